@@ -1,23 +1,62 @@
 """aria2 RPC 客户端 - 通过 JSON-RPC 与 aria2c 通信"""
 
+import asyncio
 import aiohttp
 import json
 import logging
-from typing import Optional
+import time
+from typing import Optional, Callable
+
+from app import metrics
 
 logger = logging.getLogger(__name__)
 
+# aria2 通过 WebSocket 推送的事件通知
+NOTIFICATION_METHODS = (
+    "aria2.onDownloadStart",
+    "aria2.onDownloadPause",
+    "aria2.onDownloadStop",
+    "aria2.onDownloadComplete",
+    "aria2.onDownloadError",
+    "aria2.onBtDownloadComplete",
+)
+
 
 class Aria2Client:
     """aria2 JSON-RPC 客户端"""
 
+    # 轮询只取动态字段，避免每轮传输完整的 files 列表（大种子可达数千项）
+    DYNAMIC_KEYS = ["gid", "status", "totalLength", "completedLength",
+                    "downloadSpeed", "errorCode", "errorMessage"]
+    # 静态元数据字段：确定后不再变化，每个 GID 只查询一次并缓存
+    STATIC_KEYS = ["gid", "dir", "files", "bittorrent"]
+    # 分片完成情况字段：边下边传时判断某段字节是否已下载
+    PIECE_KEYS = ["gid", "status", "totalLength", "completedLength",
+                  "pieceLength", "numPieces", "bitfield", "errorCode", "errorMessage"]
+
     def __init__(self, rpc_url: str = "http://localhost", rpc_port: int = 6800,
                  rpc_secret: str = ""):
         self.rpc_url = f"{rpc_url}:{rpc_port}/jsonrpc"
+        # WebSocket 地址：http -> ws, https -> wss
+        if rpc_url.startswith("https://"):
+            self.ws_url = "wss://" + self.rpc_url[len("https://"):]
+        elif rpc_url.startswith("http://"):
+            self.ws_url = "ws://" + self.rpc_url[len("http://"):]
+        else:
+            self.ws_url = self.rpc_url
         self.secret = rpc_secret
         self._id_counter = 0
         self._session: Optional[aiohttp.ClientSession] = None
         self._timeout = aiohttp.ClientTimeout(total=10, connect=5)
+        # WebSocket 通知通道（长连接，不设总超时）
+        self._ws_session: Optional[aiohttp.ClientSession] = None
+        self._ws_task: Optional[asyncio.Task] = None
+        self._ws_connected = False
+        self._notify_handler: Optional[Callable[[str, str], None]] = None
+        # 已停止列表的增量游标，只拉取上次同步之后新停止的任务
+        self.stopped_cursor = StoppedCursor()
+        # 静态元数据缓存：gid -> parse_meta 结果
+        self._meta_cache: dict = {}
 
     async def _get_session(self) -> aiohttp.ClientSession:
         """获取或创建复用的 HTTP 会话"""
@@ -31,6 +70,11 @@ class Aria2Client:
             await self._session.close()
             self._session = None
 
+    async def close_all(self):
+        """关闭 HTTP 会话和 WebSocket 通知通道"""
+        await self.stop_notifications()
+        await self.close()
+
     def _build_params(self, *args):
         """构建带 secret 的参数列表"""
         if self.secret:
@@ -39,24 +83,121 @@ class Aria2Client:
 
     async def _call(self, method: str, *args) -> dict:
         """发送 JSON-RPC 请求"""
+        return await self._post(method, self._build_params(*args))
+
+    async def _post(self, method: str, params: list):
+        """发送原始 JSON-RPC 请求（params 已包含 token）"""
         self._id_counter += 1
         payload = {
             "jsonrpc": "2.0",
             "id": str(self._id_counter),
             "method": method,
-            "params": self._build_params(*args)
+            "params": params
         }
+        start = time.perf_counter()
         try:
             session = await self._get_session()
             async with session.post(self.rpc_url, json=payload) as resp:
                 result = await resp.json()
                 if "error" in result:
+                    metrics.ARIA2_RPC_ERRORS.labels(method).inc()
                     raise Exception(f"aria2 RPC error: {result['error']}")
                 return result.get("result")
         except aiohttp.ClientError as e:
+            metrics.ARIA2_RPC_ERRORS.labels(method).inc()
             # 连接失败时关闭旧会话，下次重建
             await self.close()
             raise ConnectionError(f"无法连接到 aria2 RPC: {e}")
+        finally:
+            metrics.ARIA2_RPC_SECONDS.labels(method).observe(time.perf_counter() - start)
+
+    # ===========================================
+    # WebSocket 通知通道 — 下载开始/暂停/停止/完成/出错时由 aria2 主动推送
+    # ===========================================
+
+    @property
+    def notifications_connected(self) -> bool:
+        """WebSocket 通知通道是否在线"""
+        return self._ws_connected
+
+    def start_notifications(self, handler: Callable[[str, str], None]):
+        """启动 WebSocket 通知监听，断线后自动重连
+
+        handler(method, gid) 在事件循环中同步调用，不应执行耗时操作。
+        """
+        self._notify_handler = handler
+        if self._ws_task and not self._ws_task.done():
+            return
+        self._ws_task = asyncio.create_task(self._ws_loop())
+
+    async def stop_notifications(self):
+        """停止 WebSocket 通知监听"""
+        if self._ws_task and not self._ws_task.done():
+            self._ws_task.cancel()
+            try:
+                await self._ws_task
+            except asyncio.CancelledError:
+                pass
+        self._ws_task = None
+        self._ws_connected = False
+        if self._ws_session and not self._ws_session.closed:
+            await self._ws_session.close()
+        self._ws_session = None
+
+    async def _ws_loop(self):
+        """维持 WebSocket 长连接，接收事件通知"""
+        backoff = 1
+        while True:
+            try:
+                if self._ws_session is None or self._ws_session.closed:
+                    self._ws_session = aiohttp.ClientSession(
+                        timeout=aiohttp.ClientTimeout(total=None, connect=5))
+                async with self._ws_session.ws_connect(self.ws_url, heartbeat=30) as ws:
+                    self._ws_connected = True
+                    backoff = 1
+                    logger.info(f"aria2 WebSocket 通知通道已连接: {self.ws_url}")
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._dispatch_notification(msg.data)
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                logger.info("aria2 WebSocket 通知通道已断开，回退到轮询")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"aria2 WebSocket 连接失败: {e}")
+            finally:
+                self._ws_connected = False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _dispatch_notification(self, raw: str):
+        """解析通知消息并回调 handler"""
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            return
+        method = msg.get("method")
+        if method not in NOTIFICATION_METHODS or not self._notify_handler:
+            return
+        for event in msg.get("params") or []:
+            gid = event.get("gid") if isinstance(event, dict) else None
+            if gid:
+                try:
+                    self._notify_handler(method, gid)
+                except Exception as e:
+                    logger.debug(f"处理 aria2 通知失败: {e}")
+
+    def batch(self) -> "Aria2Batch":
+        """创建批量调用上下文，退出时通过 system.multicall 一次往返执行
+
+        用法:
+            async with client.batch() as batch:
+                i_active = batch.add("aria2.tellActive")
+                i_stat = batch.add("aria2.getGlobalStat")
+            active = batch.result(i_active)
+        """
+        return Aria2Batch(self)
 
     async def get_version(self) -> dict:
         """获取 aria2 版本信息"""
@@ -71,6 +212,10 @@ class Aria2Client:
         """查询下载状态"""
         return await self._call("aria2.tellStatus", gid)
 
+    async def tell_pieces(self, gid: str) -> "PieceMap":
+        """查询下载的分片完成情况"""
+        return PieceMap(await self._call("aria2.tellStatus", gid, self.PIECE_KEYS))
+
     async def pause(self, gid: str) -> str:
         """暂停下载"""
         return await self._call("aria2.pause", gid)
@@ -110,14 +255,26 @@ class Aria2Client:
         """获取等待中的下载"""
         return await self._call("aria2.tellWaiting", offset, num)
 
+    async def tell_waiting_all(self, page_size: int = 1000, offset: int = 0) -> list:
+        """分页获取所有等待中的下载"""
+        all_waiting = []
+        while True:
+            batch = await self._call("aria2.tellWaiting", offset, page_size)
+            if not batch:
+                break
+            all_waiting.extend(batch)
+            if len(batch) < page_size:
+                break
+            offset += page_size
+        return all_waiting
+
     async def tell_stopped(self, offset: int = 0, num: int = 100) -> list:
         """获取已停止的下载（含完成和出错）"""
         return await self._call("aria2.tellStopped", offset, num)
 
-    async def tell_stopped_all(self, page_size: int = 500) -> list:
+    async def tell_stopped_all(self, page_size: int = 500, offset: int = 0) -> list:
         """分页获取所有已停止的下载，避免遗漏"""
         all_stopped = []
-        offset = 0
         while True:
             batch = await self._call("aria2.tellStopped", offset, page_size)
             if not batch:
@@ -152,22 +309,49 @@ class Aria2Client:
                 "version": None
             }
 
-    @staticmethod
-    def parse_status(status: dict) -> dict:
-        """解析 aria2 下载状态为可读格式"""
-        total_length = int(status.get("totalLength", 0))
-        completed_length = int(status.get("completedLength", 0))
-        download_speed = int(status.get("downloadSpeed", 0))
-
-        progress = 0.0
-        if total_length > 0:
-            progress = round(completed_length / total_length * 100, 1)
+    # ===========================================
+    # 状态解析与元数据缓存
+    # ===========================================
+
+    def get_meta(self, gid: str) -> Optional[dict]:
+        """获取已缓存的静态元数据"""
+        return self._meta_cache.get(gid)
+
+    def forget_meta(self, gid: str):
+        """移除 GID 的元数据缓存（任务进入终态后调用）"""
+        self._meta_cache.pop(gid, None)
+
+    def remember_meta(self, status: dict) -> dict:
+        """从含静态字段的状态解析元数据，元数据已完整时写入缓存"""
+        meta = self.parse_meta(status)
+        gid = status.get("gid", "")
+        if gid and meta["complete"]:
+            self._meta_cache[gid] = meta
+        return meta
+
+    async def fetch_meta(self, gids: list) -> dict:
+        """批量查询 GID 的静态元数据（一次 multicall），返回 gid -> meta"""
+        if not gids:
+            return {}
+        async with self.batch() as batch:
+            for gid in gids:
+                batch.add("aria2.tellStatus", gid, self.STATIC_KEYS)
+        metas = {}
+        for gid, status in zip(gids, batch.results):
+            if isinstance(status, Exception) or not status:
+                continue
+            metas[gid] = self.remember_meta(status)
+        return metas
 
-        # 获取文件名和路径
+    @staticmethod
+    def parse_meta(status: dict) -> dict:
+        """解析静态元数据：文件名、本地路径、是否 BT 文件夹、来源 URI"""
+        import os
         filename = None
         file_path = ""
         is_dir = False
         dir_path = ""
+        url = ""
         files = status.get("files", [])
 
         if files:
@@ -175,6 +359,9 @@ class Aria2Client:
             if path:
                 filename = path.replace("\\", "/").split("/")[-1]
             file_path = path
+            uris = files[0].get("uris", [])
+            if uris:
+                url = uris[0].get("uri", "")
 
         # 检测 BT 多文件下载：有 bittorrent 字段且含多个文件
         bt_info = status.get("bittorrent", {})
@@ -183,7 +370,6 @@ class Aria2Client:
             all_paths = [f.get("path", "") for f in files if f.get("path")]
             if len(all_paths) > 1:
                 # 计算公共父目录
-                import os
                 common = os.path.commonpath(all_paths)
                 if common and os.path.dirname(all_paths[0]) != common or any(
                     os.path.dirname(p) != common for p in all_paths
@@ -199,6 +385,51 @@ class Aria2Client:
                     else:
                         filename = os.path.basename(common)
 
+        # 用 aria2 任务级的 dir + 文件名重新构造本地路径
+        # 不信任 files[0].path 中的目录部分（aria2 可能返回错误的目录）
+        task_dir = status.get("dir", "")
+        bt_name = bt_info.get("info", {}).get("name", "") if bt_info else ""
+        if bt_name and task_dir:
+            # BT 下载：dir + bt_name
+            file_path = os.path.join(task_dir, bt_name)
+            filename = bt_name
+        elif task_dir and filename:
+            # 非 BT 下载：dir + filename
+            file_path = os.path.join(task_dir, filename)
+
+        # 元数据是否已确定：BT 需拿到种子信息（磁力链接解析前没有 info），
+        # 普通下载需 aria2 已确定输出文件路径
+        if bt_info:
+            complete = bool(bt_name)
+        else:
+            complete = bool(files and files[0].get("path"))
+
+        return {
+            "filename": filename,
+            "file_path": file_path,
+            "is_dir": is_dir,
+            "dir_path": dir_path,
+            "url": url,
+            "complete": complete,
+        }
+
+    @staticmethod
+    def parse_status(status: dict, meta: Optional[dict] = None) -> dict:
+        """解析 aria2 下载状态为可读格式
+
+        meta 为缓存的静态元数据；不传时从 status 中的 files/bittorrent 字段解析。
+        """
+        total_length = int(status.get("totalLength", 0))
+        completed_length = int(status.get("completedLength", 0))
+        download_speed = int(status.get("downloadSpeed", 0))
+
+        progress = 0.0
+        if total_length > 0:
+            progress = round(completed_length / total_length * 100, 1)
+
+        if meta is None:
+            meta = Aria2Client.parse_meta(status)
+
         return {
             "status": status.get("status", "unknown"),
             "progress": progress,
@@ -207,14 +438,166 @@ class Aria2Client:
             "download_speed": download_speed,
             "speed_str": _format_speed(download_speed),
             "file_size": _format_size(total_length),
-            "filename": filename,
-            "file_path": file_path,
-            "is_dir": is_dir,
-            "dir_path": dir_path,
+            "filename": meta["filename"],
+            "file_path": meta["file_path"],
+            "is_dir": meta["is_dir"],
+            "dir_path": meta["dir_path"],
+            "url": meta["url"],
             "gid": status.get("gid", "")
         }
 
 
+class PieceMap:
+    """aria2 下载的分片完成情况
+
+    bitfield 为十六进制字符串，最高位对应第 0 个分片，每个分片 pieceLength 字节。
+    """
+
+    def __init__(self, status: dict):
+        self.status = status.get("status", "")
+        self.total_length = int(status.get("totalLength", 0))
+        self.completed_length = int(status.get("completedLength", 0))
+        self.piece_length = int(status.get("pieceLength", 0))
+        self.error = status.get("errorMessage", "")
+        bitfield = status.get("bitfield", "")
+        self._bits = int(bitfield, 16) if bitfield else 0
+        self._nbits = len(bitfield) * 4
+
+    @property
+    def complete(self) -> bool:
+        return self.status == "complete"
+
+    def has_range(self, offset: int, size: int) -> bool:
+        """[offset, offset + size) 覆盖的分片是否都已下载完成"""
+        if self.complete:
+            return True
+        if self.piece_length <= 0 or size <= 0:
+            return False
+        first = offset // self.piece_length
+        last = (offset + size - 1) // self.piece_length
+        if last >= self._nbits:
+            return False
+        width = last - first + 1
+        mask = ((1 << width) - 1) << (self._nbits - 1 - last)
+        return self._bits & mask == mask
+
+
+class StoppedCursor:
+    """已停止列表的增量游标
+
+    aria2 的 getGlobalStat 返回 numStoppedTotal（本次会话累计停止数，不受
+    max-download-result 截断影响），新停止的任务总是追加在列表末尾。
+    记住上次消费到的 numStoppedTotal，每轮只需用负 offset 从末尾取
+    差值条数即可，无需反复分页拉取整个历史。
+    """
+
+    # 每轮同步时随 multicall 一起预取的末尾条数，覆盖绝大多数情况，避免额外往返
+    WINDOW = 20
+
+    def __init__(self):
+        self.seen_total: Optional[int] = None
+
+    def reset(self):
+        """重置游标，下次同步时全量拉取"""
+        self.seen_total = None
+
+    def window(self) -> int:
+        """本轮预取条数（首次同步需全量拉取，不预取）"""
+        return self.WINDOW if self.seen_total is not None else 0
+
+    def _pending(self, stat: dict) -> int:
+        """根据全局统计计算尚未消费的条数"""
+        total = int(stat.get("numStoppedTotal", 0))
+        available = int(stat.get("numStopped", 0))
+        if self.seen_total is None or total < self.seen_total:
+            # 首次同步或 aria2 重启（计数归零）：全量
+            return available
+        return min(total - self.seen_total, available)
+
+    async def consume(self, client: "Aria2Client", stat: dict, latest: list,
+                      keys: Optional[list] = None) -> list:
+        """返回新停止的任务（按停止先后排序）并推进游标
+
+        Args:
+            stat: 与 latest 同一批 multicall 取得的 getGlobalStat 结果
+            latest: tellStopped(-1, window()) 的结果（从新到旧）
+            keys: 补拉时传给 tellStopped 的字段投影
+        """
+        latest = latest or []
+        need = self._pending(stat)
+        while need > len(latest):
+            # 预取不够：在同一次 multicall 中重新取统计和末尾 need 条，保证一致
+            async with client.batch() as batch:
+                i_stat = batch.add("aria2.getGlobalStat")
+                if keys:
+                    i_stopped = batch.add("aria2.tellStopped", -1, need, keys)
+                else:
+                    i_stopped = batch.add("aria2.tellStopped", -1, need)
+            stat = batch.result(i_stat) or {}
+            latest = batch.result(i_stopped) or []
+            new_need = self._pending(stat)
+            if new_need <= len(latest) or len(latest) < need:
+                need = min(new_need, len(latest))
+                break
+            need = new_need
+        self.seen_total = int(stat.get("numStoppedTotal", 0))
+        new_items = latest[:need]
+        new_items.reverse()
+        return new_items
+
+
+class Aria2Batch:
+    """system.multicall 批量调用：收集多个 RPC 调用，一次往返执行，结果按添加顺序返回"""
+
+    def __init__(self, client: Aria2Client):
+        self._client = client
+        self._calls: list = []
+        self.results: list = []
+
+    def add(self, method: str, *args) -> int:
+        """添加一个调用，返回其结果下标"""
+        self._calls.append({
+            "methodName": method,
+            "params": self._client._build_params(*args)
+        })
+        return len(self._calls) - 1
+
+    async def execute(self) -> list:
+        """执行所有已收集的调用
+
+        单个调用失败不影响其他调用，失败项在 results 中为 Exception 实例。
+        """
+        calls, self._calls = self._calls, []
+        if not calls:
+            self.results = []
+            return self.results
+        # system.multicall 本身不需要 token，token 已放在每个子调用的 params 中
+        raw = await self._client._post("system.multicall", [calls]) or []
+        results = []
+        for item in raw:
+            # 成功项为单元素数组，失败项为 {code, message} 结构
+            if isinstance(item, list):
+                results.append(item[0] if item else None)
+            else:
+                results.append(Exception(f"aria2 RPC error: {item}"))
+        self.results = results
+        return results
+
+    def result(self, index: int):
+        """取出第 index 个调用的结果，失败项抛出对应异常"""
+        value = self.results[index]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    async def __aenter__(self) -> "Aria2Batch":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.execute()
+
+
 def _format_speed(speed: int) -> str:
     """格式化速度"""
     if speed < 1024:
@@ -1,38 +1,170 @@
-"""认证模块 - 简单的 Token 会话管理"""
+"""认证模块 - HMAC 签名的无状态会话 token
 
+token 格式: v1.<过期时间戳>.<随机 id>.<签名>
+签名 = HMAC-SHA256(签名密钥, "v1.<过期时间戳>.<随机 id>")
+
+签名密钥由服务端密钥和当前用户名/密码派生：修改凭据后旧 token 全部失效。
+验证只需一次 HMAC 计算，不依赖进程内状态，重启或多进程部署均可直接验证。
+主动退出的 token 记入撤销列表（持久化在数据库，过期后清理）。
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
 import secrets
-from app.config import load_config
+import time
+from typing import Dict, Optional
+
+from app import config as app_config
+from app import database as db
+
+logger = logging.getLogger(__name__)
 
-# 内存中的活跃 token 集合，重启后需重新登录
-_active_tokens: set[str] = set()
+TOKEN_VERSION = "v1"
+# 未配置 auth.secret_key 时使用的密钥文件（多个 worker 共享同一文件）
+SECRET_FILE = app_config.CONFIG_FILE.parent / "auth_secret.key"
+
+# 密钥文件内容（启动时由 load_secret() 在线程中读取）
+_file_secret: Optional[bytes] = None
+# 派生的签名密钥（凭据或密钥变更时清空）
+_signing_key: Optional[bytes] = None
+# 撤销列表：token 随机 id -> 过期时间戳
+_revoked: Dict[str, int] = {}
 
 
 def is_auth_enabled() -> bool:
-    """检查是否启用了认证"""
-    config = load_config()
-    auth = config.get("auth", {})
+    """检查是否启用了认证（读取进程级缓存，不访问磁盘）"""
+    auth = app_config.get_config().get("auth", {})
     return bool(auth.get("username")) and bool(auth.get("password"))
 
 
 def verify_credentials(username: str, password: str) -> bool:
     """验证用户名密码"""
-    config = load_config()
-    auth = config.get("auth", {})
-    return username == auth.get("username") and password == auth.get("password")
+    auth = app_config.get_config().get("auth", {})
+    return (hmac.compare_digest(username.encode(), str(auth.get("username", "")).encode())
+            and hmac.compare_digest(password.encode(), str(auth.get("password", "")).encode()))
+
+
+# ===========================================
+# 签名密钥
+# ===========================================
+
+def _read_secret_file() -> bytes:
+    """读取密钥文件，不存在时生成（阻塞调用，可能等待其他进程写入）"""
+    try:
+        # O_EXCL：多个 worker 同时启动时只有一个能创建，其余读取同一份
+        fd = os.open(SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        secret = SECRET_FILE.read_bytes().strip()
+        if secret:
+            return secret
+        # 另一个进程刚创建、尚未写入
+        time.sleep(0.1)
+        return SECRET_FILE.read_bytes().strip()
+    secret = secrets.token_hex(32).encode()
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    logger.info(f"已生成会话签名密钥: {SECRET_FILE}")
+    return secret
+
+
+def _load_secret() -> bytes:
+    """服务端密钥：auth.secret_key > 密钥文件"""
+    global _file_secret
+    configured = app_config.get_config().get("auth", {}).get("secret_key", "")
+    if configured:
+        return configured.encode()
+    if _file_secret is None:
+        # 未经 load_secret() 预加载（如运行中清空了 secret_key）时才在此同步读取
+        _file_secret = _read_secret_file()
+    return _file_secret
+
+
+async def load_secret() -> None:
+    """启动时预加载密钥文件：文件读写和等待并发创建者都在线程中完成，不阻塞事件循环"""
+    global _file_secret
+    if app_config.get_config().get("auth", {}).get("secret_key", ""):
+        return
+    _file_secret = await asyncio.to_thread(_read_secret_file)
+
+
+def _get_signing_key() -> bytes:
+    global _signing_key
+    if _signing_key is None:
+        auth = app_config.get_config().get("auth", {})
+        credentials = f"{auth.get('username', '')}\0{auth.get('password', '')}"
+        _signing_key = hmac.new(_load_secret(), credentials.encode(),
+                                hashlib.sha256).digest()
+    return _signing_key
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(_get_signing_key(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def _on_auth_config_changed(config: dict, changed: set):
+    """用户名、密码或密钥变更：重新派生签名密钥，已签发的 token 全部失效"""
+    global _signing_key
+    _signing_key = None
+
+
+app_config.subscribe(_on_auth_config_changed, sections=("auth",))
+
+
+# ===========================================
+# token
+# ===========================================
+
+def token_ttl() -> int:
+    return int(app_config.get_config().get("auth", {}).get("token_ttl", 86400 * 7))
 
 
 def create_token() -> str:
-    """生成新的会话 token"""
-    token = secrets.token_hex(32)
-    _active_tokens.add(token)
-    return token
+    """签发新的会话 token"""
+    expires = int(time.time()) + token_ttl()
+    payload = f"{TOKEN_VERSION}.{expires}.{secrets.token_urlsafe(12)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def _parse_token(token: str) -> Optional[tuple]:
+    """校验签名和有效期，返回 (随机 id, 过期时间戳)，无效返回 None"""
+    try:
+        version, expires, token_id, signature = token.split(".")
+        expires = int(expires)
+    except ValueError:
+        return None
+    if version != TOKEN_VERSION or expires <= time.time():
+        return None
+    expected = _sign(f"{version}.{expires}.{token_id}")
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    return token_id, expires
 
 
 def verify_token(token: str) -> bool:
     """验证 token 是否有效"""
-    return token in _active_tokens
+    parsed = _parse_token(token)
+    return parsed is not None and parsed[0] not in _revoked
+
+
+async def revoke_token(token: str) -> None:
+    """撤销 token（退出登录），持久化后重启和其他进程同步时仍然有效"""
+    parsed = _parse_token(token)
+    if parsed is None:
+        return
+    token_id, expires = parsed
+    _revoked[token_id] = expires
+    await db.add_revoked_token(token_id, expires)
 
 
-def revoke_token(token: str) -> None:
-    """撤销 token"""
-    _active_tokens.discard(token)
+async def sync_revocations() -> None:
+    """从数据库加载撤销列表（启动时及定期调用），同时清理已过期的记录"""
+    global _revoked
+    now = int(time.time())
+    loaded = await db.load_revoked_tokens(now)
+    # 合并而非替换：同步期间本进程新撤销的 token 可能尚未读到
+    _revoked = {k: v for k, v in {**_revoked, **loaded}.items() if v > now}
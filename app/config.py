@@ -1,18 +1,35 @@
-"""配置管理模块 - 从 config.toml 加载和保存配置"""
+"""配置管理模块 - 从 config.toml 加载和保存配置
 
+配置在进程内缓存，按文件 mtime + 大小判断是否需要重新解析。
+文件变化（设置页保存或手动编辑）后，订阅者只收到发生变化的 section。
+"""
+
+import asyncio
+import logging
 import os
 from pathlib import Path
+from typing import Callable, Iterable, Optional
 
 try:
     import tomllib  # Python 3.11+
 except ModuleNotFoundError:
     import tomli as tomllib  # Python < 3.11 回退
 
+try:
+    import watchfiles  # 可选依赖：inotify 等系统通知，未安装时轮询
+except ImportError:
+    watchfiles = None
+
+logger = logging.getLogger(__name__)
+
 CONFIG_FILE = Path(os.environ.get("CONFIG_PATH", Path(__file__).parent.parent / "config.toml"))
 
 DEFAULT_CONFIG = {
     "server": {
-        "port": 8000
+        "port": 8000,
+        "ws_compression": True,
+        "config_watch": True,
+        "loop_lag_threshold": 0.25
     },
     "aria2": {
         "rpc_url": "http://localhost",
@@ -28,9 +45,17 @@ DEFAULT_CONFIG = {
         "channel_id": 0,
         "chunk_size": "500M",
         "upload_concurrency": 4,
+        "file_concurrency": 3,
         "upload_dir": "",
         "random_chunk_name": True,
-        "target_path": "/"
+        "pipelined_upload": False,
+        "dir_cache_ttl": 300,
+        "content_dedup": False,
+        "target_path": "/",
+        "pool_limit": 100,
+        "pool_limit_per_host": 0,
+        "dns_cache_ttl": 300,
+        "keepalive_timeout": 30
     },
     "general": {
         "max_retries": 3,
@@ -40,7 +65,9 @@ DEFAULT_CONFIG = {
     },
     "auth": {
         "username": "",
-        "password": ""
+        "password": "",
+        "secret_key": "",
+        "token_ttl": 604800
     }
 }
 
@@ -117,37 +144,161 @@ def _apply_env_overrides(config: dict) -> dict:
     return config
 
 
-def load_config() -> dict:
-    """加载配置，优先级: 环境变量 > config.toml > 默认值"""
+# ===========================================
+# 进程级配置缓存
+# ===========================================
+
+# 当前配置（只读共享，修改请用 load_config 返回的副本）
+_config: Optional[dict] = None
+# 解析 _config 时文件的 (mtime_ns, size)，None 表示文件不存在
+_stamp: Optional[tuple] = None
+# [(回调, 关注的 section 集合或 None)]
+_subscribers: list = []
+
+
+def _copy(config: dict) -> dict:
+    return {k: dict(v) if isinstance(v, dict) else v for k, v in config.items()}
+
+
+def _file_stamp() -> Optional[tuple]:
+    try:
+        st = CONFIG_FILE.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_config() -> dict:
+    """解析配置文件，优先级: 环境变量 > config.toml > 默认值（解析失败时抛出异常）"""
+    with open(CONFIG_FILE, "rb") as f:
+        config = tomllib.load(f)
+    # 合并默认值（确保新增字段有默认值）
+    merged = _copy(DEFAULT_CONFIG)
+    for section in merged:
+        if section in config:
+            merged[section].update(config[section])
+    # 环境变量覆盖
+    return _apply_env_overrides(merged)
+
+
+def refresh_config(force: bool = False) -> set:
+    """文件 mtime 或大小变化时重新解析，并通知订阅者
+
+    Returns:
+        发生变化的 section 名集合
+    """
+    global _config, _stamp
     if not CONFIG_FILE.exists():
-        save_config(DEFAULT_CONFIG)
-        config = DEFAULT_CONFIG.copy()
-    else:
+        _write_file(DEFAULT_CONFIG)
+    stamp = _file_stamp()
+    if _config is not None and stamp == _stamp and not force:
+        return set()
+    try:
+        new = _read_config()
+    except Exception as e:
+        if _config is not None:
+            # 手动编辑到一半的文件：保留当前配置，等下次保存
+            logger.warning(f"配置文件解析失败，沿用当前配置: {e}")
+            _stamp = stamp
+            return set()
+        new = _apply_env_overrides(_copy(DEFAULT_CONFIG))
+    old, _config, _stamp = _config, new, stamp
+    if old is None:
+        return set()
+    changed = {s for s in old.keys() | new.keys() if old.get(s) != new.get(s)}
+    if changed:
+        logger.info(f"配置已更新: {', '.join(sorted(changed))}")
+        _notify(changed)
+    return changed
+
+
+def get_config() -> dict:
+    """返回进程级缓存的配置（不访问磁盘，调用方不得修改）
+
+    由 watcher 或 save_config 负责刷新，适合每个请求都要读取的热路径。
+    """
+    if _config is None:
+        refresh_config()
+    return _config
+
+
+def load_config() -> dict:
+    """加载配置（返回可修改的副本），文件未变化时不重新解析"""
+    refresh_config()
+    return _copy(_config)
+
+
+def subscribe(callback: Callable[[dict, set], None],
+              sections: Optional[Iterable[str]] = None) -> None:
+    """订阅配置变化：callback(新配置, 变化的 section 集合)
+
+    sections 不为空时只在这些 section 变化时回调。
+    """
+    _subscribers.append((callback, set(sections) if sections else None))
+
+
+def unsubscribe(callback: Callable[[dict, set], None]) -> None:
+    _subscribers[:] = [(cb, s) for cb, s in _subscribers if cb != callback]
+
+
+def _notify(changed: set):
+    for callback, sections in list(_subscribers):
+        relevant = changed if sections is None else changed & sections
+        if not relevant:
+            continue
         try:
-            with open(CONFIG_FILE, "rb") as f:
-                config = tomllib.load(f)
-            # 合并默认值（确保新增字段有默认值）
-            merged = {k: dict(v) for k, v in DEFAULT_CONFIG.items()}
-            for section in merged:
-                if section in config:
-                    merged[section].update(config[section])
-            config = merged
-        except (Exception, IOError):
-            config = DEFAULT_CONFIG.copy()
-    # 环境变量覆盖
-    return _apply_env_overrides(config)
+            callback(_config, relevant)
+        except Exception as e:
+            logger.error(f"配置变更回调失败: {e}", exc_info=True)
+
+
+def _write_file(config: dict) -> None:
+    CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
+        f.write(_write_toml(config))
 
 
 def save_config(config: dict) -> None:
-    """保存配置到文件（合并模式：保留未传入的 section）"""
+    """保存配置到文件（合并模式：保留未传入的 section），并立即通知订阅者"""
     # 先读取现有配置，合并后再写入
     existing = load_config() if CONFIG_FILE.exists() else {}
     for section, values in config.items():
         if isinstance(values, dict):
             existing[section] = values
-    CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-        f.write(_write_toml(existing))
+    _write_file(existing)
+    # 同一时钟刻度内的写入 mtime 可能不变，强制重新解析
+    refresh_config(force=True)
+
+
+# ===========================================
+# 配置文件监听
+# ===========================================
+
+# 轮询间隔（秒），未安装 watchfiles 时使用
+WATCH_POLL_INTERVAL = 2.0
+
+
+async def watch_config(poll_interval: float = WATCH_POLL_INTERVAL):
+    """监听配置文件变化并刷新缓存（手动编辑 config.toml 后无需重启）"""
+    if watchfiles is not None:
+        logger.info("配置文件监听已启动 (watchfiles)")
+        # 监听所在目录：编辑器常以“写临时文件 + 重命名”的方式保存
+        async for _ in watchfiles.awatch(
+                CONFIG_FILE.parent, recursive=False,
+                watch_filter=lambda change, path: Path(path).name == CONFIG_FILE.name):
+            _refresh_safely()
+    else:
+        logger.info(f"配置文件监听已启动 (每 {poll_interval}s 轮询)")
+        while True:
+            await asyncio.sleep(poll_interval)
+            _refresh_safely()
+
+
+def _refresh_safely():
+    try:
+        refresh_config()
+    except Exception as e:
+        logger.warning(f"刷新配置失败: {e}")
 
 
 def get_aria2_rpc_url(config: dict) -> str:
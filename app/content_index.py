@@ -0,0 +1,141 @@
+"""内容索引 - 按内容哈希复用 TelDrive 上已有文件的 parts，跳过重复上传
+
+查找分三级，逐级变贵，任一级不命中即放弃：
+1. 大小：数据库中没有同样大小的文件（绝大多数情况），不读文件
+2. 部分哈希：只读首/中/尾各 1MB
+3. 完整哈希：读全文件，大文件在进程池中计算
+
+未命中的文件正常上传，同时在后台计算完整哈希，上传成功后写入索引。
+哈希计算全部在事件循环之外执行。
+"""
+
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from app import database as db
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_BLOCK = 1024 * 1024
+HASH_BLOCK = 4 * 1024 * 1024
+# 超过该大小的文件在进程池中计算完整哈希，避免长时间占用线程池和 GIL 竞争
+PROCESS_POOL_THRESHOLD = 256 * 1024 * 1024
+
+# (完整哈希, 部分哈希)
+Digest = Tuple[str, str]
+
+
+def partial_hash(path: str, size: int) -> str:
+    """文件大小 + 首/中/尾各 1MB 的 SHA-256"""
+    h = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= PARTIAL_BLOCK * 3:
+            h.update(f.read())
+        else:
+            for offset in (0, size // 2, size - PARTIAL_BLOCK):
+                f.seek(offset)
+                h.update(f.read(PARTIAL_BLOCK))
+    return h.hexdigest()
+
+
+def full_hash(path: str) -> str:
+    """流式计算完整文件的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_file(path: str, size: int) -> Digest:
+    """计算 (完整哈希, 部分哈希)，可在子进程中执行"""
+    return full_hash(path), partial_hash(path, size)
+
+
+class ContentIndex:
+    """内容哈希索引 + 哈希计算执行器"""
+
+    def __init__(self, process_workers: int = 2):
+        self.process_workers = process_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.stats = {
+            "lookups": 0,
+            "size_hits": 0,
+            "partial_hits": 0,
+            "full_hits": 0,
+            "stale": 0,
+            "reused": 0,
+            "reused_bytes": 0,
+            "indexed": 0,
+        }
+
+    def _executor(self, size: int) -> Optional[ProcessPoolExecutor]:
+        if size < PROCESS_POOL_THRESHOLD:
+            return None  # 默认线程池（hashlib 处理大块数据时释放 GIL）
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.process_workers)
+        return self._pool
+
+    async def digest(self, path: str, size: int) -> Digest:
+        """计算文件的 (完整哈希, 部分哈希)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(size), hash_file, path, size)
+
+    def start_digest(self, path: str, size: int) -> asyncio.Task:
+        """在后台计算哈希，与上传并行进行"""
+        task = asyncio.ensure_future(self.digest(path, size))
+        # 上传失败时结果无人读取，避免 "exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def lookup(self, path: str, size: int) -> Tuple[Optional[dict], Optional[Digest]]:
+        """查找内容相同的已上传文件
+
+        Returns:
+            (命中的索引记录或 None, 已算出的哈希或 None)。
+            未命中但已算出完整哈希时一并返回，上传后记录索引无需再算一次。
+        """
+        self.stats["lookups"] += 1
+        if size <= 0 or not await db.has_content_size(size):
+            return None, None
+        self.stats["size_hits"] += 1
+
+        loop = asyncio.get_running_loop()
+        partial = await loop.run_in_executor(None, partial_hash, path, size)
+        candidates = await db.find_content(size, partial)
+        if not candidates:
+            return None, None
+        self.stats["partial_hits"] += 1
+
+        digest = await self.digest(path, size)
+        for row in candidates:
+            if row["content_hash"] == digest[0]:
+                self.stats["full_hits"] += 1
+                return row, digest
+        return None, digest
+
+    async def record(self, digest: Digest, size: int, file_id: str,
+                     name: str, teldrive_path: str, parts: list):
+        """上传成功后记录内容对应的 TelDrive 文件"""
+        await db.save_content(digest[0], size, digest[1], file_id,
+                              name, teldrive_path, parts)
+        self.stats["indexed"] += 1
+
+    async def forget(self, row: dict):
+        """源文件已不存在，删除索引记录"""
+        self.stats["stale"] += 1
+        await db.delete_content(row["content_hash"], row["file_size"])
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
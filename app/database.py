@@ -1,10 +1,14 @@
 """数据库模块 - SQLite 异步操作（连接池模式）"""
 
 import aiosqlite
+import json
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 import logging
 import asyncio
+import time
+
+from app import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -30,9 +34,53 @@ CREATE TABLE IF NOT EXISTS tasks (
 )
 """
 
+# 上传会话：记录每个任务/文件的 upload_id 和已确认的 part，用于跨重试/重启续传
+CREATE_UPLOAD_SESSIONS_SQL = """
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    task_id TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    upload_id TEXT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    file_mtime REAL DEFAULT 0,
+    parts TEXT DEFAULT '[]',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (task_id, file_path)
+)
+"""
+
+# 内容索引：内容哈希 + 大小 -> TelDrive 上已有的文件及其 parts，用于跳过重复上传
+CREATE_CONTENT_INDEX_SQL = """
+CREATE TABLE IF NOT EXISTS content_index (
+    content_hash TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    partial_hash TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    name TEXT,
+    teldrive_path TEXT,
+    parts TEXT DEFAULT '[]',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (content_hash, file_size)
+)
+"""
+
+# 已撤销的会话 token（退出登录），过期后清理
+CREATE_REVOKED_TOKENS_SQL = """
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token_id TEXT PRIMARY KEY,
+    expires_at INTEGER NOT NULL
+)
+"""
+
 # 全局连接实例（复用，避免每次操作都开关连接）
 _db_conn: Optional[aiosqlite.Connection] = None
 
+# 写合并：进度类更新先在内存合并，按间隔或数量阈值批量落盘
+FLUSH_INTERVAL = 0.5        # 最长合并时间（秒）
+FLUSH_THRESHOLD = 200       # 待写任务数达到阈值时立即落盘
+CHECKPOINT_INTERVAL = 60.0  # WAL 被动 checkpoint 间隔（秒）
+
 
 async def _get_conn() -> aiosqlite.Connection:
     """获取或创建全局数据库连接"""
@@ -65,13 +113,35 @@ async def init_db():
     # 为 aria2_gid 创建索引，加速按 GID 查询
     await conn.execute(
         "CREATE INDEX IF NOT EXISTS idx_tasks_gid ON tasks(aria2_gid)")
+    # 任务列表分页：每个排序列都有 (排序列, task_id) 和 (status, 排序列, task_id)
+    # 两个索引，keyset 翻页与状态过滤都不需要临时排序
+    for column in TASK_SORT_COLUMNS:
+        suffix = column[:-3] if column.endswith("_at") else column
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_tasks_{suffix} ON tasks({column}, task_id)")
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_tasks_status_{suffix} "
+            f"ON tasks(status, {column}, task_id)")
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_filename ON tasks(filename)")
+    await conn.execute(CREATE_UPLOAD_SESSIONS_SQL)
+    await conn.execute(CREATE_CONTENT_INDEX_SQL)
+    # 预检查按 大小 + 部分哈希 查找候选
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_content_size ON content_index(file_size, partial_hash)")
+    await conn.execute(CREATE_REVOKED_TOKENS_SQL)
     await conn.commit()
 
 
 async def close_db():
-    """关闭数据库连接"""
+    """关闭数据库连接（先落盘待写更新并截断 WAL）"""
     global _db_conn
+    await _writer.stop()
     if _db_conn is not None:
+        try:
+            await _db_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logger.debug(f"WAL checkpoint 失败: {e}")
         await _db_conn.close()
         _db_conn = None
 
@@ -111,11 +181,72 @@ async def get_all_tasks() -> list:
         return [dict(row) for row in rows]
 
 
-async def update_task(task_id: str, **kwargs) -> None:
-    """更新任务字段（轻量版，不返回更新后的任务）"""
+# 允许排序的列（时间戳与数值列）
+TASK_SORT_COLUMNS = ("created_at", "updated_at", "download_progress", "upload_progress")
+
+
+async def query_tasks(statuses: Optional[list] = None,
+                      created_after: Optional[str] = None,
+                      created_before: Optional[str] = None,
+                      filename_prefix: Optional[str] = None,
+                      sort: str = "created_at", descending: bool = True,
+                      limit: int = 100, after: Optional[tuple] = None) -> list:
+    """按条件分页查询任务（keyset 分页）
+
+    Args:
+        statuses: 状态过滤
+        created_after / created_before: 创建时间范围 [after, before)，格式 YYYY-MM-DD HH:MM:SS
+        filename_prefix: 文件名前缀（区间查询，可走索引）
+        sort: 排序列，见 TASK_SORT_COLUMNS；task_id 作为第二排序键保证顺序稳定
+        after: 上一页最后一行的 (排序值, task_id)，None 表示第一页
+    """
+    if sort not in TASK_SORT_COLUMNS:
+        raise ValueError(f"不支持的排序列: {sort}")
+    where, params = [], []
+    if statuses:
+        where.append(f"status IN ({', '.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if created_after:
+        where.append("created_at >= ?")
+        params.append(created_after)
+    if created_before:
+        where.append("created_at < ?")
+        params.append(created_before)
+    if filename_prefix:
+        where.append("filename >= ? AND filename < ?")
+        params.extend((filename_prefix, filename_prefix + "\U0010ffff"))
+    if after is not None:
+        where.append(f"({sort}, task_id) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+
+    order = "DESC" if descending else "ASC"
+    sql = "SELECT * FROM tasks"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {sort} {order}, task_id {order} LIMIT ?"
+    params.append(limit)
+
+    conn = await _get_conn()
+    async with conn.execute(sql, params) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+async def update_task(task_id: str, flush: bool = False, **kwargs) -> None:
+    """更新任务字段（轻量版，不返回更新后的任务）
+
+    写合并器运行时，更新先合并到内存，由后台批量提交；
+    flush=True（状态迁移）时立即落盘。
+    """
     if not kwargs:
         return
 
+    if _writer.running:
+        _writer.queue(task_id, kwargs)
+        if flush:
+            await _writer.flush()
+        return
+
     fields = ", ".join(f"{k} = ?" for k in kwargs)
     values = list(kwargs.values())
     values.append(task_id)
@@ -130,6 +261,7 @@ async def update_task(task_id: str, **kwargs) -> None:
 
 async def delete_task(task_id: str) -> bool:
     """删除任务记录"""
+    _writer.discard(task_id)
     conn = await _get_conn()
     cursor = await conn.execute(
         "DELETE FROM tasks WHERE task_id = ?", (task_id,)
@@ -158,3 +290,334 @@ async def get_task_by_gid(gid: str) -> Optional[dict]:
         if row:
             return dict(row)
     return None
+
+
+# ===========================================
+# 上传会话（断点续传）
+# ===========================================
+
+def _parts_row(row) -> dict:
+    data = dict(row)
+    try:
+        data["parts"] = json.loads(data.get("parts") or "[]")
+    except ValueError:
+        data["parts"] = []
+    return data
+
+
+async def get_upload_session(task_id: str, file_path: str) -> Optional[dict]:
+    """获取某个任务文件的上传会话"""
+    conn = await _get_conn()
+    async with conn.execute(
+        "SELECT * FROM upload_sessions WHERE task_id = ? AND file_path = ?",
+        (task_id, file_path)
+    ) as cursor:
+        row = await cursor.fetchone()
+        if row:
+            return _parts_row(row)
+    return None
+
+
+async def get_upload_sessions(task_id: str) -> list:
+    """获取任务的全部上传会话"""
+    conn = await _get_conn()
+    async with conn.execute(
+        "SELECT * FROM upload_sessions WHERE task_id = ?", (task_id,)
+    ) as cursor:
+        rows = await cursor.fetchall()
+        return [_parts_row(row) for row in rows]
+
+
+async def save_upload_session(task_id: str, file_path: str, upload_id: str,
+                              chunk_size: int, file_size: int,
+                              file_mtime: float, parts: list = None) -> None:
+    """新建或覆盖上传会话"""
+    conn = await _get_conn()
+    await conn.execute(
+        """INSERT OR REPLACE INTO upload_sessions
+           (task_id, file_path, upload_id, chunk_size, file_size, file_mtime, parts)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (task_id, file_path, upload_id, chunk_size, file_size, file_mtime,
+         json.dumps(sorted(parts or [])))
+    )
+    await conn.commit()
+
+
+async def update_upload_session_parts(task_id: str, file_path: str, parts: list) -> None:
+    """更新上传会话中已确认的 part 清单"""
+    conn = await _get_conn()
+    await conn.execute(
+        """UPDATE upload_sessions SET parts = ?, updated_at = CURRENT_TIMESTAMP
+           WHERE task_id = ? AND file_path = ?""",
+        (json.dumps(sorted(parts)), task_id, file_path)
+    )
+    await conn.commit()
+
+
+async def delete_upload_session(task_id: str, file_path: str) -> None:
+    """删除单个上传会话"""
+    conn = await _get_conn()
+    await conn.execute(
+        "DELETE FROM upload_sessions WHERE task_id = ? AND file_path = ?",
+        (task_id, file_path)
+    )
+    await conn.commit()
+
+
+async def delete_upload_sessions(task_id: str) -> None:
+    """删除任务的全部上传会话"""
+    conn = await _get_conn()
+    await conn.execute(
+        "DELETE FROM upload_sessions WHERE task_id = ?", (task_id,)
+    )
+    await conn.commit()
+
+
+# ===========================================
+# 内容索引（去重）
+# ===========================================
+
+async def has_content_size(file_size: int) -> bool:
+    """是否存在该大小的已索引文件（最廉价的预检查）"""
+    conn = await _get_conn()
+    async with conn.execute(
+        "SELECT 1 FROM content_index WHERE file_size = ? LIMIT 1", (file_size,)
+    ) as cursor:
+        return await cursor.fetchone() is not None
+
+
+async def find_content(file_size: int, partial_hash: str) -> list:
+    """按 大小 + 部分哈希 查找候选文件"""
+    conn = await _get_conn()
+    async with conn.execute(
+        "SELECT * FROM content_index WHERE file_size = ? AND partial_hash = ?",
+        (file_size, partial_hash)
+    ) as cursor:
+        rows = await cursor.fetchall()
+        return [_parts_row(row) for row in rows]
+
+
+async def save_content(content_hash: str, file_size: int, partial_hash: str,
+                       file_id: str, name: str, teldrive_path: str, parts: list) -> None:
+    """记录（或覆盖）内容对应的 TelDrive 文件"""
+    conn = await _get_conn()
+    await conn.execute(
+        """INSERT OR REPLACE INTO content_index
+           (content_hash, file_size, partial_hash, file_id, name, teldrive_path, parts)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (content_hash, file_size, partial_hash, file_id, name, teldrive_path,
+         json.dumps(parts))
+    )
+    await conn.commit()
+
+
+async def delete_content(content_hash: str, file_size: int) -> None:
+    """删除失效的内容索引（源文件已不存在）"""
+    conn = await _get_conn()
+    await conn.execute(
+        "DELETE FROM content_index WHERE content_hash = ? AND file_size = ?",
+        (content_hash, file_size)
+    )
+    await conn.commit()
+
+
+# ===========================================
+# 会话撤销
+# ===========================================
+
+async def add_revoked_token(token_id: str, expires_at: int) -> None:
+    """记录已撤销的 token"""
+    conn = await _get_conn()
+    await conn.execute(
+        "INSERT OR REPLACE INTO revoked_tokens (token_id, expires_at) VALUES (?, ?)",
+        (token_id, expires_at)
+    )
+    await conn.commit()
+
+
+async def load_revoked_tokens(now: int) -> dict:
+    """清理已过期的记录，返回 {token_id: expires_at}"""
+    conn = await _get_conn()
+    await conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,))
+    await conn.commit()
+    async with conn.execute("SELECT token_id, expires_at FROM revoked_tokens") as cursor:
+        return {row["token_id"]: row["expires_at"] for row in await cursor.fetchall()}
+
+
+# ===========================================
+# 写合并器 — 合并同一任务的多次更新，一次事务批量提交
+# ===========================================
+
+class _TaskWriter:
+    """任务更新的写合并器（write-behind）"""
+
+    def __init__(self):
+        self._pending: dict = {}  # task_id -> 合并后的字段
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._last_checkpoint = 0.0
+        self.stats = {
+            "queued": 0,          # 入队的更新次数
+            "flushes": 0,         # 落盘批次数
+            "commits": 0,         # 事务提交次数
+            "rows": 0,            # 累计写入行数
+            "last_flush_rows": 0,
+            "max_flush_rows": 0,
+            "last_commit_ms": 0.0,
+            "checkpoints": 0,
+            "errors": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._last_checkpoint = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并落盘剩余更新"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            await self.flush()
+
+    def queue(self, task_id: str, fields: dict):
+        """合并一次字段更新（同字段后写覆盖先写）"""
+        self.stats["queued"] += 1
+        merged = self._pending.get(task_id)
+        if merged is None:
+            self._pending[task_id] = dict(fields)
+        else:
+            merged.update(fields)
+        if len(self._pending) >= FLUSH_THRESHOLD and self._wake is not None:
+            self._wake.set()
+
+    def touches(self, columns: set) -> bool:
+        """待写更新是否涉及给定列（updated_at 随任何更新变化）"""
+        if "updated_at" in columns:
+            return bool(self._pending)
+        return any(not columns.isdisjoint(fields) for fields in self._pending.values())
+
+    def discard(self, task_id: str):
+        """丢弃任务的待写更新（任务被删除时调用）"""
+        self._pending.pop(task_id, None)
+
+    async def flush(self):
+        """把当前合并的更新在一个事务中批量提交"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+
+            # 按字段集合分组，同组用一条 executemany
+            groups: dict = {}
+            for task_id, fields in batch.items():
+                keys = tuple(sorted(fields))
+                groups.setdefault(keys, []).append(
+                    [fields[k] for k in keys] + [task_id])
+
+            start = time.monotonic()
+            try:
+                conn = await _get_conn()
+                for keys, rows in groups.items():
+                    assignments = ", ".join(f"{k} = ?" for k in keys)
+                    await conn.executemany(
+                        f"UPDATE tasks SET {assignments}, updated_at = CURRENT_TIMESTAMP "
+                        f"WHERE task_id = ?",
+                        rows
+                    )
+                await conn.commit()
+            except Exception as e:
+                # 写入失败：放回队列（不覆盖期间产生的更新的字段），下次重试
+                self.stats["errors"] += 1
+                metrics.DB_COMMIT_ERRORS.inc()
+                for task_id, fields in batch.items():
+                    newer = self._pending.get(task_id)
+                    if newer is not None:
+                        fields.update(newer)
+                    self._pending[task_id] = fields
+                logger.warning(f"批量写入任务更新失败: {e}")
+                raise
+
+            count = len(batch)
+            elapsed = time.monotonic() - start
+            self.stats["flushes"] += 1
+            self.stats["commits"] += 1
+            self.stats["rows"] += count
+            self.stats["last_flush_rows"] = count
+            self.stats["max_flush_rows"] = max(self.stats["max_flush_rows"], count)
+            self.stats["last_commit_ms"] = round(elapsed * 1000, 2)
+            metrics.DB_COMMIT_SECONDS.observe(elapsed)
+            metrics.DB_COMMIT_ROWS.observe(count)
+
+    async def _checkpoint(self):
+        """被动 checkpoint：把 WAL 内容合并回主库，避免 WAL 无限增长"""
+        conn = await _get_conn()
+        await conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        self.stats["checkpoints"] += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                now = time.monotonic()
+                if now - self._last_checkpoint >= CHECKPOINT_INTERVAL:
+                    self._last_checkpoint = now
+                    await self._checkpoint()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"写合并器异常: {e}")
+                await asyncio.sleep(1)
+
+
+_writer = _TaskWriter()
+
+
+def start_writer():
+    """启动写合并器（需在事件循环中调用）"""
+    _writer.start()
+
+
+async def flush_writes():
+    """立即落盘所有待写更新"""
+    await _writer.flush()
+
+
+def has_pending_writes(columns: Iterable[str]) -> bool:
+    """是否有尚未落盘、且会影响这些列的更新（查询前据此决定是否需要先落盘）"""
+    return _writer.touches(set(columns))
+
+
+def get_writer_stats() -> dict:
+    """获取写合并器统计（每批行数、提交次数等）"""
+    stats = dict(_writer.stats)
+    stats["pending"] = _writer.pending_count
+    if stats["flushes"]:
+        stats["rows_per_flush"] = round(stats["rows"] / stats["flushes"], 2)
+    else:
+        stats["rows_per_flush"] = 0.0
+    return stats
@@ -0,0 +1,212 @@
+"""运行诊断 - 事件循环卡顿监测 + 采样分析器
+
+卡顿监测：事件循环内的心跳协程定期更新时间戳，独立的看门狗线程发现心跳超时后，
+立即抓取事件循环线程当前的调用栈（即正在阻塞循环的代码），循环恢复后记录卡顿时长。
+
+采样分析器：在独立线程中按固定频率采集各线程调用栈，输出 collapsed stack 格式
+（每行 "帧1;帧2;...;帧N 次数"），可直接交给 flamegraph.pl / speedscope 生成火焰图。
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frame_label(frame) -> str:
+    """火焰图中的帧名：函数名 (相对路径:行号)"""
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_PROJECT_ROOT):
+        filename = os.path.relpath(filename, _PROJECT_ROOT)
+    else:
+        filename = os.path.basename(filename)
+    # ';' 是 collapsed 格式的分隔符
+    return f"{code.co_name} ({filename}:{frame.f_lineno})".replace(";", ":")
+
+
+def _stack_labels(frame, limit: int = 128) -> List[str]:
+    """从最外层到最内层的帧名列表"""
+    labels = []
+    while frame is not None and len(labels) < limit:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+# ===========================================
+# 事件循环卡顿监测
+# ===========================================
+
+class LoopLagMonitor:
+    """事件循环卡顿监测：心跳协程 + 看门狗线程"""
+
+    # 保留最近的卡顿记录数
+    HISTORY = 50
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # 看门狗捕获的进行中卡顿（循环恢复后补上时长并移入 stalls）
+        self._pending: Optional[dict] = None
+        self.stalls: deque = deque(maxlen=self.HISTORY)
+        self.stats = {"stalls": 0, "max_lag_ms": 0.0, "last_lag_ms": 0.0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """启动监测（需在事件循环中调用）"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+        self._thread = threading.Thread(target=self._watchdog, name="loop-watchdog",
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"事件循环卡顿监测已启动（阈值 {self.threshold * 1000:.0f}ms）")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        """心跳：实际唤醒时间与预期之差即为循环延迟"""
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            self.stats["last_lag_ms"] = round(lag * 1000, 1)
+            # 看门狗已抓到栈的也记录（两边计时略有差异）
+            if lag >= self.threshold or self._pending is not None:
+                self._record_stall(lag)
+
+    def _record_stall(self, lag: float):
+        stall, self._pending = self._pending, None
+        if stall is None:
+            # 看门狗未来得及抓栈（卡顿略超阈值）
+            stall = {"at": time.time() - lag, "task": None, "stack": []}
+        stall["lag_ms"] = round(lag * 1000, 1)
+        self.stalls.append(stall)
+        self.stats["stalls"] += 1
+        self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], stall["lag_ms"])
+        metrics.LOOP_STALLS.inc()
+        where = stall["stack"][-1] if stall["stack"] else "未知位置"
+        logger.warning(f"事件循环卡顿 {stall['lag_ms']:.0f}ms，阻塞于 {where}"
+                       f"（任务: {stall['task'] or '-'}）")
+
+    def _watchdog(self):
+        """独立线程：心跳超时时抓取事件循环线程的调用栈"""
+        while not self._stop.wait(self.interval):
+            overdue = time.monotonic() - self._heartbeat - self.interval
+            if overdue < self.threshold or self._pending is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            task = None
+            try:
+                current = asyncio.current_task(self._loop)
+                task = current.get_name() if current else None
+            except RuntimeError:
+                pass
+            self._pending = {
+                "at": time.time() - overdue,
+                "task": task,
+                "stack": _stack_labels(frame),
+            }
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, threshold_ms=round(self.threshold * 1000, 1))
+
+
+# ===========================================
+# 采样分析器
+# ===========================================
+
+class SamplingProfiler:
+    """按固定频率采集调用栈，输出 collapsed stack"""
+
+    MAX_SECONDS = 120.0
+    MAX_HZ = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def _sample(self, seconds: float, hz: int, thread_ids: Optional[set]) -> Dict[str, int]:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        period = 1.0 / hz
+        counts: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (thread_ids is not None and ident not in thread_ids):
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                thread = names.get(ident, str(ident)).replace(";", ":").replace(" ", "_")
+                counts[";".join([thread] + _stack_labels(frame))] += 1
+            next_sample += period
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+        return counts
+
+    async def profile(self, seconds: float = 10.0, hz: int = 100,
+                      loop_only: bool = False) -> str:
+        """采样 seconds 秒，返回 collapsed stack 文本（同一时间只允许一次）
+
+        Raises:
+            RuntimeError: 已有采样在进行中
+        """
+        seconds = max(0.1, min(seconds, self.MAX_SECONDS))
+        hz = max(1, min(hz, self.MAX_HZ))
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("已有采样在进行中")
+        try:
+            thread_ids = {threading.get_ident()} if loop_only else None
+            counts = await asyncio.to_thread(self._sample, seconds, hz, thread_ids)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+loop_monitor = LoopLagMonitor()
+profiler = SamplingProfiler()
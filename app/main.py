@@ -8,21 +8,25 @@ _project_root = str(Path(__file__).parent.parent)
 if _project_root not in sys.path:
     sys.path.insert(0, _project_root)
 
+import asyncio
 import logging
 import uvicorn
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Receive, Scope, Send
 from pathlib import Path
 
-from app.routes import api, settings, ws
+from app.routes import api, settings, ws, debug
 from app.routes import login as login_route
 from app.task_manager import task_manager
-from app.config import load_config
-from app.auth import is_auth_enabled, verify_token
+from app.config import load_config, watch_config
+from app.auth import is_auth_enabled, verify_token, sync_revocations, load_secret
 from app import database as db
+from app import metrics
+from app.diagnostics import loop_monitor
 
 # 配置日志
 logging.basicConfig(
@@ -36,36 +40,52 @@ logger = logging.getLogger(__name__)
 STATIC_DIR = Path(__file__).parent / "static"
 
 # 不需要认证的路径前缀
-AUTH_WHITELIST = ["/api/login", "/api/auth/check", "/static/", "/docs", "/openapi.json", "/favicon.ico"]
+AUTH_WHITELIST = ("/api/login", "/api/auth/check", "/static/", "/docs", "/openapi.json", "/favicon.ico")
+# 撤销列表与数据库同步的间隔（秒），多进程部署时其他进程的退出登录在此间隔内生效
+REVOCATION_SYNC_INTERVAL = 30.0
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    """简单的认证中间件"""
+class AuthMiddleware:
+    """认证中间件（纯 ASGI：不包装请求和响应流，只检查请求头）
 
-    async def dispatch(self, request: Request, call_next):
-        # 不启用认证时直接放行
-        if not is_auth_enabled():
-            return await call_next(request)
+    token 取自 Cookie auth_token，或 Authorization: Bearer（供 Prometheus 等抓取方使用）。
+    WebSocket 走自己的认证逻辑，lifespan 等其他类型的 scope 直接放行。
+    """
 
-        path = request.url.path
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not is_auth_enabled():
+            return await self.app(scope, receive, send)
 
         # 白名单路径放行
-        if path == "/" or any(path.startswith(p) for p in AUTH_WHITELIST):
-            return await call_next(request)
+        path = scope["path"]
+        if path == "/" or path.startswith(AUTH_WHITELIST):
+            return await self.app(scope, receive, send)
+
+        # 检查 Cookie 或 Authorization 头中的 token
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"cookie" and token is None:
+                token = cookie_parser(value.decode("latin-1")).get("auth_token")
+            elif name == b"authorization" and value[:7].lower() == b"bearer ":
+                token = value[7:].decode("latin-1").strip()
+        if not token or not verify_token(token):
+            response = JSONResponse(status_code=401, content={"detail": "未登录"})
+            return await response(scope, receive, send)
 
-        # WebSocket 走自己的认证逻辑
-        if path == "/ws":
-            return await call_next(request)
+        return await self.app(scope, receive, send)
 
-        # 检查 Cookie 中的 token
-        token = request.cookies.get("auth_token")
-        if not token or not verify_token(token):
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "未登录"}
-            )
 
-        return await call_next(request)
+async def _revocation_sync_loop():
+    """定期从数据库同步撤销列表（其他进程的退出登录）"""
+    while True:
+        await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+        try:
+            await sync_revocations()
+        except Exception as e:
+            logger.warning(f"同步会话撤销列表失败: {e}")
 
 
 @asynccontextmanager
@@ -74,10 +94,24 @@ async def lifespan(app: FastAPI):
     config = load_config()
     port = config.get("server", {}).get("port", 8000)
     logger.info("Pikpak2TelDrive 正在启动...")
+    # 最先启动，启动过程中的阻塞也能记录
+    lag_threshold = config.get("server", {}).get("loop_lag_threshold", 0.25)
+    if lag_threshold > 0:
+        loop_monitor.threshold = lag_threshold
+        loop_monitor.start()
     await task_manager.start()
+    await load_secret()
+    await sync_revocations()
+    background = [asyncio.create_task(_revocation_sync_loop())]
+    # 监听 config.toml，手动编辑后自动生效
+    if config.get("server", {}).get("config_watch", True):
+        background.append(asyncio.create_task(watch_config()))
     logger.info(f"应用已启动 - http://localhost:{port}")
     yield
     logger.info("正在关闭...")
+    for bg_task in background:
+        bg_task.cancel()
+    await loop_monitor.stop()
     await task_manager.stop()
     await db.close_db()
 
@@ -97,6 +131,7 @@ app.include_router(login_route.router)
 app.include_router(api.router)
 app.include_router(settings.router)
 app.include_router(ws.router)
+app.include_router(debug.router)
 
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
@@ -108,6 +143,13 @@ async def index():
     return FileResponse(str(STATIC_DIR / "index.html"))
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 格式的运行指标"""
+    return PlainTextResponse(metrics.render(),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":
     config = load_config()
     port = config.get("server", {}).get("port", 8000)
@@ -115,5 +157,6 @@ if __name__ == "__main__":
         "app.main:app",
         host="0.0.0.0",
         port=port,
-        reload=True
+        reload=True,
+        ws_per_message_deflate=config.get("server", {}).get("ws_compression", True)
     )
@@ -0,0 +1,247 @@
+"""运行指标 - Prometheus 文本格式导出
+
+热路径上每次记录只是一次字典查找 + 数值累加（直方图多一次二分查找），
+不加锁、不分配对象；队列深度等状态量在抓取时通过回调读取，平时不维护。
+"""
+
+import bisect
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 所有指标名的前缀
+PREFIX = "aria2teldrive_"
+
+# 默认延迟分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# part 上传耗时分桶（秒）：单个 part 通常为数百 MB
+PART_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+# 数量分桶（每轮任务数、每次提交行数）
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def _format_number(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...],
+                   extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+
+    def labels(self, *values):
+        """取（或创建）一组标签值对应的子指标，调用方可缓存返回值"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """单调递增计数"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        """无标签计数"""
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_number(c.value)}"
+                for k, c in self._children.items()]
+
+
+class Gauge(_Metric):
+    """当前值：可直接设置，或注册回调在抓取时读取"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._function: Optional[Callable[[], object]] = None
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def set(self, value: float, *labels):
+        self.labels(*labels).value = value
+
+    def set_function(self, fn: Callable[[], object]):
+        """抓取时调用 fn：无标签时返回数值，有标签时返回 {标签值元组: 数值}"""
+        self._function = fn
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception:
+                return []
+            items = result.items() if isinstance(result, dict) else [((), result)]
+        else:
+            items = ((k, c.value) for k, c in self._children.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_number(v)}"
+                for k, v in items]
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """分桶统计（每个桶只记本桶计数，导出时再累加）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """无标签记录"""
+        self.labels().observe(value)
+
+    def _samples(self):
+        lines = []
+        for k, child in self._children.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += n
+                le = 'le="' + _format_number(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, k, le)} "
+                             f"{cumulative}")
+            labels = _format_labels(self.labelnames, k)
+            lines.append(f"{self.name}_sum{labels} {_format_number(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+_registry: List[_Metric] = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """导出全部指标（Prometheus text format 0.0.4）"""
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# ===========================================
+# 指标定义
+# ===========================================
+
+# aria2
+ARIA2_RPC_SECONDS = _register(Histogram(
+    "aria2_rpc_seconds", "aria2 JSON-RPC 请求耗时", ("method",)))
+ARIA2_RPC_ERRORS = _register(Counter(
+    "aria2_rpc_errors_total", "aria2 JSON-RPC 请求失败次数", ("method",)))
+
+# 监控循环
+SYNC_TICK_SECONDS = _register(Histogram(
+    "sync_tick_seconds", "aria2 任务同步一轮耗时", ("mode",)))
+SYNC_TICK_TASKS = _register(Histogram(
+    "sync_tick_tasks", "每轮同步从 aria2 拉取的任务数", buckets=COUNT_BUCKETS))
+THROTTLE_TRANSITIONS = _register(Counter(
+    "throttle_transitions_total", "限流状态切换次数", ("kind", "state")))
+THROTTLED = _register(Gauge(
+    "throttled", "当前是否处于限流（1=是）", ("kind",)))
+
+# 事件循环
+LOOP_LAG_SECONDS = _register(Histogram(
+    "loop_lag_seconds", "事件循环心跳延迟"))
+LOOP_STALLS = _register(Counter(
+    "loop_stalls_total", "超过阈值的事件循环卡顿次数"))
+
+# 数据库写合并器
+DB_COMMIT_SECONDS = _register(Histogram(
+    "db_commit_seconds", "批量写入事务耗时"))
+DB_COMMIT_ROWS = _register(Histogram(
+    "db_commit_rows", "每次事务写入的任务行数", buckets=COUNT_BUCKETS))
+DB_COMMIT_ERRORS = _register(Counter(
+    "db_commit_errors_total", "批量写入失败次数"))
+
+# WebSocket
+WS_BROADCAST_SECONDS = _register(Histogram(
+    "ws_broadcast_seconds", "一次广播序列化并入队的耗时", ("kind",)))
+WS_CLIENTS = _register(Gauge(
+    "ws_clients", "WebSocket 客户端数", ("protocol",)))
+WS_QUEUED = _register(Gauge(
+    "ws_queued_messages", "所有客户端发送队列中的消息总数"))
+WS_MAX_QUEUED = _register(Gauge(
+    "ws_max_queued_messages", "单个客户端发送队列的最大积压"))
+
+# 上传
+UPLOAD_PART_SECONDS = _register(Histogram(
+    "upload_part_seconds", "单个 part 上传耗时（成功的请求）", ("endpoint",),
+    buckets=PART_BUCKETS))
+UPLOAD_PART_BYTES = _register(Counter(
+    "upload_part_bytes_total", "成功上传的 part 字节数", ("endpoint",)))
+UPLOAD_PART_RETRIES = _register(Counter(
+    "upload_part_retries_total", "part 上传重试次数", ("endpoint",)))
+UPLOAD_PART_FAILURES = _register(Counter(
+    "upload_part_failures_total", "重试耗尽后失败的 part 数", ("endpoint",)))
+UPLOAD_SLOT_WAIT_SECONDS = _register(Histogram(
+    "upload_slot_wait_seconds", "任务等待上传槽位的时间"))
+ACTIVE_UPLOADS = _register(Gauge(
+    "active_uploads", "占用上传槽位的任务数"))
@@ -44,8 +44,16 @@ class TelDriveSettings(BaseModel):
     channel_id: int = 0
     chunk_size: str = "500M"
     upload_concurrency: int = 4
+    file_concurrency: int = 3
     upload_dir: str = ""
     target_path: str = "/"
+    pipelined_upload: bool = False
+    dir_cache_ttl: int = 300
+    content_dedup: bool = False
+    pool_limit: int = 100
+    pool_limit_per_host: int = 0
+    dns_cache_ttl: int = 300
+    keepalive_timeout: int = 30
 
 
 class GeneralSettings(BaseModel):
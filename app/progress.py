@@ -0,0 +1,125 @@
+"""上传进度统计 - 发送路径只更新内存计数，由 emitter 定期汇总、估算速度并推送
+
+发送路径（每发出 1MB 调用一次）只做同步的字典/整数写入：事件循环单线程，
+无需加锁，也不 await 任何 I/O。数据库写入和 WebSocket 广播全部在 emitter
+的周期任务中完成，慢速浏览器或 SQLite 提交不会拖慢 part 发送。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TransferProgress:
+    """单个任务的上传字节计数 + EWMA 速度"""
+
+    __slots__ = ("total", "completed", "parts", "speed",
+                 "_sample_bytes", "_sample_time")
+
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = 0          # 已确认 part 的字节数
+        self.parts: Dict[Hashable, int] = {}  # 传输中的 part -> 已发送字节
+        self.speed = 0.0            # 字节/秒（EWMA）
+        self._sample_bytes = 0
+        self._sample_time = time.monotonic()
+
+    def part_sent(self, key: Hashable, sent: int):
+        """传输中的 part 已发送 sent 字节"""
+        self.parts[key] = sent
+
+    def part_done(self, key: Hashable, size: int):
+        """part 已确认（上传成功或远程已存在）"""
+        self.parts.pop(key, None)
+        self.completed += size
+
+    def part_reset(self, key: Hashable):
+        """part 发送失败，重试时从 0 重新计数"""
+        self.parts.pop(key, None)
+
+    def part_redo(self, key: Hashable, size: int):
+        """已确认的 part 需要重新上传：撤销已计入的字节，重传完成时再计入"""
+        self.parts.pop(key, None)
+        self.completed = max(0, self.completed - size)
+
+    @property
+    def uploaded(self) -> int:
+        # 传输中的 part 数不超过调度器 worker 数，求和开销固定
+        return self.completed + sum(self.parts.values())
+
+    @property
+    def percent(self) -> float:
+        if self.total <= 0:
+            return 0.0
+        return min(100.0, self.uploaded / self.total * 100)
+
+    def sample(self, now: float, alpha: float) -> float:
+        """按两次采样间的字节增量更新 EWMA 速度"""
+        uploaded = self.uploaded
+        elapsed = now - self._sample_time
+        if elapsed > 0:
+            # 重试会让已发送字节回退，按 0 计
+            rate = max(0, uploaded - self._sample_bytes) / elapsed
+            self.speed = alpha * rate + (1 - alpha) * self.speed
+        self._sample_bytes = uploaded
+        self._sample_time = now
+        return self.speed
+
+
+class ProgressEmitter:
+    """按固定周期采样所有上传中任务的进度，并回调 on_emit(task_id, progress)"""
+
+    INTERVAL = 1.0
+    # EWMA 平滑系数：越大越跟手，越小越平稳
+    ALPHA = 0.3
+
+    def __init__(self, on_emit: Callable[[str, TransferProgress], Awaitable],
+                 interval: float = INTERVAL):
+        self._on_emit = on_emit
+        self.interval = interval
+        self._tracked: Dict[str, TransferProgress] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, task_id: str, total: int) -> TransferProgress:
+        """开始追踪任务上传进度（每次上传尝试重新计数）"""
+        progress = TransferProgress(total)
+        self._tracked[task_id] = progress
+        return progress
+
+    def untrack(self, task_id: str):
+        self._tracked.pop(task_id, None)
+
+    def get(self, task_id: str) -> Optional[TransferProgress]:
+        return self._tracked.get(task_id)
+
+    @property
+    def total_speed(self) -> float:
+        """所有上传中任务的速度之和（字节/秒）"""
+        return sum(p.speed for p in self._tracked.values())
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for task_id, progress in list(self._tracked.items()):
+                progress.sample(now, self.ALPHA)
+                try:
+                    await self._on_emit(task_id, progress)
+                except Exception as e:
+                    logger.debug(f"推送任务 {task_id} 上传进度失败: {e}")
@@ -1,13 +1,31 @@
 """API 路由 - 任务管理接口"""
 
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
 from app.models import TaskAddRequest, TaskResponse
 from app.task_manager import task_manager
 from app import database as db
+from app.diagnostics import loop_monitor
+
+try:
+    import orjson  # 可选依赖：序列化大列表快得多
+except ImportError:
+    orjson = None
 
 router = APIRouter(prefix="/api")
 
 
+class FastJSONResponse(JSONResponse):
+    """大列表响应：安装了 orjson 时用它序列化"""
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return super().render(content)
+
+
 @router.post("/task/add")
 async def add_task(req: TaskAddRequest):
     """添加下载任务"""
@@ -20,10 +38,46 @@ async def add_task(req: TaskAddRequest):
 
 
 @router.get("/tasks")
-async def get_all_tasks():
-    """获取所有任务"""
-    tasks = await task_manager.get_all_tasks()
-    return {"tasks": tasks}
+async def get_all_tasks(status: Optional[str] = None,
+                        created_after: Optional[str] = None,
+                        created_before: Optional[str] = None,
+                        filename_prefix: Optional[str] = None,
+                        sort: str = "created_at", order: str = "desc",
+                        limit: int = 100, cursor: Optional[str] = None):
+    """分页获取任务列表
+
+    status 可用逗号分隔多个状态；创建时间范围为 [created_after, created_before)；
+    sort 见 db.TASK_SORT_COLUMNS；翻页时传入上一页返回的 next_cursor。
+    """
+    if sort not in db.TASK_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序列: {sort}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order 只能是 asc 或 desc")
+    statuses = [s for s in status.split(",") if s] if status else None
+    try:
+        result = await task_manager.list_tasks(
+            statuses=statuses, created_after=created_after,
+            created_before=created_before, filename_prefix=filename_prefix,
+            sort=sort, descending=(order == "desc"), limit=limit, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(result)
+
+
+@router.get("/stats")
+async def get_stats():
+    """获取运行统计（数据库写合并、上传请求计数、连接池等）"""
+    teldrive = task_manager.teldrive
+    return {
+        "db": db.get_writer_stats(),
+        "upload": teldrive.get_upload_stats() if teldrive else {},
+        "http_pool": teldrive.get_pool_stats() if teldrive else {},
+        "scheduler": task_manager.part_scheduler.get_stats(),
+        "dedup": task_manager.content_index.get_stats(),
+        "ws": task_manager.get_ws_stats(),
+        "loop": loop_monitor.get_stats(),
+    }
 
 
 @router.get("/task/{task_id}")
@@ -162,10 +216,7 @@ async def pause_all_uploads():
             task_id = t["task_id"]
             # 取消上传协程但不删除本地文件
             task_manager._cancel_existing_upload(task_id)
-            old_gid = t.get("aria2_gid", "")
-            if old_gid:
-                task_manager._uploading_gids.discard(old_gid)
-            await db.update_task(task_id, status="failed", error="用户手动暂停上传")
-            await task_manager._broadcast_task_update(task_id)
+            await task_manager._update_task(task_id, status="failed", error="用户手动暂停上传")
+            task_manager._broadcast_task_update(task_id)
             count += 1
     return {"success": True, "message": f"已暂停 {count} 个上传任务"}
@@ -0,0 +1,31 @@
+"""诊断路由 - 事件循环卡顿记录和采样分析（受认证中间件保护）"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from app.diagnostics import loop_monitor, profiler
+
+router = APIRouter(prefix="/api/debug")
+
+
+@router.get("/stalls")
+async def get_stalls():
+    """最近的事件循环卡顿（含卡顿时事件循环线程的调用栈，最内层在最后）"""
+    return {
+        "enabled": loop_monitor.running,
+        "stats": loop_monitor.get_stats(),
+        "stalls": list(reversed(loop_monitor.stalls)),
+    }
+
+
+@router.get("/profile")
+async def profile(seconds: float = 10.0, hz: int = 100, loop_only: bool = False):
+    """对当前进程采样 seconds 秒，返回 collapsed stack（可用 flamegraph.pl / speedscope 打开）
+
+    loop_only=true 时只采样事件循环线程。
+    """
+    try:
+        collapsed = await profiler.profile(seconds, hz, loop_only)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed, headers={
+        "Content-Disposition": 'attachment; filename="profile.collapsed"'})
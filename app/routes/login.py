@@ -9,6 +9,7 @@ from app.auth import (
     create_token,
     verify_token,
     revoke_token,
+    token_ttl,
 )
 
 router = APIRouter(prefix="/api")
@@ -34,7 +35,7 @@ async def login(req: LoginRequest, response: Response):
         value=token,
         httponly=True,
         samesite="lax",
-        max_age=86400 * 7,  # 7 天
+        max_age=token_ttl(),
     )
     return {"success": True, "token": token}
 
@@ -43,7 +44,7 @@ async def login(req: LoginRequest, response: Response):
 async def logout(response: Response, auth_token: Optional[str] = Cookie(None)):
     """退出登录"""
     if auth_token:
-        revoke_token(auth_token)
+        await revoke_token(auth_token)
     response.delete_cookie("auth_token")
     return {"success": True}
 
@@ -2,10 +2,9 @@
 
 from fastapi import APIRouter
 from app.models import AllSettings, TestResult
-from app.config import load_config, save_config
+from app.config import get_config, save_config
 from app.aria2_client import Aria2Client
 from app.teldrive_client import TelDriveClient
-from app.task_manager import task_manager
 
 router = APIRouter(prefix="/api/settings")
 
@@ -13,7 +12,7 @@ router = APIRouter(prefix="/api/settings")
 @router.get("")
 async def get_settings():
     """获取当前设置"""
-    config = load_config()
+    config = get_config()
     return config
 
 
@@ -21,16 +20,15 @@ async def get_settings():
 async def update_settings(settings: AllSettings):
     """保存设置"""
     config = settings.model_dump()
+    # 保存后立即通知订阅者，任务管理器只重建配置有变化的客户端
     save_config(config)
-    # 重新加载配置到任务管理器
-    task_manager.reload_config()
     return {"success": True, "message": "设置已保存"}
 
 
 @router.post("/test/aria2")
 async def test_aria2():
     """测试 aria2 连接"""
-    config = load_config()
+    config = get_config()
     client = Aria2Client(
         rpc_url=config["aria2"]["rpc_url"],
         rpc_port=config["aria2"]["rpc_port"],
@@ -43,11 +41,13 @@ async def test_aria2():
 @router.post("/test/teldrive")
 async def test_teldrive():
     """测试 TelDrive 连接"""
-    config = load_config()
+    config = get_config()
     client = TelDriveClient(
         api_host=config["teldrive"]["api_host"],
         access_token=config["teldrive"]["access_token"]
     )
-    result = await client.test_connection()
-    return result
+    try:
+        return await client.test_connection()
+    finally:
+        await client.close()
 
@@ -1,11 +1,136 @@
 """WebSocket 路由 - 实时进度推送"""
 
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Union
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.task_manager import task_manager
+from app.ws_protocol import PROTOCOL_VERSION, encode_message, negotiate_encoding
 from app.auth import is_auth_enabled, verify_token
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# init 只推送第一页任务，其余由前端按需通过 /api/tasks 翻页加载
+INIT_PAGE_SIZE = 100
+
+
+class ClientConnection:
+    """单个 WebSocket 客户端：有界发送队列 + 独立的写协程
+
+    广播方只入队不等待网络；队列写满后，同一 key（task_update 为 task_id）
+    的消息合并为最新状态，仍放不下时断开该客户端（前端重连后由 init 重新同步全量）。
+    """
+
+    QUEUE_SIZE = 1024
+    # 单条消息发送超时（秒）：超时视为客户端已失去响应
+    SEND_TIMEOUT = 10.0
+
+    def __init__(self, ws: WebSocket, protocol: int = 1, encoding: str = "json",
+                 max_queue: int = QUEUE_SIZE):
+        self.ws = ws
+        self.protocol = protocol
+        self.encoding = encoding
+        self.max_queue = max_queue
+        # 每项为 [payload, key]，用列表包装以便合并时原地替换
+        self._queue: deque = deque()
+        # key -> 队列中该 key 最新的一项
+        self._latest: dict = {}
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.stats = {"sent": 0, "coalesced": 0}
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.closed = True
+        if self._writer and not self._writer.done():
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def send(self, payload: Union[str, bytes], key: Optional[str] = None) -> bool:
+        """入队一条已序列化的消息，返回 False 表示客户端已关闭或积压过多
+
+        key 不为空表示该消息是完整状态快照，队列满时可被同 key 的新快照替换。
+        """
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            item = self._latest.get(key) if key is not None else None
+            if item is not None:
+                item[0] = payload
+                self.stats["coalesced"] += 1
+                return True
+            self._compact()
+            if len(self._queue) >= self.max_queue:
+                # 无可合并的消息：客户端跟不上推送速度，断开让它重连
+                logger.info("WebSocket 客户端积压过多，断开连接")
+                self._abort()
+                return False
+        item = [payload, key]
+        self._queue.append(item)
+        if key is not None:
+            self._latest[key] = item
+        self._wakeup.set()
+        return True
+
+    def _compact(self):
+        """丢弃已被同 key 新消息取代的旧消息"""
+        before = len(self._queue)
+        self._queue = deque(item for item in self._queue
+                            if item[1] is None or self._latest.get(item[1]) is item)
+        self.stats["coalesced"] += before - len(self._queue)
+
+    def _abort(self):
+        self.closed = True
+        self._queue.clear()
+        self._latest.clear()
+        if self._writer and not self._writer.done():
+            self._writer.cancel()
+        # 关闭连接以结束 endpoint 中的接收循环
+        asyncio.create_task(self._close_ws())
+
+    async def _close_ws(self):
+        try:
+            await self.ws.close(code=1013)
+        except Exception:
+            pass
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            item = self._queue.popleft()
+            # 已出队的项不再参与合并
+            if item[1] is not None and self._latest.get(item[1]) is item:
+                del self._latest[item[1]]
+            payload = item[0]
+            send = self.ws.send_bytes if isinstance(payload, bytes) else self.ws.send_text
+            try:
+                await asyncio.wait_for(send(payload), timeout=self.SEND_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"WebSocket 发送失败: {e}")
+                self._writer = None  # 当前协程即将退出，无需取消自身
+                self._abort()
+                return
+            self.stats["sent"] += 1
+
 
 @router.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
@@ -19,22 +144,39 @@ async def websocket_endpoint(ws: WebSocket):
             await ws.close(code=4001, reason="未认证")
             return
 
+    # 协议版本：?v=2 使用按 tick 合并的增量推送，可选 &enc=msgpack
+    try:
+        protocol = min(int(ws.query_params.get("v", "1")), PROTOCOL_VERSION)
+    except ValueError:
+        protocol = 1
+    encoding = negotiate_encoding(ws.query_params.get("enc")) if protocol >= 2 else "json"
+
     await ws.accept()
-    task_manager.register_ws(ws)
+    client = ClientConnection(ws, protocol=protocol, encoding=encoding)
+    client.start()
+    # 先注册再取快照：注册后的广播排在 init 之前，init 的状态不会比它们旧
+    task_manager.register_ws(client)
     try:
-        # 发送当前所有任务状态 + 监控数据
-        tasks = await task_manager.get_all_tasks()
-        global_stat = task_manager.get_global_stat()
-        await ws.send_json({
-            "type": "init",
-            "data": {"tasks": tasks, "global_stat": global_stat}
-        })
+        # 发送第一页任务、各状态任务数 + 监控数据
+        page = await task_manager.list_tasks(limit=INIT_PAGE_SIZE)
+        init = {"type": "init", "data": {
+            "tasks": page["tasks"],
+            "next_cursor": page["next_cursor"],
+            "counts": page["counts"],
+            "global_stat": task_manager.get_global_stat(),
+        }}
+        if protocol >= 2:
+            init["v"] = protocol
+            init["encoding"] = encoding
+        client.send(encode_message(init, encoding))
         # 保持连接，接收客户端心跳
         while True:
             data = await ws.receive_text()
             if data == "ping":
-                await ws.send_json({"type": "pong"})
-    except WebSocketDisconnect:
+                client.send(encode_message({"type": "pong"}, encoding))
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError：连接已被写协程关闭
         pass
     finally:
-        task_manager.unregister_ws(ws)
+        task_manager.unregister_ws(client)
+        await client.stop()
@@ -8,6 +8,8 @@
 const state = {
     ws: null,
     tasks: {},
+    counts: null,      // 服务端各状态任务数（含 total）
+    nextCursor: null,  // 任务列表下一页游标，null 表示已全部加载
     currentPage: 'dashboard',
     currentFilter: 'all',
     reconnectTimer: null,
@@ -18,6 +20,9 @@ const state = {
     authEnabled: false  // 是否需要认证
 };
 
+// 任务列表每页条数
+const TASK_PAGE_SIZE = 100;
+
 // 渲染批处理：合并同一帧内的多条 WS 消息，避免重复 DOM 操作
 let _pendingUpdates = {};      // taskId -> task data
 let _rafScheduled = false;
@@ -87,29 +92,47 @@ async function apiCall(url, options = {}) {
     }
 }
 
-// 全量刷新任务列表（WS 重连 & 兜底轮询共用）
+function taskListUrl(cursor) {
+    const params = new URLSearchParams({ limit: TASK_PAGE_SIZE });
+    if (state.currentFilter !== 'all') params.set('status', state.currentFilter);
+    if (cursor) params.set('cursor', cursor);
+    return `/api/tasks?${params}`;
+}
+
+// 刷新当前过滤条件下的第一页（WS 重连 & 兜底轮询共用）
 async function fetchAllTasks() {
     try {
-        const data = await apiCall('/api/tasks');
+        const data = await apiCall(taskListUrl(null));
         if (data && data.tasks) {
             const serverIds = new Set(data.tasks.map(t => t.task_id));
-
-            // 删除服务端已不存在的任务
+            // 第一页覆盖的创建时间范围内，服务端已不存在的任务视为已删除
+            const oldest = data.next_cursor && data.tasks.length
+                ? data.tasks[data.tasks.length - 1].created_at || ''
+                : '';
             for (const id of Object.keys(state.tasks)) {
-                if (!serverIds.has(id)) {
-                    delete state.tasks[id];
-                    const el = document.getElementById(`task-${id}`);
-                    if (el) el.remove();
+                const t = state.tasks[id];
+                if (!serverIds.has(id) && shouldShowTask(t) && (t.created_at || '') >= oldest) {
+                    removeTask(id);
                 }
             }
 
-            // 更新所有任务
+            let added = false;
             data.tasks.forEach(t => {
+                if (!state.tasks[t.task_id]) added = true;
                 state.tasks[t.task_id] = t;
-                renderTaskItem(t);
             });
+            if (added) {
+                renderTasks();
+            } else {
+                data.tasks.forEach(renderTaskItem);
+            }
+            if (!state.nextCursor || !data.next_cursor) {
+                state.nextCursor = data.next_cursor;
+            }
+            state.counts = data.counts || state.counts;
 
             updateDashboard();
+            updateLoadMore();
             checkEmptyState();
         }
     } catch (e) {
@@ -117,6 +140,33 @@ async function fetchAllTasks() {
     }
 }
 
+// 加载下一页（追加到列表末尾）
+async function fetchMoreTasks() {
+    if (!state.nextCursor) return;
+    try {
+        const data = await apiCall(taskListUrl(state.nextCursor));
+        const list = document.getElementById('task-list');
+        data.tasks.forEach(t => {
+            if (state.tasks[t.task_id]) return;
+            state.tasks[t.task_id] = t;
+            const el = createTaskElement(t, 'task');
+            el.style.display = shouldShowTask(t) ? '' : 'none';
+            list.appendChild(el);
+        });
+        state.nextCursor = data.next_cursor;
+        state.counts = data.counts || state.counts;
+        updateDashboard();
+        updateLoadMore();
+    } catch (e) {
+        showToast('加载失败: ' + e.message, 'error');
+    }
+}
+
+function updateLoadMore() {
+    const btn = document.getElementById('btn-load-more');
+    if (btn) btn.style.display = state.nextCursor ? '' : 'none';
+}
+
 async function addTask(url, filename, telDrivePath) {
     return apiCall('/api/task/add', {
         method: 'POST',
@@ -156,14 +206,19 @@ async function testTelDrive() {
 
 function connectWS() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    let wsUrl = `${protocol}//${window.location.host}/ws`;
+    // v2 协议：按 tick 合并的增量帧；加载了 msgpack 解码器时请求二进制编码
+    let wsUrl = `${protocol}//${window.location.host}/ws?v=2`;
+    if (window.msgpackDecode) {
+        wsUrl += '&enc=msgpack';
+    }
     // 认证模式下带上 token
     if (state.authToken) {
-        wsUrl += `?token=${encodeURIComponent(state.authToken)}`;
+        wsUrl += `&token=${encodeURIComponent(state.authToken)}`;
     }
 
     try {
         state.ws = new WebSocket(wsUrl);
+        state.ws.binaryType = 'arraybuffer';
     } catch (e) {
         scheduleReconnect();
         return;
@@ -187,7 +242,9 @@ function connectWS() {
 
     state.ws.onmessage = (event) => {
         try {
-            const msg = JSON.parse(event.data);
+            const msg = typeof event.data === 'string'
+                ? JSON.parse(event.data)
+                : window.msgpackDecode(event.data);
             handleWSMessage(msg);
         } catch (e) {
             console.error('WS message parse error:', e);
@@ -230,14 +287,20 @@ function updateWSStatus(connected) {
 function handleWSMessage(msg) {
     switch (msg.type) {
         case 'init':
-            // 初始化任务列表
+            // 初始化任务列表（服务端只推送第一页，其余翻页加载）
             state.tasks = {};
             if (msg.data && msg.data.tasks) {
                 msg.data.tasks.forEach(t => {
                     state.tasks[t.task_id] = t;
                 });
             }
+            if (msg.data) {
+                state.counts = msg.data.counts || null;
+                // 第一页按“全部”查询；其他过滤条件由随后的 fetchAllTasks 重新加载
+                state.nextCursor = state.currentFilter === 'all' ? msg.data.next_cursor : null;
+            }
             renderTasks();
+            updateLoadMore();
             updateDashboard();
             // 立即渲染监控数据（速度/磁盘/CPU）
             if (msg.data && msg.data.global_stat) {
@@ -247,35 +310,55 @@ function handleWSMessage(msg) {
 
         case 'task_update':
             if (msg.data) {
-                const task = msg.data;
-                const oldTask = state.tasks[task.task_id];
-                state.tasks[task.task_id] = task;
-
-                // 纯进度变化 → 精确 DOM 更新（不重建 HTML）
-                if (oldTask && oldTask.status === task.status && !statusChanged(oldTask, task)) {
-                    fastProgressUpdate(task);
-                } else {
-                    // 状态变化 → 批量重建
-                    _pendingUpdates[task.task_id] = task;
-                    if (!_rafScheduled) {
-                        _rafScheduled = true;
-                        requestAnimationFrame(flushPendingUpdates);
-                    }
-                }
-                scheduleDashboardUpdate();
+                applyTaskUpdate(msg.data);
             }
             break;
 
         case 'task_deleted':
             if (msg.data && msg.data.task_id) {
-                delete state.tasks[msg.data.task_id];
-                const el = document.getElementById(`task-${msg.data.task_id}`);
-                if (el) el.remove();
+                removeTask(msg.data.task_id);
                 updateDashboard();
                 checkEmptyState();
             }
             break;
 
+        case 'batch':
+            // v2：本 tick 内变化的字段，按 task_id 合并到本地状态
+            if (msg.tasks) {
+                for (const taskId in msg.tasks) {
+                    const oldTask = state.tasks[taskId];
+                    const delta = msg.tasks[taskId];
+                    // 未加载的任务只收到部分字段时忽略，翻页加载时再取完整数据
+                    if (!oldTask && delta.url === undefined) continue;
+                    applyTaskUpdate(Object.assign({}, oldTask || {}, delta));
+                }
+            }
+            if (msg.counts) {
+                state.counts = msg.counts;
+                scheduleDashboardUpdate();
+            }
+            if (msg.removed && msg.removed.length) {
+                msg.removed.forEach(removeTask);
+                updateDashboard();
+                checkEmptyState();
+            }
+            if (msg.global_stat) {
+                handleWSMessage({ type: 'global_stat', data: msg.global_stat });
+            }
+            break;
+
+        case 'snapshot':
+            // v2：定期推送非终态任务的完整快照，纠正增量累积的偏差
+            if (msg.tasks) {
+                msg.tasks.forEach(applyTaskUpdate);
+                checkEmptyState();
+            }
+            if (msg.counts) {
+                state.counts = msg.counts;
+                scheduleDashboardUpdate();
+            }
+            break;
+
         case 'global_stat':
             if (msg.data) {
                 const dlSpeed = formatSpeed(msg.data.download_speed || 0);
@@ -332,6 +415,31 @@ function handleWSMessage(msg) {
     }
 }
 
+function applyTaskUpdate(task) {
+    const oldTask = state.tasks[task.task_id];
+    state.tasks[task.task_id] = task;
+
+    // 纯进度变化 → 精确 DOM 更新（不重建 HTML）
+    if (oldTask && oldTask.status === task.status && !statusChanged(oldTask, task)) {
+        fastProgressUpdate(task);
+    } else {
+        // 状态变化 → 批量重建
+        _pendingUpdates[task.task_id] = task;
+        if (!_rafScheduled) {
+            _rafScheduled = true;
+            requestAnimationFrame(flushPendingUpdates);
+        }
+    }
+    scheduleDashboardUpdate();
+}
+
+function removeTask(taskId) {
+    delete state.tasks[taskId];
+    delete _pendingUpdates[taskId];
+    const el = document.getElementById(`task-${taskId}`);
+    if (el) el.remove();
+}
+
 // ============================================
 // 渲染
 // ============================================
@@ -353,6 +461,8 @@ function renderTasks() {
         return;
     }
 
+    // 按创建时间倒序（与服务端分页顺序一致）
+    tasks.sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''));
     list.innerHTML = '';
     tasks.forEach(task => {
         const el = createTaskElement(task, 'task');
@@ -403,6 +513,19 @@ function buildTaskHTML(task) {
                     <div class="progress-fill download ${status === 'downloading' ? 'active' : ''}" style="width: ${dlProgress}%"></div>
                 </div>
             </div>`;
+        // 边下边传：下载中已开始上传
+        if (ulProgress > 0) {
+            progressHTML += `
+            <div class="task-progress-section">
+                <div class="progress-labels">
+                    <span>上传进度</span>
+                    <span>${ulProgress.toFixed(1)}%</span>
+                </div>
+                <div class="progress-bar">
+                    <div class="progress-fill upload active" style="width: ${ulProgress}%"></div>
+                </div>
+            </div>`;
+        }
     } else if (status === 'uploading') {
         progressHTML = `
             <div class="task-progress-section">
@@ -458,6 +581,7 @@ function buildTaskHTML(task) {
     const metaItems = [];
     if (task.file_size) metaItems.push(`<span class="task-meta-item">📦 ${task.file_size}</span>`);
     if (task.download_speed && status === 'downloading') metaItems.push(`<span class="task-meta-item">⬇ ${task.download_speed}</span>`);
+    if (task.upload_speed && (status === 'uploading' || status === 'downloading')) metaItems.push(`<span class="task-meta-item">⬆ ${task.upload_speed}</span>`);
     if (task.error) metaItems.push(`<span class="task-meta-item" style="color:var(--error)">⚠ ${task.error}</span>`);
 
     return `
@@ -479,7 +603,9 @@ function statusChanged(oldTask, newTask) {
     return oldTask.filename !== newTask.filename ||
         oldTask.error !== newTask.error ||
         oldTask.file_size !== newTask.file_size ||
-        oldTask.download_speed !== newTask.download_speed;
+        oldTask.download_speed !== newTask.download_speed ||
+        oldTask.upload_speed !== newTask.upload_speed ||
+        (oldTask.upload_progress > 0) !== (newTask.upload_progress > 0);
 }
 
 // 快速进度更新：只改进度条宽度和百分比文字，不重建 DOM
@@ -491,6 +617,8 @@ function fastProgressUpdate(task) {
     if (task.status === 'downloading' || task.status === 'paused') {
         if (fills[0]) fills[0].style.width = (task.download_progress || 0) + '%';
         if (labels[0]) labels[0].lastElementChild.textContent = (task.download_progress || 0).toFixed(1) + '%';
+        if (fills[1]) fills[1].style.width = (task.upload_progress || 0) + '%';
+        if (labels[1]) labels[1].lastElementChild.textContent = (task.upload_progress || 0).toFixed(1) + '%';
     } else if (task.status === 'uploading') {
         if (fills[1]) fills[1].style.width = (task.upload_progress || 0) + '%';
         if (labels[1]) labels[1].lastElementChild.textContent = (task.upload_progress || 0).toFixed(1) + '%';
@@ -624,12 +752,22 @@ function bindTaskActions(el, taskId) {
 }
 
 function updateDashboard() {
-    const tasks = Object.values(state.tasks);
-    const total = tasks.length;
-    const downloading = tasks.filter(t => t.status === 'downloading').length;
-    const uploading = tasks.filter(t => t.status === 'uploading').length;
-    const completed = tasks.filter(t => t.status === 'completed').length;
-    const failed = tasks.filter(t => t.status === 'failed').length;
+    // 优先使用服务端统计（本地只加载了部分任务）
+    let total, downloading, uploading, completed, failed;
+    if (state.counts) {
+        total = state.counts.total || 0;
+        downloading = state.counts.downloading || 0;
+        uploading = state.counts.uploading || 0;
+        completed = state.counts.completed || 0;
+        failed = state.counts.failed || 0;
+    } else {
+        const tasks = Object.values(state.tasks);
+        total = tasks.length;
+        downloading = tasks.filter(t => t.status === 'downloading').length;
+        uploading = tasks.filter(t => t.status === 'uploading').length;
+        completed = tasks.filter(t => t.status === 'completed').length;
+        failed = tasks.filter(t => t.status === 'failed').length;
+    }
 
     document.getElementById('stat-total').textContent = total;
     document.getElementById('stat-downloading').textContent = downloading;
@@ -768,10 +906,16 @@ document.addEventListener('DOMContentLoaded', () => {
             state.currentFilter = btn.dataset.filter;
             document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
             btn.classList.add('active');
+            // 过滤在服务端完成：重新加载该状态的第一页
+            state.nextCursor = null;
             renderTasks();
+            fetchAllTasks();
         });
     });
 
+    // 加载更多任务
+    document.getElementById('btn-load-more').addEventListener('click', fetchMoreTasks);
+
     // 添加任务按钮
     document.getElementById('btn-add-task').addEventListener('click', openModal);
     document.getElementById('btn-add-task-dash').addEventListener('click', openModal);
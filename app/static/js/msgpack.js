@@ -0,0 +1,81 @@
+/**
+ * 最小 MessagePack 解码器 — 仅用于解码 WebSocket v2 的二进制帧
+ * 支持 nil/bool/int/float/str/bin/array/map，不支持 ext 类型
+ */
+
+(function () {
+    const textDecoder = new TextDecoder();
+
+    function msgpackDecode(buffer) {
+        const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let pos = 0;
+
+        function str(len) {
+            const s = textDecoder.decode(bytes.subarray(pos, pos + len));
+            pos += len;
+            return s;
+        }
+
+        function bin(len) {
+            const b = bytes.slice(pos, pos + len);
+            pos += len;
+            return b;
+        }
+
+        function array(len) {
+            const arr = new Array(len);
+            for (let i = 0; i < len; i++) arr[i] = read();
+            return arr;
+        }
+
+        function map(len) {
+            const obj = {};
+            for (let i = 0; i < len; i++) {
+                const key = read();
+                obj[key] = read();
+            }
+            return obj;
+        }
+
+        function read() {
+            const b = bytes[pos++];
+            if (b <= 0x7f) return b;                       // positive fixint
+            if (b >= 0xe0) return b - 0x100;               // negative fixint
+            if ((b & 0xf0) === 0x80) return map(b & 0x0f);  // fixmap
+            if ((b & 0xf0) === 0x90) return array(b & 0x0f); // fixarray
+            if ((b & 0xe0) === 0xa0) return str(b & 0x1f);  // fixstr
+            let v;
+            switch (b) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: v = view.getUint8(pos); pos += 1; return bin(v);
+                case 0xc5: v = view.getUint16(pos); pos += 2; return bin(v);
+                case 0xc6: v = view.getUint32(pos); pos += 4; return bin(v);
+                case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+                case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+                case 0xcc: v = view.getUint8(pos); pos += 1; return v;
+                case 0xcd: v = view.getUint16(pos); pos += 2; return v;
+                case 0xce: v = view.getUint32(pos); pos += 4; return v;
+                case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+                case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+                case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+                case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+                case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+                case 0xd9: v = view.getUint8(pos); pos += 1; return str(v);
+                case 0xda: v = view.getUint16(pos); pos += 2; return str(v);
+                case 0xdb: v = view.getUint32(pos); pos += 4; return str(v);
+                case 0xdc: v = view.getUint16(pos); pos += 2; return array(v);
+                case 0xdd: v = view.getUint32(pos); pos += 4; return array(v);
+                case 0xde: v = view.getUint16(pos); pos += 2; return map(v);
+                case 0xdf: v = view.getUint32(pos); pos += 4; return map(v);
+            }
+            throw new Error(`msgpack: 不支持的类型 0x${b.toString(16)}`);
+        }
+
+        return read();
+    }
+
+    window.msgpackDecode = msgpackDecode;
+})();
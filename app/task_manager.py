@@ -1,6 +1,9 @@
 """任务管理器 - 监控 aria2 下载并自动上传到 TelDrive"""
 
 import asyncio
+import base64
+import json
+import time
 import uuid
 import os
 import shutil
@@ -10,44 +13,80 @@ from typing import Optional, Set
 from pathlib import Path
 
 from app.config import load_config, get_aria2_rpc_url, get_download_dir
-from app.aria2_client import Aria2Client
-from app.teldrive_client import TelDriveClient
+from app import config as app_config
+from app.aria2_client import Aria2Client, _format_speed
+from app.teldrive_client import TelDriveClient, UploadSession
+from app.progress import ProgressEmitter, TransferProgress
+from app.upload_scheduler import PartScheduler
+from app.content_index import ContentIndex
+from app.ws_protocol import TickBatcher, encode_message
+from app.task_store import TaskStore, TaskRecord
 from app import database as db
+from app import metrics
 
 logger = logging.getLogger(__name__)
 
 
+def _encode_cursor(sort: str, descending: bool, value, task_id: str) -> str:
+    """分页游标：排序列 + 方向 + 上一页最后一行的 (排序值, task_id)，对客户端不透明"""
+    order = "desc" if descending else "asc"
+    raw = json.dumps([sort, order, value, task_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str, descending: bool) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, task_id = json.loads(raw)
+    except Exception:
+        raise ValueError("无效的分页游标")
+    if cursor_sort != sort or cursor_order != ("desc" if descending else "asc"):
+        raise ValueError("分页游标与排序方式不匹配")
+    return value, task_id
+
+
 class TaskManager:
     """任务管理器 - 监控 aria2 并自动上传"""
 
+    # 轮询间隔（秒）：刷新进度、CPU/磁盘检测
+    POLL_INTERVAL = 2.0
+    # WebSocket 通知在线时，全量对账的间隔（秒）
+    RECONCILE_INTERVAL = 30.0
+    # WebSocket v2 增量帧的合并间隔（秒）
+    WS_BATCH_INTERVAL = 1.0
+    # 上传无进展检测的检查间隔（秒）
+    UPLOAD_WATCHDOG_INTERVAL = 5.0
+
     def __init__(self):
         self.config = load_config()
         self.aria2: Optional[Aria2Client] = None
         self.teldrive: Optional[TelDriveClient] = None
         self._ws_clients: Set = set()
+        # v2 客户端：按 tick 合并的增量推送
+        self.ws_batcher = TickBatcher()
+        self._ws_batch_task: Optional[asyncio.Task] = None
         self._monitor_task: Optional[asyncio.Task] = None
         self._running = False
-        # 内存缓存：已知的 GID 集合，避免重复查库
-        self._known_gids: set = set()
-        # 终态 GID 集合：已完成/失败/取消的任务，不再查库更新
-        self._terminal_gids: set = set()
-        # 正在上传的 GID 集合，避免重复触发上传
-        self._uploading_gids: set = set()
+        # 任务状态的内存权威副本（按 task_id / GID / 状态索引），数据库只做持久化
+        self.store = TaskStore()
         # 上传并发控制：用活跃计数+Event 实现动态并发，支持热更新
         self._active_uploads: int = 0
+        # 进程级 part 调度器：upload_concurrency = 同时在传输中的 part 数
+        self.part_scheduler = PartScheduler()
         self._upload_slot_event = asyncio.Event()
         self._upload_slot_event.set()  # 初始有空位
         # 上传协程追踪：task_id -> asyncio.Task，重试时可取消旧任务
         self._upload_tasks: dict = {}
+        # 边下边传失败过的任务，改为下载完成后常规上传
+        self._pipeline_disabled: set = set()
         # 上传重试计数：task_id -> 已重试次数
         self._upload_retry_counts: dict = {}
         # 自动重试计时器
         self._last_retry_time: float = 0.0
-        # 上传速度跟踪：per-task 已上传字节 → monitor loop 汇总算总速度
-        self._task_uploaded_bytes: dict = {}   # task_id -> 当前已上传字节
-        self._upload_total_snapshot: int = 0   # 上次快照时的总字节
-        self._upload_time_snapshot: float = 0.0
-        self._upload_speed: float = 0.0
+        # 上传进度：发送路径只更新内存计数，emitter 每秒汇总进度/速度并推送
+        self.progress = ProgressEmitter(self._emit_upload_progress)
+        # 内容去重：内容哈希 -> TelDrive 上已有文件的 parts
+        self.content_index = ContentIndex()
         # 磁盘空间限制：通过调控并发数防止新任务占用空间
         self._disk_throttled: bool = False
         self._disk_limited_concurrent: int = 0  # 磁盘限流期间的当前并发数限制，0=未限流
@@ -58,35 +97,99 @@ class TaskManager:
         self._cpu_info: dict = {}
         self._cpu_samples: list = []  # CPU 采样历史，用于滑动平均
         self._last_download_speed: int = 0  # 缓存最近的 aria2 下载速度
+        # aria2 WebSocket 通知：待处理的 GID + 唤醒监控循环的事件
+        self._pending_aria2_events: set = set()
+        self._aria2_event = asyncio.Event()
+        self._last_reconcile_time: float = 0.0
+        # 状态类指标在抓取时读取
+        metrics.ACTIVE_UPLOADS.set_function(lambda: self._active_uploads)
+        metrics.THROTTLED.set_function(lambda: {
+            ("cpu",): int(self._cpu_speed_limit > 0),
+            ("disk",): int(self._disk_throttled),
+        })
+        metrics.WS_CLIENTS.set_function(self._ws_client_counts)
+        metrics.WS_QUEUED.set_function(
+            lambda: sum(c.queued for c in self._ws_clients))
+        metrics.WS_MAX_QUEUED.set_function(
+            lambda: max((c.queued for c in self._ws_clients), default=0))
 
     def _init_clients(self):
         """根据当前配置初始化客户端"""
+        self._init_aria2()
+        self._init_teldrive()
+
+    def _init_aria2(self):
         cfg = self.config
+        old_aria2 = self.aria2
+        if old_aria2:
+            # 旧客户端的 HTTP 会话和 WebSocket 通知通道需要关闭，避免泄漏
+            asyncio.create_task(old_aria2.close_all())
         self.aria2 = Aria2Client(
             rpc_url=cfg["aria2"]["rpc_url"],
             rpc_port=cfg["aria2"]["rpc_port"],
             rpc_secret=cfg["aria2"]["rpc_secret"]
         )
+
+    def _init_teldrive(self):
+        cfg = self.config
+        td = cfg["teldrive"]
+        upload_options = {
+            "channel_id": td["channel_id"],
+            "chunk_size": td["chunk_size"],
+            "upload_concurrency": td["upload_concurrency"],
+            "random_chunk_name": td.get("random_chunk_name", True),
+            "max_retries": cfg["general"].get("max_retries", 3),
+            "dir_cache_ttl": td.get("dir_cache_ttl", 300),
+        }
+        pool_options = {
+            "pool_limit": td.get("pool_limit", 100),
+            "pool_limit_per_host": td.get("pool_limit_per_host", 0),
+            "dns_cache_ttl": td.get("dns_cache_ttl", 300),
+            "keepalive_timeout": td.get("keepalive_timeout", 30),
+        }
+        old_teldrive = self.teldrive
+        if old_teldrive and old_teldrive.same_endpoint(
+                td["api_host"], td["access_token"], **pool_options):
+            # 地址、凭据和连接池参数未变：保留连接池，只更新上传参数
+            old_teldrive.configure(**upload_options)
+            return
+        if old_teldrive:
+            # 进行中的上传仍在使用旧连接池，等它们结束后再关闭
+            asyncio.create_task(old_teldrive.close_when_idle())
         self.teldrive = TelDriveClient(
-            api_host=cfg["teldrive"]["api_host"],
-            access_token=cfg["teldrive"]["access_token"],
-            channel_id=cfg["teldrive"]["channel_id"],
-            chunk_size=cfg["teldrive"]["chunk_size"],
-            upload_concurrency=cfg["teldrive"]["upload_concurrency"],
-            random_chunk_name=cfg["teldrive"].get("random_chunk_name", True),
-            max_retries=cfg["general"].get("max_retries", 3)
+            api_host=td["api_host"],
+            access_token=td["access_token"],
+            **upload_options,
+            **pool_options,
+            scheduler=self.part_scheduler
         )
 
-    def reload_config(self):
-        """重新加载配置并重建客户端"""
+    def reload_config(self, changed: Optional[set] = None):
+        """重新加载配置，只重建受影响的客户端
+
+        Args:
+            changed: 发生变化的 section，None 表示全部
+        """
         self.config = load_config()
-        self._init_clients()
-        # upload_concurrency 变更后无需重建对象，
-        # _wait_upload_slot 每次实时读取 config 值
-        # 唤醒等待槽位的协程，让它们用新并发数重新检查
-        self._upload_slot_event.set()
-        # 异步同步 aria2 全局选项
-        asyncio.create_task(self._apply_aria2_options())
+        if changed is None:
+            changed = set(self.config)
+        if "aria2" in changed:
+            self._init_aria2()
+            if self._running:
+                self.aria2.start_notifications(self._on_aria2_notification)
+            # 异步同步 aria2 全局选项
+            asyncio.create_task(self._apply_aria2_options())
+        if changed & {"teldrive", "general"}:
+            # general.max_retries 也是 TelDrive 客户端的上传参数
+            self._init_teldrive()
+            # upload_concurrency 变更后无需重建对象：
+            # _wait_upload_slot 每次实时读取 config 值，part 调度器在 configure 中调整 worker 数
+            # 唤醒等待槽位的协程，让它们用新并发数重新检查
+            self._upload_slot_event.set()
+
+    def _on_config_changed(self, config: dict, changed: set):
+        """配置文件变化（设置页保存或手动编辑）"""
+        self.reload_config(changed)
 
     def _get_upload_path(self, local_path: str) -> str:
         """将 aria2 下载路径映射到用户配置的上传文件目录。
@@ -132,72 +235,177 @@ class TaskManager:
     async def start(self):
         """启动任务管理器"""
         await db.init_db()
+        db.start_writer()
         self._init_clients()
         # 同步配置到 aria2
         await self._apply_aria2_options()
-        # 加载已有任务的 GID 到缓存
-        all_tasks = await db.get_all_tasks()
-        for t in all_tasks:
-            if t.get("aria2_gid"):
-                self._known_gids.add(t["aria2_gid"])
+        # 一次性加载全部任务到内存，之后运行时只读内存
+        self.store.load(await db.get_all_tasks())
+        logger.info(f"已加载 {len(self.store)} 个任务")
 
         # 恢复僵死的 uploading 任务（应用重启后 uploading 状态不会自动恢复）
-        for t in all_tasks:
-            if t["status"] == "uploading":
-                task_id = t["task_id"]
-                local_path = self._get_upload_path(t.get("local_path", ""))
-                if local_path and os.path.exists(local_path):
-                    logger.info(f"恢复僵死的上传任务: {task_id} ({t.get('filename', '?')})")
-                    upload_t = asyncio.create_task(self._retry_upload(task_id))
-                    self._upload_tasks[task_id] = upload_t
-                else:
-                    logger.warning(f"僵死上传任务 {task_id} 本地文件不存在，标记失败")
-                    await db.update_task(task_id, status="failed",
-                                         error="上传中断且本地文件不存在")
+        for t in self.store.with_status("uploading"):
+            task_id = t.task_id
+            local_path = self._get_upload_path(t.local_path or "")
+            if local_path and os.path.exists(local_path):
+                logger.info(f"恢复僵死的上传任务: {task_id} ({t.filename or '?'})")
+                upload_t = asyncio.create_task(self._retry_upload(task_id))
+                self._upload_tasks[task_id] = upload_t
+            else:
+                logger.warning(f"僵死上传任务 {task_id} 本地文件不存在，标记失败")
+                await self._update_task(task_id, status="failed",
+                                        error="上传中断且本地文件不存在")
 
         self._running = True
+        # 配置变化时只重建受影响的客户端
+        app_config.subscribe(self._on_config_changed,
+                             sections=("aria2", "teldrive", "general"))
+        # 订阅 aria2 事件通知，下载完成后立即触发上传
+        self.aria2.start_notifications(self._on_aria2_notification)
         # 预热 psutil.cpu_percent()，首次调用返回 0.0，需要先调一次建立基准
         psutil.cpu_percent(interval=None)
         self._monitor_task = asyncio.create_task(self._monitor_loop())
+        self._ws_batch_task = asyncio.create_task(self._ws_batch_loop())
+        self.progress.start()
         logger.info("任务管理器已启动")
 
     async def stop(self):
         """停止任务管理器"""
         self._running = False
-        if self._monitor_task:
-            self._monitor_task.cancel()
-            try:
-                await self._monitor_task
-            except asyncio.CancelledError:
-                pass
-        # 关闭 aria2 HTTP 会话
+        app_config.unsubscribe(self._on_config_changed)
+        for bg_task in (self._monitor_task, self._ws_batch_task):
+            if bg_task:
+                bg_task.cancel()
+                try:
+                    await bg_task
+                except asyncio.CancelledError:
+                    pass
+        # 关闭 aria2 HTTP 会话和通知通道
         if self.aria2:
-            await self.aria2.close()
+            await self.aria2.close_all()
+        # 停止进度推送、part 调度器并关闭 TelDrive 连接池
+        await self.progress.stop()
+        await self.part_scheduler.stop()
+        self.content_index.shutdown()
+        if self.teldrive:
+            await self.teldrive.close()
         logger.info("任务管理器已停止")
 
-    def register_ws(self, ws):
-        """注册 WebSocket 客户端"""
-        self._ws_clients.add(ws)
+    def register_ws(self, client):
+        """注册 WebSocket 客户端（routes.ws.ClientConnection）"""
+        self._ws_clients.add(client)
 
-    def unregister_ws(self, ws):
+    def unregister_ws(self, client):
         """注销 WebSocket 客户端"""
-        self._ws_clients.discard(ws)
+        self._ws_clients.discard(client)
 
-    async def broadcast(self, message: dict):
-        """向所有 WebSocket 客户端广播消息"""
-        dead = set()
-        for ws in self._ws_clients:
+    def broadcast(self, message: dict, key: Optional[str] = None):
+        """向 v1 WebSocket 客户端广播消息（v2 客户端由 _ws_batch_loop 按 tick 推送）
+
+        只序列化一次并放入各客户端的发送队列，不等待网络；
+        key 不为空时（如 task_id），客户端积压时可用同 key 的新状态替换旧状态。
+        """
+        start = time.perf_counter()
+        payload = None
+        dead = []
+        for client in self._ws_clients:
+            if client.protocol != 1:
+                continue
+            if payload is None:
+                payload = encode_message(message)
+            if not client.send(payload, key):
+                dead.append(client)
+        for client in dead:
+            self._ws_clients.discard(client)
+        if payload is not None:
+            metrics.WS_BROADCAST_SECONDS.labels("v1").observe(time.perf_counter() - start)
+
+    def _ws_client_counts(self) -> dict:
+        counts = {("1",): 0, ("2",): 0}
+        for client in self._ws_clients:
+            key = (str(client.protocol),)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _has_ws_v2(self) -> bool:
+        return any(client.protocol >= 2 for client in self._ws_clients)
+
+    def _broadcast_global_stat(self, data: dict):
+        self.broadcast({"type": "global_stat", "data": data}, key="global_stat")
+        if self._has_ws_v2():
+            self.ws_batcher.set_global_stat(data)
+
+    def _broadcast_task_deleted(self, task_id: str):
+        self.broadcast({"type": "task_deleted", "data": {"task_id": task_id}})
+        if self._has_ws_v2():
+            self.ws_batcher.mark_removed(task_id)
+
+    async def _ws_batch_loop(self):
+        """v2 推送：每个 tick 把变化的字段合并成一帧，定期推送完整快照"""
+        while True:
+            await asyncio.sleep(self.WS_BATCH_INTERVAL)
             try:
-                await asyncio.wait_for(ws.send_json(message), timeout=3)
-            except Exception:
-                dead.add(ws)
-        self._ws_clients -= dead
+                self._flush_ws_batch()
+            except Exception as e:
+                logger.debug(f"WebSocket 增量推送异常: {e}")
+
+    def _flush_ws_batch(self):
+        clients = [c for c in self._ws_clients if c.protocol >= 2]
+        if not clients:
+            self.ws_batcher.reset()
+            return
+        start = time.perf_counter()
+        frames = []
+
+        def current(task_id):
+            record = self.store.get(task_id)
+            return record.to_dict() if record else None
+
+        # 先发本 tick 的增量：刚结束或被删除的任务不在快照中，只能由 batch 通知
+        batch = self.ws_batcher.build_batch(current)
+        if batch is not None:
+            if "tasks" in batch or "removed" in batch:
+                batch["counts"] = self.get_task_counts()
+            frames.append(batch)
+
+        now = time.monotonic()
+        if self.ws_batcher.snapshot_due(now):
+            # 只含非终态任务：历史任务不再变化，无需定期重发
+            snapshot = self.ws_batcher.build_snapshot(
+                (record.to_dict() for record in self.store.active()), now)
+            snapshot["counts"] = self.get_task_counts()
+            frames.append(snapshot)
+
+        for frame in frames:
+            # 每种编码只序列化一次
+            payloads = {}
+            for client in clients:
+                payload = payloads.get(client.encoding)
+                if payload is None:
+                    payload = payloads[client.encoding] = encode_message(frame, client.encoding)
+                if not client.send(payload):
+                    self._ws_clients.discard(client)
+        if frames:
+            metrics.WS_BROADCAST_SECONDS.labels("v2").observe(time.perf_counter() - start)
+
+    def get_ws_stats(self) -> dict:
+        """WebSocket 推送统计：客户端数、队列积压、已发送与合并次数"""
+        clients = list(self._ws_clients)
+        return {
+            "clients": len(clients),
+            "clients_v2": sum(1 for c in clients if c.protocol >= 2),
+            "batcher": dict(self.ws_batcher.stats),
+            "queued": sum(c.queued for c in clients),
+            "max_queued": max((c.queued for c in clients), default=0),
+            "sent": sum(c.stats["sent"] for c in clients),
+            "coalesced": sum(c.stats["coalesced"] for c in clients),
+        }
 
     def get_global_stat(self) -> dict:
         """获取当前缓存的全局统计数据（供 WS init 立即推送）"""
         data = {
             "download_speed": self._last_download_speed,
-            "upload_speed": int(self._upload_speed),
+            "upload_speed": int(self.progress.total_speed),
         }
         if self._disk_usage_info:
             data["disk"] = self._disk_usage_info
@@ -206,43 +414,70 @@ class TaskManager:
         return data
 
     # ===========================================
-    # 核心：监控循环 — 主动轮询 aria2 全部任务
+    # 核心：监控循环 — aria2 事件驱动 + 轮询兜底
     # ===========================================
 
+    def _on_aria2_notification(self, method: str, gid: str):
+        """aria2 事件通知回调：记录 GID 并唤醒监控循环"""
+        logger.debug(f"aria2 通知: {method} {gid}")
+        self._pending_aria2_events.add(gid)
+        self._aria2_event.set()
+
+    async def _wait_next_tick(self, timeout: float):
+        """等待下一轮：超时或收到 aria2 事件通知时返回"""
+        try:
+            await asyncio.wait_for(self._aria2_event.wait(), timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            pass
+        self._aria2_event.clear()
+
     async def _monitor_loop(self):
-        """定期轮询 aria2，同步所有下载任务到数据库和前端"""
-        import time
-        self._upload_time_snapshot = time.monotonic()
-        self._upload_total_snapshot = 0
+        """监控循环：即时处理 aria2 事件通知，定期轮询进度、CPU/磁盘并兜底对账"""
         self._last_cleanup_time = 0.0
+        last_tick = 0.0
         while self._running:
             try:
-                # 计算总上传速度
+                # 事件通知优先处理：状态变更（完成/出错/停止）无需等到下一轮轮询
+                if self._pending_aria2_events:
+                    try:
+                        await self._process_aria2_events()
+                    except Exception as e:
+                        logger.warning(f"处理 aria2 事件异常: {e}")
+
                 now = time.monotonic()
-                elapsed = now - self._upload_time_snapshot
-                if elapsed >= 2.0:
-                    current_total = sum(self._task_uploaded_bytes.values())
-                    self._upload_speed = (current_total - self._upload_total_snapshot) / elapsed
-                    if self._upload_speed < 0:
-                        self._upload_speed = 0.0
-                    self._upload_total_snapshot = current_total
-                    self._upload_time_snapshot = now
+                if now - last_tick < self.POLL_INTERVAL:
+                    await self._wait_next_tick(self.POLL_INTERVAL - (now - last_tick))
+                    continue
+                last_tick = now
 
                 # 每个步骤独立保护，单步失败不影响其他
                 # 注意顺序：先检测 CPU，再检测磁盘
                 # 确保磁盘恢复并发时能感知到最新的 CPU 状态
+                cpu_throttled = self._cpu_speed_limit > 0
                 try:
                     await self._check_cpu_usage()
                 except Exception as e:
                     logger.debug(f"CPU 检测异常: {e}")
+                self._record_throttle("cpu", cpu_throttled, self._cpu_speed_limit > 0)
 
+                disk_throttled = self._disk_throttled
                 try:
                     await self._check_disk_usage()
                 except Exception as e:
                     logger.debug(f"磁盘检测异常: {e}")
+                self._record_throttle("disk", disk_throttled, self._disk_throttled)
 
                 try:
-                    await self._sync_aria2_tasks()
+                    # 通知通道在线：只刷新活跃任务进度，定期全量对账
+                    # 通知通道断开：每轮全量同步
+                    full = (not self.aria2.notifications_connected or
+                            now - self._last_reconcile_time >= self.RECONCILE_INTERVAL)
+                    if full:
+                        self._last_reconcile_time = now
+                    sync_start = time.perf_counter()
+                    await self._sync_aria2_tasks(full=full)
+                    metrics.SYNC_TICK_SECONDS.labels("full" if full else "active").observe(
+                        time.perf_counter() - sync_start)
                 except Exception as e:
                     logger.warning(f"任务同步异常: {e}")
                     # DB 连接可能异常，尝试重建
@@ -255,16 +490,13 @@ class TaskManager:
                 try:
                     broadcast_data = {
                         "download_speed": self._last_download_speed,
-                        "upload_speed": int(self._upload_speed),
+                        "upload_speed": int(self.progress.total_speed),
                     }
                     if self._disk_usage_info:
                         broadcast_data["disk"] = self._disk_usage_info
                     if self._cpu_info:
                         broadcast_data["cpu"] = self._cpu_info
-                    await self.broadcast({
-                        "type": "global_stat",
-                        "data": broadcast_data
-                    })
+                    self._broadcast_global_stat(broadcast_data)
                 except Exception:
                     pass
 
@@ -284,13 +516,20 @@ class TaskManager:
                     except Exception as e:
                         logger.debug(f"自动重试异常: {e}")
 
-                await asyncio.sleep(2)
+                await self._wait_next_tick(self.POLL_INTERVAL)
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"监控循环异常: {e}")
                 await asyncio.sleep(5)
 
+    @staticmethod
+    def _record_throttle(kind: str, before: bool, after: bool):
+        """记录限流状态切换（throttled / released）"""
+        if before != after:
+            metrics.THROTTLE_TRANSITIONS.labels(
+                kind, "throttled" if after else "released").inc()
+
     async def _check_disk_usage(self):
         """检测磁盘使用量，通过动态调控并发数限制新任务派发"""
         max_gb = self.config["general"].get("max_disk_usage", 0)
@@ -455,16 +694,12 @@ class TaskManager:
             if cpu_pct >= cpu_limit:
                 # CPU 超上限：降低下载速度
                 if self._cpu_speed_limit == 0:
-                    # 首次限速：获取当前下载速度，限制为 75%
-                    try:
-                        stat = await self.aria2.get_global_stat()
-                        current_speed = int(stat.get("downloadSpeed", 0))
-                        if current_speed > 0:
-                            self._cpu_speed_limit = max(102400, int(current_speed * 0.75))  # 最低 100KB/s
-                        else:
-                            self._cpu_speed_limit = 1048576  # 默认限速 1MB/s
-                    except Exception:
-                        self._cpu_speed_limit = 1048576
+                    # 首次限速：取同步时缓存的下载速度（省去一次 RPC 往返），限制为 75%
+                    current_speed = self._last_download_speed
+                    if current_speed > 0:
+                        self._cpu_speed_limit = max(102400, int(current_speed * 0.75))  # 最低 100KB/s
+                    else:
+                        self._cpu_speed_limit = 1048576  # 默认限速 1MB/s
                 else:
                     # 持续高负载：继续降低 25%
                     self._cpu_speed_limit = max(102400, int(self._cpu_speed_limit * 0.75))
@@ -496,170 +731,226 @@ class TaskManager:
         except Exception as e:
             logger.debug(f"检测 CPU 使用失败: {e}")
 
-    async def _sync_aria2_tasks(self):
-        """从 aria2 获取所有任务，同步到本地数据库"""
+    async def _sync_aria2_tasks(self, full: bool = True):
+        """从 aria2 获取任务，同步到本地数据库
+
+        full=False 时只拉取活跃任务刷新进度（WebSocket 通知在线时使用），
+        状态变更由通知事件驱动，全量拉取仅作为定期兜底。
+        """
+        waiting_page = 1000
+        cursor = self.aria2.stopped_cursor
+        keys = Aria2Client.DYNAMIC_KEYS
         try:
-            # 获取 aria2 全部任务
-            active = await self.aria2.tell_active() or []
-            waiting = await self.aria2.tell_waiting(0, 1000) or []
-            # 分页拉取所有 stopped 任务，避免超过 100 条后遗漏
-            stopped = await self.aria2.tell_stopped_all() or []
+            # 一次 system.multicall 往返拉取活跃/等待列表、新停止的任务和全局统计
+            # 列表只投影动态字段，静态元数据按 GID 缓存
+            async with self.aria2.batch() as batch:
+                i_active = batch.add("aria2.tellActive", keys)
+                if full:
+                    i_waiting = batch.add("aria2.tellWaiting", 0, waiting_page, keys)
+                # 已停止列表只取末尾增量（负 offset 从最新一条开始）
+                i_stopped = batch.add("aria2.tellStopped", -1, cursor.window(), keys)
+                i_stat = batch.add("aria2.getGlobalStat")
+            active = batch.result(i_active) or []
+            stat = batch.result(i_stat) or {}
+            waiting = []
+            if full:
+                waiting = batch.result(i_waiting) or []
+                # 等待队列超过一页时继续分页
+                if int(stat.get("numWaiting", 0)) > len(waiting) >= waiting_page:
+                    waiting += await self.aria2.tell_waiting_all(
+                        page_size=waiting_page, offset=waiting_page) or []
+            stopped = await cursor.consume(self.aria2, stat, batch.result(i_stopped), keys)
+            all_aria2_tasks = active + waiting + stopped
+            metrics.SYNC_TICK_TASKS.observe(len(all_aria2_tasks))
+            # 未缓存元数据的 GID 一次批量补齐
+            missing = [
+                item["gid"] for item in all_aria2_tasks
+                if item.get("gid") and not self._is_terminal_gid(item["gid"])
+                and self.aria2.get_meta(item["gid"]) is None
+            ]
+            metas = await self.aria2.fetch_meta(missing)
         except Exception as e:
             # aria2 连接失败时静默跳过（仅每 30 秒打一次日志）
             logger.debug(f"aria2 轮询失败: {e}")
             return
 
-        all_aria2_tasks = active + waiting + stopped
-
-        # 获取 aria2 下载速度（供 monitor_loop 广播使用）
+        # 缓存 aria2 下载速度（供 monitor_loop 广播和 CPU 限速使用）
         try:
-            stat = await self.aria2.get_global_stat()
             self._last_download_speed = int(stat.get("downloadSpeed", 0))
-        except Exception:
+        except (TypeError, ValueError):
             pass
 
-        for item in all_aria2_tasks:
-            gid = item.get("gid", "")
-            if not gid:
-                continue
-
-            # 终态任务不再处理，直接跳过
-            if gid in self._terminal_gids:
-                continue
-
-            parsed = Aria2Client.parse_status(item)
-            aria2_status = parsed["status"]
-            task_dir = item.get("dir", "")
-
-            # 用 aria2 任务级的 dir + 文件名重新构造本地路径
-            # 不信任 files[0].path 中的目录部分（aria2 可能返回错误的目录）
-            bt_name = item.get("bittorrent", {}).get("info", {}).get("name", "")
-            if bt_name and task_dir:
-                # BT 下载：dir + bt_name
-                parsed["file_path"] = os.path.join(task_dir, bt_name)
-                parsed["filename"] = bt_name
-            elif task_dir and parsed["filename"]:
-                # 非 BT 下载：dir + filename
-                parsed["file_path"] = os.path.join(task_dir, parsed["filename"])
-
-            # 判断是否已入库
-            if gid not in self._known_gids:
-                # 新发现的 aria2 任务，检查是否已在数据库
-                existing = await db.get_task_by_gid(gid)
-                if not existing:
-                    # GID 可能直接作为 task_id 存在（如重启后）
-                    existing = await db.get_task(gid)
-                if existing:
-                    self._known_gids.add(gid)
-                else:
-                    task_id = gid  # 直接用 GID 作为 task_id
-                    url = ""
-                    files = item.get("files", [])
-                    if files:
-                        uris = files[0].get("uris", [])
-                        if uris:
-                            url = uris[0].get("uri", "")
-
-                    status_map = {
-                        "active": "downloading",
-                        "waiting": "pending",
-                        "paused": "paused",
-                        "complete": "completed",
-                        "error": "failed",
-                        "removed": "cancelled"
-                    }
-                    initial_status = status_map.get(aria2_status, "pending")
-
-                    await db.add_task(
-                        task_id=task_id,
-                        url=url,
-                        filename=parsed["filename"],
-                        teldrive_path=self.config["teldrive"].get("target_path", "/")
-                    )
-                    await db.update_task(
-                        task_id,
-                        status=initial_status,
-                        aria2_gid=gid,
-                        download_progress=parsed["progress"],
-                        download_speed=parsed["speed_str"],
-                        file_size=parsed["file_size"],
-                        local_path=parsed["file_path"]
-                    )
-                    self._known_gids.add(gid)
-                    logger.info(f"发现 aria2 任务: {gid} ({parsed['filename']}) 状态={initial_status}")
-                    await self._broadcast_task_update(task_id)
-
-                    # 已入库时即标记终态
-                    if initial_status in ("completed", "failed", "cancelled"):
-                        self._terminal_gids.add(gid)
-
-                    # 如果发现时已经完成，触发上传
-                    if aria2_status == "complete":
-                        local_path = parsed["file_path"]
-                        if local_path:
-                            t = asyncio.create_task(self._handle_download_complete(task_id, gid))
-                            self._upload_tasks[task_id] = t
+        try:
+            for item in all_aria2_tasks:
+                gid = item.get("gid", "")
+                meta = self.aria2.get_meta(gid) or metas.get(gid)
+                if meta is None:
+                    if gid and not self._is_terminal_gid(gid):
+                        # 元数据查询失败：跳过本轮，重置游标以免丢失已停止任务
+                        cursor.reset()
                     continue
-
-            # 已入库的任务，更新状态
-            task = await db.get_task_by_gid(gid)
-            if not task:
+                await self._process_aria2_item(item, meta)
+        except Exception:
+            # 处理中断时本轮新停止的任务可能未入库，重置游标下轮全量补齐
+            self.aria2.stopped_cursor.reset()
+            raise
+
+    def _is_terminal_gid(self, gid: str) -> bool:
+        """GID 对应的任务是否已进入终态（不再随 aria2 更新）"""
+        record = self.store.get_by_gid(gid)
+        return record is not None and record.is_terminal
+
+    async def _process_aria2_events(self):
+        """处理 aria2 推送的事件：一次批量查询对应 GID 的最新状态并同步"""
+        gids = list(self._pending_aria2_events)
+        self._pending_aria2_events.clear()
+        try:
+            async with self.aria2.batch() as batch:
+                for gid in gids:
+                    if self.aria2.get_meta(gid) is None:
+                        # 未缓存：取完整状态，顺便填充元数据缓存
+                        batch.add("aria2.tellStatus", gid)
+                    else:
+                        batch.add("aria2.tellStatus", gid, Aria2Client.DYNAMIC_KEYS)
+        except Exception as e:
+            logger.debug(f"批量查询 aria2 任务失败: {e}")
+            return
+        for gid, item in zip(gids, batch.results):
+            if isinstance(item, Exception):
+                logger.debug(f"查询 aria2 任务 {gid} 失败: {item}")
                 continue
+            if item:
+                meta = self.aria2.get_meta(gid) or self.aria2.remember_meta(item)
+                await self._process_aria2_item(item, meta)
 
-            task_id = task["task_id"]
-            current_status = task["status"]
+    async def _process_aria2_item(self, item: dict, meta: dict):
+        """同步单个 aria2 任务状态到本地数据库，下载完成时触发上传
 
-            # 已完成上传、已取消、已失败的任务不再更新
-            if current_status in ("completed", "cancelled", "failed"):
-                self._terminal_gids.add(gid)
-                continue
+        item 只需包含动态字段，文件名/路径等取自缓存的静态元数据 meta。
+        """
+        gid = item.get("gid", "")
+        if not gid:
+            return
 
-            # 正在上传中的任务不更新下载状态
-            if current_status == "uploading":
-                continue
+        # 终态任务不再处理，直接跳过
+        task = self.store.get_by_gid(gid)
+        if task is not None and task.is_terminal:
+            return
 
-            update_data = {
-                "download_progress": parsed["progress"],
-                "download_speed": parsed["speed_str"],
-                "file_size": parsed["file_size"],
+        parsed = Aria2Client.parse_status(item, meta)
+        aria2_status = parsed["status"]
+        # aria2 侧进入终态后元数据不再需要，释放缓存
+        if aria2_status in ("complete", "error", "removed"):
+            self.aria2.forget_meta(gid)
+
+        # 新发现的 aria2 任务（不在内存存储中）→ 入库
+        if task is None:
+            task_id = gid  # 直接用 GID 作为 task_id
+            url = parsed["url"]
+
+            status_map = {
+                "active": "downloading",
+                "waiting": "pending",
+                "paused": "paused",
+                "complete": "completed",
+                "error": "failed",
+                "removed": "cancelled"
             }
-            if parsed["filename"]:
-                update_data["filename"] = parsed["filename"]
-            if parsed["file_path"]:
-                update_data["local_path"] = parsed["file_path"]
-
-            if aria2_status == "active":
-                update_data["status"] = "downloading"
-            elif aria2_status == "waiting":
-                update_data["status"] = "pending"
-            elif aria2_status == "paused":
-                update_data["status"] = "paused"
-            elif aria2_status == "complete":
-                update_data["status"] = "uploading"
-                update_data["download_progress"] = 100.0
-                update_data["download_speed"] = ""
-            elif aria2_status == "error":
-                error_code = item.get("errorCode", "")
-                error_msg = item.get("errorMessage", "下载失败")
-                update_data["status"] = "failed"
-                update_data["error"] = f"aria2 错误 [{error_code}]: {error_msg}"
-            elif aria2_status == "removed":
-                update_data["status"] = "cancelled"
-
-            await db.update_task(task_id, **update_data)
-            # 合并更新数据到已有 task 记录用于广播，避免再次查库
-            task.update(update_data)
-            await self._broadcast_task_update(task_id, task)
-
-            # 下载完成 → 触发上传
-            if aria2_status == "complete" and current_status != "uploading":
+            initial_status = status_map.get(aria2_status, "pending")
+
+            await self._add_task(
+                task_id=task_id,
+                url=url,
+                filename=parsed["filename"],
+                teldrive_path=self.config["teldrive"].get("target_path", "/")
+            )
+            await self._update_task(
+                task_id,
+                status=initial_status,
+                aria2_gid=gid,
+                download_progress=parsed["progress"],
+                download_speed=parsed["speed_str"],
+                file_size=parsed["file_size"],
+                local_path=parsed["file_path"]
+            )
+            logger.info(f"发现 aria2 任务: {gid} ({parsed['filename']}) 状态={initial_status}")
+            self._broadcast_task_update(task_id)
+
+            # 如果发现时已经完成，触发上传
+            if aria2_status == "complete":
                 local_path = parsed["file_path"]
                 if local_path:
                     t = asyncio.create_task(self._handle_download_complete(task_id, gid))
                     self._upload_tasks[task_id] = t
-                else:
-                    await db.update_task(task_id, status="completed")
-                    await self._broadcast_task_update(task_id)
+            return
+
+        task_id = task.task_id
+        current_status = task.status
+
+        # 正在上传中的任务不更新下载状态
+        if current_status == "uploading":
+            return
+
+        update_data = {
+            "download_progress": parsed["progress"],
+            "download_speed": parsed["speed_str"],
+            "file_size": parsed["file_size"],
+        }
+        if parsed["filename"]:
+            update_data["filename"] = parsed["filename"]
+        if parsed["file_path"]:
+            update_data["local_path"] = parsed["file_path"]
+
+        if aria2_status == "active":
+            update_data["status"] = "downloading"
+        elif aria2_status == "waiting":
+            update_data["status"] = "pending"
+        elif aria2_status == "paused":
+            update_data["status"] = "paused"
+        elif aria2_status == "complete":
+            update_data["status"] = "uploading"
+            update_data["download_progress"] = 100.0
+            update_data["download_speed"] = ""
+        elif aria2_status == "error":
+            error_code = item.get("errorCode", "")
+            error_msg = item.get("errorMessage", "下载失败")
+            update_data["status"] = "failed"
+            update_data["error"] = f"aria2 错误 [{error_code}]: {error_msg}"
+        elif aria2_status == "removed":
+            update_data["status"] = "cancelled"
+
+        await self._update_task(task_id, **update_data)
+        self._broadcast_task_update(task_id)
+
+        # 边下边传（可选）：下载中即上传已下载完成的 part
+        if aria2_status == "active":
+            self._maybe_start_pipelined_upload(task, parsed, meta)
+
+        # 下载完成 → 触发上传（边下边传中的任务由其自行收尾）
+        if aria2_status == "complete" and current_status != "uploading" and not task.upload_running:
+            local_path = parsed["file_path"]
+            if local_path:
+                t = asyncio.create_task(self._handle_download_complete(task_id, gid))
+                self._upload_tasks[task_id] = t
+            else:
+                await self._update_task(task_id, status="completed")
+                self._broadcast_task_update(task_id)
+
+    def _maybe_start_pipelined_upload(self, record: TaskRecord, parsed: dict, meta: dict):
+        """满足条件时为下载中的单文件任务启动边下边传"""
+        if not self.config["teldrive"].get("pipelined_upload", False):
+            return
+        if record.upload_running or record.task_id in self._pipeline_disabled:
+            return
+        # 只处理路径已确定的单文件；不足一个 chunk 的文件没有可提前上传的部分
+        if parsed["is_dir"] or not parsed["file_path"] or not (meta and meta.get("complete")):
+            return
+        if parsed["total_length"] <= self.teldrive.chunk_size:
+            return
+        record.upload_running = True
+        t = asyncio.create_task(self._pipelined_upload(
+            record.task_id, parsed["gid"], parsed["file_path"], parsed["total_length"]))
+        self._upload_tasks[record.task_id] = t
 
     def _calc_teldrive_path(self, local_path: str) -> str:
         """计算文件在 TelDrive 上的目标目录，保留下载目录中的子目录结构。"""
@@ -696,11 +987,17 @@ class TaskManager:
         return result
 
     async def _wait_upload_slot(self):
-        """等待可用的上传槽位（动态读取配置的并发数）"""
+        """等待可用的上传槽位（动态读取配置的并发数）
+
+        槽位只限制同时处于上传阶段的任务数；真正在传输中的 part 数
+        由全局 part 调度器控制，不会随任务数成倍增加。
+        """
+        start = time.perf_counter()
         while True:
             max_uploads = self.config["teldrive"].get("upload_concurrency", 4)
             if self._active_uploads < max_uploads:
                 self._active_uploads += 1
+                metrics.UPLOAD_SLOT_WAIT_SECONDS.observe(time.perf_counter() - start)
                 return
             self._upload_slot_event.clear()
             await self._upload_slot_event.wait()
@@ -712,19 +1009,22 @@ class TaskManager:
 
     async def _handle_download_complete(self, task_id: str, gid: str):
         """下载完成后自动上传到 TelDrive（受并发限制）"""
-        if gid in self._uploading_gids:
+        record = self.store.get(task_id)
+        if record is None or record.upload_running:
+            # 不会进入下方 finally，调用方登记的协程记录在这里移除
+            self._forget_upload_task(task_id)
             return
-        self._uploading_gids.add(gid)
+        record.upload_running = True
 
         # 等待上传槽位（动态读取并发数配置）
         await self._wait_upload_slot()
         try:
-            task = await db.get_task(task_id)
-            if not task or not task.get("local_path"):
+            task = self.store.get(task_id)
+            if not task or not task.local_path:
                 logger.warning(f"任务 {task_id} 无本地文件路径，跳过上传")
                 return
 
-            local_path = self._get_upload_path(task["local_path"])
+            local_path = self._get_upload_path(task.local_path)
             teldrive_path = self._calc_teldrive_path(local_path)
 
             # 等待文件就绪（aria2 可能还在写入/移动文件）
@@ -754,13 +1054,13 @@ class TaskManager:
                 except Exception:
                     pass
                 error_msg = f"本地文件不存在: {local_path}"
-                await db.update_task(task_id, status="failed", error=error_msg)
-                await self._broadcast_task_update(task_id)
+                await self._update_task(task_id, status="failed", error=error_msg)
+                self._broadcast_task_update(task_id)
                 return
 
-            await db.update_task(task_id, status="uploading",
-                                 download_progress=100.0, download_speed="")
-            await self._broadcast_task_update(task_id)
+            await self._update_task(task_id, status="uploading",
+                                    download_progress=100.0, download_speed="")
+            self._broadcast_task_update(task_id)
 
             if os.path.isdir(local_path):
                 logger.info(f"[上传] 走文件夹上传: {local_path}")
@@ -778,18 +1078,31 @@ class TaskManager:
             # 不标记 failed，让重试逻辑接管
         except Exception as e:
             logger.error(f"任务 {task_id} 上传失败: {e}")
-            await db.update_task(task_id, status="failed", error=str(e))
-            await self._broadcast_task_update(task_id)
+            await self._update_task(task_id, status="failed", error=str(e),
+                                    upload_speed="")
+            self._broadcast_task_update(task_id)
         finally:
             self._release_upload_slot()
-            self._uploading_gids.discard(gid)
-            self._upload_tasks.pop(task_id, None)
+            if self._forget_upload_task(task_id):
+                record.upload_running = False
+
+    def _forget_upload_task(self, task_id: str) -> bool:
+        """移除当前协程的上传记录
+
+        已被重试登记的新协程替换时保留新记录并返回 False，
+        调用方此时不应再清除 upload_running（标记已属于新协程）。
+        """
+        current = asyncio.current_task()
+        registered = self._upload_tasks.get(task_id)
+        if registered is current:
+            del self._upload_tasks[task_id]
+        return registered is None or registered is current
 
     async def _auto_delete_local(self, task_id: str, local_path: str):
         """上传成功后自动删除本地文件（如果配置了 auto_delete）"""
         try:
-            task = await db.get_task(task_id)
-            if not task or task["status"] != "completed":
+            task = self.store.get(task_id)
+            if not task or task.status != "completed":
                 return
             if not self.config["general"].get("auto_delete", True):
                 return
@@ -819,11 +1132,10 @@ class TaskManager:
         if not self.config["general"].get("auto_delete", True):
             return
         try:
-            all_tasks = await db.get_all_tasks()
             max_retries = self.config["general"].get("max_retries", 3)
-            for task in all_tasks:
-                status = task["status"]
-                task_id = task["task_id"]
+            for task in self.store.with_status("completed", "failed"):
+                status = task.status
+                task_id = task.task_id
 
                 # 已完成：清理残留文件
                 should_clean = (status == "completed")
@@ -837,7 +1149,11 @@ class TaskManager:
                 if not should_clean:
                     continue
 
-                local_path = task.get("local_path", "")
+                if status == "failed":
+                    # 不再重试，已上传的 parts 也无需保留
+                    await self._discard_upload_sessions(task_id)
+
+                local_path = task.local_path
                 if not local_path:
                     continue
                 local_path = self._get_upload_path(local_path)
@@ -860,19 +1176,15 @@ class TaskManager:
         """自动重试失败的上传任务，超过 max_retries 次后放弃并清理本地文件"""
         max_retries = self.config["general"].get("max_retries", 3)
         try:
-            all_tasks = await db.get_all_tasks()
-            for task in all_tasks:
-                if task["status"] != "failed":
-                    continue
-
-                task_id = task["task_id"]
+            for task in self.store.with_status("failed"):
+                task_id = task.task_id
 
                 # 已经在重试中的跳过
                 if task_id in self._upload_tasks:
                     continue
 
                 # 没有本地文件的跳过（不是上传失败）
-                local_path = task.get("local_path", "")
+                local_path = task.local_path
                 if not local_path:
                     continue
                 local_path = self._get_upload_path(local_path)
@@ -893,14 +1205,61 @@ class TaskManager:
         except Exception as e:
             logger.debug(f"自动重试扫描异常: {e}")
 
+    # ===========================================
+    # 上传会话（断点续传）
+    # ===========================================
+
+    async def _open_upload_session(self, task_id: str, file_path: str) -> UploadSession:
+        """加载或新建任务文件的上传会话，本地文件变化时放弃旧会话"""
+        st = os.stat(file_path)
+        row = await db.get_upload_session(task_id, file_path)
+        if row and (row["file_size"] != st.st_size or
+                    abs((row["file_mtime"] or 0) - st.st_mtime) > 0.001):
+            logger.info(f"本地文件已变化，放弃旧上传会话 {row['upload_id']}: {file_path}")
+            await self._drop_upload_session(row)
+            row = None
+
+        if row is None:
+            upload_id = str(uuid.uuid4())
+            chunk_size = self.teldrive.chunk_size
+            parts = []
+            await db.save_upload_session(task_id, file_path, upload_id,
+                                         chunk_size, st.st_size, st.st_mtime)
+        else:
+            upload_id = row["upload_id"]
+            chunk_size = row["chunk_size"]
+            parts = row["parts"]
+            logger.info(f"任务 {task_id} 续传 {os.path.basename(file_path)}: "
+                        f"upload_id={upload_id}, 已完成 {len(parts)} 块")
+
+        async def persist(session: UploadSession):
+            await db.update_upload_session_parts(
+                task_id, file_path, list(session.completed_parts))
+
+        return UploadSession(upload_id, chunk_size, parts, persist)
+
+    async def _drop_upload_session(self, row: dict):
+        """删除单个上传会话及 TelDrive 上已上传的 parts"""
+        try:
+            await self.teldrive.cleanup_upload(row["upload_id"])
+        except Exception as e:
+            logger.debug(f"清理上传记录失败: {e}")
+        await db.delete_upload_session(row["task_id"], row["file_path"])
+
+    async def _discard_upload_sessions(self, task_id: str):
+        """放弃任务的全部上传会话（取消/删除/重新下载时调用）"""
+        try:
+            for row in await db.get_upload_sessions(task_id):
+                await self._drop_upload_session(row)
+        except Exception as e:
+            logger.debug(f"清理任务 {task_id} 上传会话失败: {e}")
+
     # ===========================================
     # 上传
     # ===========================================
 
     async def _upload_directory(self, task_id: str, dir_path: str, teldrive_path: str = "/"):
         """递归上传文件夹到 TelDrive，保留目录结构"""
-        import time
-
         # 收集所有文件及其大小
         # 直接使用 teldrive_path 作为基础路径，不额外嵌套文件夹名
         base_teldrive_path = teldrive_path.rstrip("/") if teldrive_path != "/" else "/"
@@ -914,133 +1273,324 @@ class TaskManager:
 
         if not all_files:
             logger.warning(f"任务 {task_id} 文件夹为空: {dir_path}")
-            await db.update_task(task_id, status="completed", upload_progress=100.0)
-            await self._broadcast_task_update(task_id)
+            await self._update_task(task_id, status="completed", upload_progress=100.0)
+            self._broadcast_task_update(task_id)
             return
 
         total_size = sum(s for _, _, s in all_files)
-        uploaded_total = [0]  # 已上传的总字节数
-        _last_broadcast = [0.0]
-        _last_progress = [0.0]
-
-        # 注册 per-task 字节追踪
-        self._task_uploaded_bytes[task_id] = 0
+        # 所有文件的 part 计入同一个任务级进度
+        progress = self.progress.track(task_id, total_size)
 
+        file_workers = max(1, min(self.config["teldrive"].get("file_concurrency", 3),
+                                  len(all_files)))
         logger.info(f"任务 {task_id} 检测到文件夹: {dir_path}，"
                     f"共 {len(all_files)} 个文件，总大小 {total_size} bytes，"
-                    f"上传到 {base_teldrive_path}")
+                    f"上传到 {base_teldrive_path}，文件并发={file_workers}")
 
-        upload_timeout_per_file = self.config["general"].get("max_retries", 3) * 300
+        upload_idle_timeout = self.config["general"].get("max_retries", 3) * 300
 
-        for idx, (full_path, rel_path, file_size) in enumerate(all_files, 1):
-            # 计算该文件在 TelDrive 上的目标路径
+        def target_dir(rel_path: str) -> str:
+            # 计算文件在 TelDrive 上的目标路径
             rel_dir = os.path.dirname(rel_path).replace("\\", "/")
             if rel_dir:
-                file_teldrive_path = base_teldrive_path + "/" + rel_dir
-            else:
-                file_teldrive_path = base_teldrive_path
+                return base_teldrive_path.rstrip("/") + "/" + rel_dir
+            return base_teldrive_path
+
+        # 上传前一次性补齐整棵目录树（由浅到深，只创建缓存中没有的目录），
+        # 之后每个文件的目录检查都命中缓存
+        target_dirs = {target_dir(rel_path) for _, rel_path, _ in all_files}
+        teldrive = self.teldrive
+        try:
+            created = await teldrive.ensure_directories(target_dirs)
+            if created:
+                logger.info(f"任务 {task_id} 已创建/确认 {created} 个 TelDrive 目录")
+        except Exception as e:
+            # 失败的目录在上传各文件时会再次尝试创建
+            logger.warning(f"任务 {task_id} 预创建目录失败: {e}")
+        # 每个目标目录只分页拉取一次列表，同名检测改查本地索引
+        await teldrive.prefetch_listings(target_dirs)
+
+        async def upload_one(idx: int, full_path: str, rel_path: str, file_size: int):
+            file_teldrive_path = target_dir(rel_path)
 
             logger.info(f"任务 {task_id} 上传文件 [{idx}/{len(all_files)}]: "
                         f"{rel_path} -> {file_teldrive_path}")
 
-            # 为每个文件创建进度回调（汇总到整体进度）
-            file_uploaded_before = uploaded_total[0]
-
-            async def make_progress_cb(base_uploaded):
-                async def progress_callback(uploaded: int, total: int):
-                    if total_size > 0:
-                        current_total = base_uploaded + uploaded
-                        self._task_uploaded_bytes[task_id] = current_total
-                        progress = round(current_total / total_size * 100, 1)
-                        now = time.monotonic()
-                        if (progress - _last_progress[0] >= 1.0 or
-                                now - _last_broadcast[0] >= 1.0 or
-                                progress >= 100.0):
-                            _last_progress[0] = progress
-                            _last_broadcast[0] = now
-                            await db.update_task(task_id, upload_progress=progress)
-                            await self._broadcast_task_update(task_id)
-                return progress_callback
-
-            cb = await make_progress_cb(file_uploaded_before)
-
+            upload_session = await self._open_upload_session(task_id, full_path)
             try:
-                result = await asyncio.wait_for(
-                    self.teldrive.upload_file_chunked(
-                        full_path, file_teldrive_path, cb
+                result = await self._run_upload_watchdog(
+                    self._upload_file(
+                        full_path, file_teldrive_path, progress,
+                        upload_session, schedule_key=task_id
                     ),
-                    timeout=upload_timeout_per_file
+                    task_id, progress, upload_idle_timeout
                 )
             except asyncio.TimeoutError:
-                raise Exception(f"上传超时: {rel_path}（超过 {upload_timeout_per_file}s）")
+                raise Exception(f"上传超时: {rel_path}（{upload_idle_timeout}s 无进展）")
 
             if not result.get("success"):
                 raise Exception(f"上传失败: {rel_path} - {result.get('error', '未知错误')}")
+            await db.delete_upload_session(task_id, full_path)
 
-            uploaded_total[0] += file_size
             logger.info(f"任务 {task_id} 文件上传成功: {rel_path}")
 
+        # 有界文件级并发：固定数量的 worker 依次领取文件
+        pending_files = iter(enumerate(all_files, 1))
+
+        async def worker():
+            for idx, (full_path, rel_path, file_size) in pending_files:
+                await upload_one(idx, full_path, rel_path, file_size)
+
+        workers = [asyncio.create_task(worker()) for _ in range(file_workers)]
+        try:
+            done, pending = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception():
+                    raise task.exception()
+        finally:
+            # 任一文件失败（或整个上传被取消）时中止其余文件，
+            # 等它们退出后再返回；已上传的 parts 由上传会话保留，重试时续传
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.progress.untrack(task_id)
+            teldrive.release_listings(target_dirs)
+
         # 所有文件上传完成
-        self._task_uploaded_bytes.pop(task_id, None)
-        await db.update_task(task_id, status="completed", upload_progress=100.0)
-        await self._broadcast_task_update(task_id)
+        await self._update_task(task_id, status="completed", upload_progress=100.0,
+                                upload_speed="")
+        self._broadcast_task_update(task_id)
         logger.info(f"任务 {task_id} 文件夹上传完成: {dir_path}，共 {len(all_files)} 个文件")
 
-    async def _upload(self, task_id: str, local_path: str, teldrive_path: str = "/"):
-        """上传单个文件到 TelDrive"""
-        import time
-        _last_broadcast = [0.0]   # 上次广播时间
-        _last_progress = [0.0]    # 上次广播的进度值
+    async def _run_upload_watchdog(self, coro, task_id: str, progress: TransferProgress,
+                                   idle_timeout: float):
+        """运行上传协程，连续 idle_timeout 秒无进展时取消并抛出 asyncio.TimeoutError
 
-        # 注册 per-task 字节追踪
-        self._task_uploaded_bytes[task_id] = 0
-
-        async def progress_callback(uploaded: int, total: int):
-            if total > 0:
-                self._task_uploaded_bytes[task_id] = uploaded
-                progress = round(uploaded / total * 100, 1)
+        已发送字节数变化即视为有进展；part 在全局调度器中排队等待 worker 的时间
+        不计入空闲时间，负载高时排队再久的文件也不会被误判超时。
+        """
+        upload = asyncio.ensure_future(coro)
+        last_uploaded = progress.uploaded
+        idle_since = time.monotonic()
+        try:
+            while True:
+                done, _ = await asyncio.wait([upload], timeout=self.UPLOAD_WATCHDOG_INTERVAL)
+                if done:
+                    return upload.result()
                 now = time.monotonic()
+                uploaded = progress.uploaded
+                if uploaded != last_uploaded or self.part_scheduler.is_queued(task_id):
+                    last_uploaded = uploaded
+                    idle_since = now
+                elif now - idle_since >= idle_timeout:
+                    raise asyncio.TimeoutError()
+        finally:
+            if not upload.done():
+                upload.cancel()
+                await asyncio.gather(upload, return_exceptions=True)
+
+    async def _upload(self, task_id: str, local_path: str, teldrive_path: str = "/"):
+        """上传单个文件到 TelDrive"""
+        # 沿用上次失败时的上传会话，跳过已上传的 parts
+        upload_session = await self._open_upload_session(task_id, local_path)
+        progress = self.progress.track(task_id, os.path.getsize(local_path))
 
-                # 节流：进度变化 ≥ 1% 或距上次超 1 秒才广播
-                if (progress - _last_progress[0] >= 1.0 or
-                        now - _last_broadcast[0] >= 1.0 or
-                        progress >= 100.0):
-                    _last_progress[0] = progress
-                    _last_broadcast[0] = now
-                    await db.update_task(task_id, upload_progress=progress)
-                    await self._broadcast_task_update(task_id)
-
-        # 整体超时保护：防止上传无限挂起 (15 分钟)
-        upload_timeout = self.config["general"].get("max_retries", 3) * 300
+        # 无进展超时保护：防止上传无限挂起（默认 15 分钟无进展）
+        upload_idle_timeout = self.config["general"].get("max_retries", 3) * 300
         try:
-            result = await asyncio.wait_for(
-                self.teldrive.upload_file_chunked(
-                    local_path, teldrive_path, progress_callback
+            result = await self._run_upload_watchdog(
+                self._upload_file(
+                    local_path, teldrive_path, progress,
+                    upload_session, schedule_key=task_id
                 ),
-                timeout=upload_timeout
+                task_id, progress, upload_idle_timeout
             )
         except asyncio.TimeoutError:
-            raise Exception(f"上传超时（超过 {upload_timeout}s）")
-
-        self._task_uploaded_bytes.pop(task_id, None)  # 上传完成，移除追踪
+            raise Exception(f"上传超时（{upload_idle_timeout}s 无进展）")
+        finally:
+            self.progress.untrack(task_id)  # 上传结束，停止推送进度
 
         if result.get("success"):
-            await db.update_task(task_id, status="completed",
-                                 upload_progress=100.0)
-            await self._broadcast_task_update(task_id)
+            await db.delete_upload_session(task_id, local_path)
+            await self._update_task(task_id, status="completed",
+                                    upload_progress=100.0, upload_speed="")
+            self._broadcast_task_update(task_id)
             logger.info(f"任务 {task_id} 上传完成")
         else:
             error = result.get("error", "上传失败")
             raise Exception(error)
 
-    async def _broadcast_task_update(self, task_id: str, task_data: dict = None):
-        """广播任务状态更新（优先使用传入的 task_data 避免查库）"""
-        task = task_data or await db.get_task(task_id)
+    async def _upload_file(self, local_path: str, teldrive_path: str,
+                           progress: TransferProgress, upload_session: UploadSession,
+                           schedule_key: str) -> dict:
+        """上传单个文件；开启内容去重时先查内容索引，内容相同则复用已有 parts"""
+        teldrive = self.teldrive
+        if not self.config["teldrive"].get("content_dedup", False):
+            return await teldrive.upload_file_chunked(
+                local_path, teldrive_path, progress,
+                upload_session, schedule_key=schedule_key
+            )
+
+        file_size = os.path.getsize(local_path)
+        name = os.path.basename(local_path)
+        match, digest = await self.content_index.lookup(local_path, file_size)
+        if match:
+            result = await teldrive.create_file_from_parts(
+                name, teldrive_path, match["parts"], file_size, match["file_id"]
+            )
+            if result.get("success"):
+                self.content_index.stats["reused"] += 1
+                self.content_index.stats["reused_bytes"] += file_size
+                progress.part_done(("reused", local_path), file_size)
+                if upload_session.completed_parts:
+                    # 之前失败留下的部分上传已无用
+                    try:
+                        await teldrive.cleanup_upload(upload_session.upload_id)
+                    except Exception:
+                        pass
+                return result
+            if result.get("conflict"):
+                # 正常上传同样会先删除同名文件，连带删除共享的 parts，不再回退
+                return result
+            if result.get("stale"):
+                await self.content_index.forget(match)
+            logger.info(f"文件 {name} 无法复用已有 parts，改为正常上传: {result.get('error')}")
+
+        # 未命中：上传的同时在后台计算哈希，成功后写入索引
+        hashing = None if digest else self.content_index.start_digest(local_path, file_size)
+        try:
+            result = await teldrive.upload_file_chunked(
+                local_path, teldrive_path, progress,
+                upload_session, schedule_key=schedule_key
+            )
+            data = result.get("data")
+            if (result.get("success") and file_size > 0 and result.get("parts")
+                    and isinstance(data, dict) and data.get("id")):
+                try:
+                    if digest is None:
+                        digest = await hashing
+                    await self.content_index.record(
+                        digest, file_size, str(data["id"]), name,
+                        teldrive_path, result["parts"]
+                    )
+                except Exception as e:
+                    logger.warning(f"记录内容索引失败 {name}: {e}")
+            return result
+        finally:
+            if hashing is not None and not hashing.done():
+                hashing.cancel()
+
+    async def _emit_upload_progress(self, task_id: str, progress: TransferProgress):
+        """ProgressEmitter 周期回调：把内存计数写入任务并广播（只在变化时）"""
+        record = self.store.get(task_id)
+        # downloading：边下边传
+        if record is None or record.status not in ("uploading", "downloading"):
+            return
+        percent = round(progress.percent, 1)
+        speed = _format_speed(int(progress.speed))
+        if percent == record.upload_progress and speed == record.upload_speed:
+            return
+        await self._update_task(task_id, upload_progress=percent, upload_speed=speed)
+        self._broadcast_task_update(task_id)
+
+    async def _pipelined_upload(self, task_id: str, gid: str, local_path: str, file_size: int):
+        """边下边传：按 aria2 bitfield 上传已下载完成的 part，下载完成后补齐剩余 part 并创建文件记录
+
+        不占用上传槽位，part 仍受全局调度器限制。下载尚未完成时失败会放弃本次
+        上传会话，回退到下载完成后的常规上传。
+        """
+        record = self.store.get(task_id)
+        upload_path = self._get_upload_path(local_path)
+        first_poll = [True]
+
+        async def wait_ready():
+            if not first_poll[0]:
+                await asyncio.sleep(self.POLL_INTERVAL)
+            first_poll[0] = False
+            pieces = await self.aria2.tell_pieces(gid)
+            if pieces.status in ("error", "removed"):
+                raise Exception(f"下载已终止 ({pieces.status}): {pieces.error}")
+            if pieces.complete and record.status != "uploading":
+                await self._update_task(task_id, status="uploading",
+                                        download_progress=100.0, download_speed="")
+                self._broadcast_task_update(task_id)
+            return pieces
+
+        try:
+            logger.info(f"任务 {task_id} 开始边下边传: {upload_path} ({file_size} bytes)")
+            teldrive_path = self._calc_teldrive_path(upload_path)
+            upload_session = await self._open_upload_session(task_id, upload_path)
+            progress = self.progress.track(task_id, file_size)
+            try:
+                result = await self.teldrive.upload_file_chunked(
+                    upload_path, teldrive_path, progress, upload_session,
+                    schedule_key=task_id, file_size=file_size, wait_ready=wait_ready
+                )
+            finally:
+                self.progress.untrack(task_id)
+
+            if not result.get("success"):
+                raise Exception(result.get("error", "上传失败"))
+            await db.delete_upload_session(task_id, upload_path)
+            await self._update_task(task_id, status="completed",
+                                    upload_progress=100.0, upload_speed="")
+            self._broadcast_task_update(task_id)
+            logger.info(f"任务 {task_id} 边下边传完成")
+            await self._auto_delete_local(task_id, upload_path)
+
+        except asyncio.CancelledError:
+            logger.info(f"任务 {task_id} 边下边传被取消")
+        except Exception as e:
+            if record.status == "uploading":
+                # 下载已完成：按上传失败处理，由自动重试接管
+                logger.error(f"任务 {task_id} 边下边传失败: {e}")
+                await self._update_task(task_id, status="failed", error=str(e),
+                                        upload_speed="")
+            else:
+                logger.warning(f"任务 {task_id} 边下边传失败，下载完成后改为常规上传: {e}")
+                self._pipeline_disabled.add(task_id)
+                await self._discard_upload_sessions(task_id)
+                await self._update_task(task_id, upload_progress=0.0, upload_speed="")
+            self._broadcast_task_update(task_id)
+        finally:
+            if self._forget_upload_task(task_id):
+                record.upload_running = False
+
+    async def _add_task(self, task_id: str, url: str, filename: str = None,
+                        teldrive_path: str = "/") -> TaskRecord:
+        """新建任务：写入数据库并加入内存存储"""
+        row = await db.add_task(task_id, url, filename, teldrive_path)
+        if row is None:
+            row = {"task_id": task_id, "url": url, "filename": filename,
+                   "teldrive_path": teldrive_path}
+        return self.store.add(row)
+
+    async def _update_task(self, task_id: str, **fields) -> Optional[TaskRecord]:
+        """更新任务：先改内存（运行时以内存为准），再写穿到数据库
+
+        与内存记录相同的字段不再写入；只有状态真正变化时才立即落盘，
+        每轮同步重复设置的同一状态仍走写合并。
+        """
+        record = self.store.get(task_id)
+        if record is None:
+            return None
+        changed = {k: v for k, v in fields.items() if getattr(record, k) != v}
+        if not changed:
+            return record
+        self.store.update(task_id, **changed)
+        await db.update_task(task_id, flush="status" in changed, **changed)
+        return record
+
+    def _broadcast_task_update(self, task_id: str):
+        """广播任务状态更新（直接读内存记录，不查库）"""
+        task = self.store.get(task_id)
         if task:
-            await self.broadcast({
+            self.broadcast({
                 "type": "task_update",
-                "data": task
-            })
+                "data": task.to_dict()
+            }, key=task_id)
+            if self._has_ws_v2():
+                self.ws_batcher.mark(task_id)
 
     # ===========================================
     # 手动添加任务（通过面板）
@@ -1058,12 +1608,11 @@ class TaskManager:
         gid = await self.aria2.add_uri(url, options)
 
         # 入库（用 GID 作为 task_id）
-        task = await db.add_task(gid, url, filename, teldrive_path)
-        await db.update_task(gid, status="downloading", aria2_gid=gid)
-        self._known_gids.add(gid)
+        await self._add_task(gid, url, filename, teldrive_path)
+        record = await self._update_task(gid, status="downloading", aria2_gid=gid)
 
-        await self._broadcast_task_update(gid)
-        return await db.get_task(gid)
+        self._broadcast_task_update(gid)
+        return record.to_dict()
 
     # ===========================================
     # 任务操作
@@ -1071,59 +1620,61 @@ class TaskManager:
 
     async def pause_task(self, task_id: str) -> dict:
         """暂停任务"""
-        task = await db.get_task(task_id)
+        task = self.store.get(task_id)
         if not task:
             return {"success": False, "message": "任务不存在"}
-        if task["status"] != "downloading":
+        if task.status != "downloading":
             return {"success": False, "message": "只能暂停下载中的任务"}
 
         try:
-            await self.aria2.pause(task["aria2_gid"])
-            await db.update_task(task_id, status="paused")
-            await self._broadcast_task_update(task_id)
+            await self.aria2.pause(task.aria2_gid)
+            await self._update_task(task_id, status="paused")
+            self._broadcast_task_update(task_id)
             return {"success": True, "message": "已暂停"}
         except Exception as e:
             return {"success": False, "message": str(e)}
 
     async def resume_task(self, task_id: str) -> dict:
         """恢复任务"""
-        task = await db.get_task(task_id)
+        task = self.store.get(task_id)
         if not task:
             return {"success": False, "message": "任务不存在"}
-        if task["status"] != "paused":
+        if task.status != "paused":
             return {"success": False, "message": "只能恢复已暂停的任务"}
 
         try:
-            await self.aria2.unpause(task["aria2_gid"])
-            await db.update_task(task_id, status="downloading")
-            await self._broadcast_task_update(task_id)
+            await self.aria2.unpause(task.aria2_gid)
+            await self._update_task(task_id, status="downloading")
+            self._broadcast_task_update(task_id)
             return {"success": True, "message": "已恢复"}
         except Exception as e:
             return {"success": False, "message": str(e)}
 
     async def cancel_task(self, task_id: str) -> dict:
         """取消任务"""
-        task = await db.get_task(task_id)
+        task = self.store.get(task_id)
         if not task:
             return {"success": False, "message": "任务不存在"}
-        if task["status"] in ("completed", "cancelled"):
+        if task.status in ("completed", "cancelled"):
             return {"success": False, "message": "任务已结束"}
 
         try:
-            if task.get("aria2_gid"):
+            if task.aria2_gid:
                 try:
-                    await self.aria2.force_remove(task["aria2_gid"])
+                    await self.aria2.force_remove(task.aria2_gid)
                 except Exception:
                     pass
+            # 放弃续传：删除 TelDrive 上已上传的 parts
+            await self._discard_upload_sessions(task_id)
             # 删除本地文件/文件夹（映射到实际路径）
-            local = self._get_upload_path(task.get("local_path", ""))
+            local = self._get_upload_path(task.local_path or "")
             if local and os.path.exists(local):
                 if os.path.isdir(local):
                     shutil.rmtree(local, ignore_errors=True)
                 else:
                     os.remove(local)
-            await db.update_task(task_id, status="cancelled")
-            await self._broadcast_task_update(task_id)
+            await self._update_task(task_id, status="cancelled")
+            self._broadcast_task_update(task_id)
             return {"success": True, "message": "已取消"}
         except Exception as e:
             return {"success": False, "message": str(e)}
@@ -1135,39 +1686,35 @@ class TaskManager:
             existing_task.cancel()
             logger.info(f"已取消任务 {task_id} 的旧上传协程")
 
-        # 清理 _uploading_gids 中对应的 GID，解除去重锁定
-        # task_id 本身可能就是 GID（直接用 GID 做 task_id 的情况）
-        self._uploading_gids.discard(task_id)
+        # 解除上传去重标记，允许重新触发上传
+        record = self.store.get(task_id)
+        if record is not None:
+            record.upload_running = False
 
     async def retry_task(self, task_id: str) -> dict:
         """重试失败/卡住的任务"""
-        task = await db.get_task(task_id)
+        task = self.store.get(task_id)
         if not task:
             return {"success": False, "message": "任务不存在"}
-        if task["status"] not in ("failed", "uploading"):
+        if task.status not in ("failed", "uploading"):
             return {"success": False, "message": "只能重试失败或上传中的任务"}
 
-        # 取消正在卡住的旧上传协程，清理 GID 去重标记
+        # 取消正在卡住的旧上传协程，清理去重标记
         self._cancel_existing_upload(task_id)
-        # 也清理 aria2_gid 对应的 uploading_gids 标记
-        old_gid = task.get("aria2_gid", "")
-        if old_gid:
-            self._uploading_gids.discard(old_gid)
-            self._known_gids.discard(old_gid)
-            self._terminal_gids.discard(old_gid)
+        old_gid = task.aria2_gid or ""
 
         # 清除重试计数
         self._upload_retry_counts.pop(task_id, None)
 
         # 如果本地文件/文件夹已存在，直接重试上传
-        local_path = self._get_upload_path(task.get("local_path", ""))
+        local_path = self._get_upload_path(task.local_path or "")
         if local_path and os.path.exists(local_path):
             t = asyncio.create_task(self._retry_upload(task_id))
             self._upload_tasks[task_id] = t
             return {"success": True, "message": "正在重试上传"}
 
         # 否则需要重新下载
-        url = task.get("url", "")
+        url = task.url or ""
 
         # 如果数据库中没有 URL，尝试从 aria2 查询原始 URI
         if not url and old_gid:
@@ -1186,8 +1733,8 @@ class TaskManager:
 
         download_dir = self.config["aria2"].get("download_dir", "./downloads")
         options = {"dir": download_dir}
-        if task.get("filename"):
-            options["out"] = task["filename"]
+        if task.filename:
+            options["out"] = task.filename
 
         try:
             # 先尝试从 aria2 移除旧的失败任务
@@ -1198,40 +1745,47 @@ class TaskManager:
                     pass
 
             new_gid = await self.aria2.add_uri(url, options)
-            await db.update_task(
+            # 重新下载后文件会变化，旧的上传会话作废
+            await self._discard_upload_sessions(task_id)
+            await self._update_task(
                 task_id, status="downloading", aria2_gid=new_gid,
                 download_progress=0, upload_progress=0,
                 download_speed="", upload_speed="",
                 error=None, local_path=None, url=url
             )
-            self._known_gids.add(new_gid)
-            await self._broadcast_task_update(task_id)
+            self._broadcast_task_update(task_id)
             return {"success": True, "message": "正在重新下载"}
         except Exception as e:
             return {"success": False, "message": str(e)}
 
     async def _retry_upload(self, task_id: str):
         """仅重试上传步骤（受并发限制）"""
+        record = self.store.get(task_id)
+        if record is None or record.upload_running:
+            self._forget_upload_task(task_id)
+            return
+        record.upload_running = True
+
         await self._wait_upload_slot()
         try:
-            task = await db.get_task(task_id)
+            task = self.store.get(task_id)
             if not task:
                 return
 
-            local_path = self._get_upload_path(task.get("local_path", ""))
+            local_path = self._get_upload_path(task.local_path or "")
 
             if not local_path or not os.path.exists(local_path):
-                await db.update_task(task_id, status="failed",
-                                     error="本地文件不存在，无法重试上传")
-                await self._broadcast_task_update(task_id)
+                await self._update_task(task_id, status="failed",
+                                        error="本地文件不存在，无法重试上传")
+                self._broadcast_task_update(task_id)
                 return
 
             teldrive_path = self._calc_teldrive_path(local_path)
 
             # 重置上传状态
-            await db.update_task(task_id, status="uploading",
-                                 upload_progress=0.0, error=None)
-            await self._broadcast_task_update(task_id)
+            await self._update_task(task_id, status="uploading",
+                                    upload_progress=0.0, error=None)
+            self._broadcast_task_update(task_id)
 
             # 判断是文件夹还是单文件
             if os.path.isdir(local_path):
@@ -1246,42 +1800,98 @@ class TaskManager:
             logger.info(f"任务 {task_id} 重试上传被取消")
         except Exception as e:
             logger.error(f"任务 {task_id} 重试上传失败: {e}")
-            await db.update_task(task_id, status="failed", error=str(e))
-            await self._broadcast_task_update(task_id)
+            await self._update_task(task_id, status="failed", error=str(e),
+                                    upload_speed="")
+            self._broadcast_task_update(task_id)
         finally:
             self._release_upload_slot()
-            self._upload_tasks.pop(task_id, None)
+            if self._forget_upload_task(task_id):
+                record.upload_running = False
 
     async def delete_task(self, task_id: str) -> dict:
         """删除任务记录"""
-        task = await db.get_task(task_id)
+        task = self.store.get(task_id)
         if not task:
             return {"success": False, "message": "任务不存在"}
 
         # 如果任务还在进行中，先取消
-        if task["status"] in ("downloading", "uploading", "pending"):
+        if task.status in ("downloading", "uploading", "pending"):
             await self.cancel_task(task_id)
 
-        gid = task.get("aria2_gid")
+        gid = task.aria2_gid
         if gid:
-            self._known_gids.discard(gid)
+            self.aria2.forget_meta(gid)
             # 从 aria2 移除下载记录
             try:
                 await self.aria2.remove(gid)
             except Exception:
                 pass
 
+        await self._discard_upload_sessions(task_id)
+        self._pipeline_disabled.discard(task_id)
+        self.store.remove(task_id)
         await db.delete_task(task_id)
-        await self.broadcast({"type": "task_deleted", "data": {"task_id": task_id}})
+        self._broadcast_task_deleted(task_id)
         return {"success": True, "message": "已删除"}
 
     async def get_all_tasks(self) -> list:
         """获取所有任务"""
-        return await db.get_all_tasks()
+        return [t.to_dict() for t in self.store.all()]
+
+    async def list_tasks(self, statuses: Optional[list] = None,
+                         created_after: Optional[str] = None,
+                         created_before: Optional[str] = None,
+                         filename_prefix: Optional[str] = None,
+                         sort: str = "created_at", descending: bool = True,
+                         limit: int = 100, cursor: Optional[str] = None) -> dict:
+        """分页获取任务列表（过滤、排序、分页由数据库索引完成）
+
+        Returns:
+            {"tasks": [...], "next_cursor": 下一页游标或 None, "counts": 各状态任务数}
+        """
+        limit = max(1, min(limit, 1000))
+        after = _decode_cursor(cursor, sort, descending) if cursor else None
+        # 进度等字段走写合并：只有待写更新涉及过滤/排序列时才需先落盘，
+        # 其余字段在下方以内存记录覆盖，翻页和 WebSocket init 不打断写合并
+        columns = {sort}
+        if statuses:
+            columns.add("status")
+        if created_after or created_before:
+            columns.add("created_at")
+        if filename_prefix:
+            columns.add("filename")
+        if db.has_pending_writes(columns):
+            try:
+                await db.flush_writes()
+            except Exception as e:
+                logger.debug(f"查询前落盘失败，结果可能略有滞后: {e}")
+        rows = await db.query_tasks(
+            statuses=statuses, created_after=created_after,
+            created_before=created_before, filename_prefix=filename_prefix,
+            sort=sort, descending=descending, limit=limit + 1, after=after,
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = _encode_cursor(sort, descending, last[sort], last["task_id"])
+        # 以内存记录为准（落盘后新产生的变化）
+        tasks = []
+        for row in rows:
+            record = self.store.get(row["task_id"])
+            tasks.append(record.to_dict() if record else row)
+        return {"tasks": tasks, "next_cursor": next_cursor, "counts": self.get_task_counts()}
+
+    def get_task_counts(self) -> dict:
+        """各状态任务数（含 total），直接读内存索引"""
+        counts = self.store.status_counts()
+        counts["total"] = len(self.store)
+        return counts
 
     async def get_task(self, task_id: str) -> Optional[dict]:
         """获取单个任务"""
-        return await db.get_task(task_id)
+        task = self.store.get(task_id)
+        return task.to_dict() if task else None
 
 
 # 全局单例
@@ -0,0 +1,143 @@
+"""任务存储 - 运行时任务状态的内存权威副本（数据库只做持久化）"""
+
+import time
+from typing import Optional, Iterable
+
+# 与 tasks 表字段一一对应
+TASK_FIELDS = (
+    "task_id", "url", "filename", "status",
+    "download_progress", "upload_progress",
+    "download_speed", "upload_speed", "file_size",
+    "error", "teldrive_path", "aria2_gid", "local_path",
+    "created_at", "updated_at",
+)
+
+# 终态：不再随 aria2 状态更新
+TERMINAL_STATUSES = frozenset(("completed", "failed", "cancelled"))
+
+_DEFAULTS = {
+    "status": "pending",
+    "download_progress": 0.0,
+    "upload_progress": 0.0,
+    "download_speed": "",
+    "upload_speed": "",
+    "file_size": "",
+    "teldrive_path": "/",
+}
+
+
+class TaskRecord:
+    """单个任务的紧凑内存记录"""
+
+    # upload_running 为运行时标记（上传协程执行中），不持久化
+    __slots__ = TASK_FIELDS + ("upload_running",)
+
+    def __init__(self, row: dict):
+        for field in TASK_FIELDS:
+            setattr(self, field, row.get(field, _DEFAULTS.get(field)))
+        self.upload_running = False
+
+    def to_dict(self) -> dict:
+        """转为 API / WebSocket 使用的 dict"""
+        return {field: getattr(self, field) for field in TASK_FIELDS}
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+
+class TaskStore:
+    """按 task_id / aria2 GID / 状态建立索引的任务存储"""
+
+    def __init__(self):
+        self._by_id: dict = {}
+        self._by_gid: dict = {}
+        self._by_status: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._by_id
+
+    def load(self, rows: Iterable[dict]):
+        """从数据库行批量加载（启动时调用一次）"""
+        self._by_id.clear()
+        self._by_gid.clear()
+        self._by_status.clear()
+        for row in rows:
+            self.add(row)
+
+    def add(self, row: dict) -> TaskRecord:
+        """加入一条任务记录（已存在时覆盖）"""
+        if row["task_id"] in self._by_id:
+            self.remove(row["task_id"])
+        record = TaskRecord(row)
+        self._by_id[record.task_id] = record
+        self._index(record)
+        return record
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        return self._by_id.get(task_id)
+
+    def get_by_gid(self, gid: str) -> Optional[TaskRecord]:
+        """按 aria2 GID 查找（GID 也可能直接作为 task_id）"""
+        return self._by_gid.get(gid) or self._by_id.get(gid)
+
+    def with_status(self, *statuses: str) -> list:
+        """获取处于指定状态的任务"""
+        records = []
+        for status in statuses:
+            ids = self._by_status.get(status)
+            if ids:
+                records.extend(self._by_id[task_id] for task_id in ids)
+        return records
+
+    def active(self) -> list:
+        """获取全部非终态任务"""
+        records = []
+        for status, ids in self._by_status.items():
+            if status not in TERMINAL_STATUSES:
+                records.extend(self._by_id[task_id] for task_id in ids)
+        return records
+
+    def status_counts(self) -> dict:
+        """各状态的任务数"""
+        return {status: len(ids) for status, ids in self._by_status.items()}
+
+    def all(self) -> list:
+        """获取全部任务，按创建时间倒序"""
+        return sorted(self._by_id.values(),
+                      key=lambda r: r.created_at or "", reverse=True)
+
+    def update(self, task_id: str, **fields) -> Optional[TaskRecord]:
+        """更新字段并维护索引，返回更新后的记录"""
+        record = self._by_id.get(task_id)
+        if record is None:
+            return None
+        self._unindex(record)
+        for key, value in fields.items():
+            setattr(record, key, value)
+        record.updated_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        self._index(record)
+        return record
+
+    def remove(self, task_id: str) -> Optional[TaskRecord]:
+        record = self._by_id.pop(task_id, None)
+        if record is not None:
+            self._unindex(record)
+        return record
+
+    def _index(self, record: TaskRecord):
+        if record.aria2_gid:
+            self._by_gid[record.aria2_gid] = record
+        self._by_status.setdefault(record.status, set()).add(record.task_id)
+
+    def _unindex(self, record: TaskRecord):
+        if record.aria2_gid and self._by_gid.get(record.aria2_gid) is record:
+            del self._by_gid[record.aria2_gid]
+        ids = self._by_status.get(record.status)
+        if ids is not None:
+            ids.discard(record.task_id)
+            if not ids:
+                del self._by_status[record.status]
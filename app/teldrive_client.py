@@ -9,10 +9,17 @@ import aiohttp
 import uuid
 import hashlib
 import math
+import zlib
 import logging
+import functools
+import time
 from pathlib import Path
 from typing import Optional, Callable, List, Dict, Any
 
+from app import metrics
+from app.progress import TransferProgress
+from app.upload_scheduler import PartScheduler
+
 logger = logging.getLogger(__name__)
 
 # TelDrive 上传分块大小映射
@@ -25,6 +32,119 @@ CHUNK_SIZE_MAP = {
 }
 
 
+class FileRange:
+    """文件中 [offset, offset + size) 区间的只读视图
+
+    上传时按块从磁盘流式读取（读操作在线程池执行，不阻塞事件循环），
+    内存占用与 chunk 大小无关；每次迭代重新打开文件，重试时可重复读取。
+    """
+
+    # 流式发送粒度：1MB
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, path, offset: int, size: int):
+        self.path = path
+        self.offset = offset
+        self.size = size
+        # 最近一次完整发送的数据的 CRC32（边下边传时用于复核）
+        self.crc32: Optional[int] = None
+
+    async def iter_blocks(self, on_sent: Optional[Callable] = None):
+        """逐块读出区间数据，每发出一块后同步调用 on_sent(本区间已发送字节数)"""
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, self.path, "rb")
+        try:
+            await loop.run_in_executor(None, f.seek, self.offset)
+            sent = 0
+            crc = 0
+            while sent < self.size:
+                want = min(self.BLOCK_SIZE, self.size - sent)
+                block = await loop.run_in_executor(None, f.read, want)
+                if not block:
+                    raise IOError(f"文件在读取时被截断: {self.path}")
+                crc = zlib.crc32(block, crc)
+                yield block
+                sent += len(block)
+                if on_sent:
+                    on_sent(sent)
+            self.crc32 = crc
+        finally:
+            f.close()
+
+    def _read_crc32(self) -> int:
+        crc = 0
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            remaining = self.size
+            while remaining > 0:
+                block = f.read(min(self.BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+        return crc
+
+    async def checksum(self) -> int:
+        """重新从磁盘读取区间并计算 CRC32（在线程池执行）"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._read_crc32)
+
+
+class UploadSession:
+    """可续传的上传会话：固定 upload_id 和 chunk 大小，记录已确认的 part
+
+    TelDrive 按 upload_id 保留已上传的 part，复用同一会话重试时已存在的 part 会被跳过。
+    on_part_done(session) 在每个 part 确认后调用，用于持久化清单。
+
+    远程 part 清单（manifest）在会话开始时只拉取一次，之后由每个 part 的
+    POST 响应增量更新；仅在上传出错后标记为 stale，下次使用前重新同步。
+    """
+
+    def __init__(self, upload_id: str, chunk_size: int,
+                 completed_parts: Optional[List[int]] = None,
+                 on_part_done: Optional[Callable] = None):
+        self.upload_id = upload_id
+        self.chunk_size = chunk_size
+        self.completed_parts = set(completed_parts or [])
+        self.on_part_done = on_part_done
+        # partNo -> 远程 part 信息
+        self.manifest: Dict[int, Dict] = {}
+        # 已被重传取代的远程 part id，同步清单时忽略
+        self.superseded: set = set()
+        self.stale = True
+        self.fetched = False
+        self._sync_lock = asyncio.Lock()
+
+    def get_part(self, part_no: int) -> Optional[Dict]:
+        """从本地清单查找已上传的 part"""
+        return self.manifest.get(part_no)
+
+    def add_part(self, part_no: int, part: Dict):
+        """记录 POST 返回的 part"""
+        self.manifest[part_no] = part
+
+    def discard_part(self, part_no: int):
+        """作废已上传的 part（内容有误需重传），之后同步清单也不再采用它"""
+        part = self.manifest.pop(part_no, None)
+        if part and part.get("partId") is not None:
+            self.superseded.add(part["partId"])
+        self.completed_parts.discard(part_no)
+
+    def part_list(self) -> List[Dict]:
+        """按 partNo 排序的 part 列表"""
+        return [self.manifest[k] for k in sorted(self.manifest)]
+
+    async def mark_done(self, part_no: int):
+        """记录 part 已确认并触发持久化"""
+        if part_no in self.completed_parts:
+            return
+        self.completed_parts.add(part_no)
+        if self.on_part_done:
+            try:
+                await self.on_part_done(self)
+            except Exception as e:
+                logger.debug(f"保存上传会话失败: {e}")
+
+
 class TelDriveClient:
     """TelDrive REST API 客户端"""
 
@@ -36,15 +156,153 @@ class TelDriveClient:
     def __init__(self, api_host: str = "http://localhost:8080",
                  access_token: str = "", channel_id: int = 0,
                  chunk_size: str = "500M", upload_concurrency: int = 4,
-                 random_chunk_name: bool = True, max_retries: int = 3):
+                 random_chunk_name: bool = True, max_retries: int = 3,
+                 dir_cache_ttl: int = 300,
+                 pool_limit: int = 100, pool_limit_per_host: int = 0,
+                 dns_cache_ttl: int = 300, keepalive_timeout: int = 30,
+                 scheduler: Optional[PartScheduler] = None):
         self.api_host = api_host.rstrip("/")
         self.access_token = access_token
+        # part 调度器：TaskManager 传入进程级共享实例，重建客户端时保持不变
+        self.scheduler = scheduler or PartScheduler(upload_concurrency)
+        # 自建的调度器随客户端关闭而停止，共享实例由创建者负责
+        self._owns_scheduler = scheduler is None
+        # 已确认存在的目录 -> 过期时间（monotonic），避免每个文件都 POST mkdir
+        self._known_dirs: Dict[str, float] = {}
+        # 正在创建的目录，并发上传同一目录时只发一次请求
+        self._pending_dirs: Dict[str, asyncio.Future] = {}
+        # 批量上传时预取的目录列表：目录 -> {文件名: 文件记录}，只含文件
+        self._listings: Dict[str, Dict[str, Dict]] = {}
+        self.configure(channel_id=channel_id, chunk_size=chunk_size,
+                       upload_concurrency=upload_concurrency,
+                       random_chunk_name=random_chunk_name,
+                       max_retries=max_retries, dir_cache_ttl=dir_cache_ttl)
+        # 连接池参数（创建会话时生效）
+        self.pool_options = {
+            "pool_limit": pool_limit,
+            "pool_limit_per_host": pool_limit_per_host,
+            "dns_cache_ttl": dns_cache_ttl,
+            "keepalive_timeout": keepalive_timeout,
+        }
+        # 长连接会话：所有请求共用同一个连接池，保留 keep-alive / TLS / DNS 缓存
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.pool_stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+        }
+        # 上传请求计数
+        self.upload_stats = {
+            "manifest_fetches": 0,
+            "manifest_resyncs": 0,
+            "part_posts": 0,
+            "part_retries": 0,
+            "parts_skipped": 0,
+            "parts_reuploaded": 0,
+            "mkdir_posts": 0,
+            "mkdir_cached": 0,
+            "mkdir_rechecks": 0,
+            "listing_pages": 0,
+            "find_requests": 0,
+            "find_cached": 0,
+        }
+
+    def configure(self, channel_id: int = 0, chunk_size: str = "500M",
+                  upload_concurrency: int = 4, random_chunk_name: bool = True,
+                  max_retries: int = 3, dir_cache_ttl: int = 300):
+        """更新上传参数（不影响连接池，进行中的上传沿用原 chunk 大小）"""
         self.channel_id = channel_id
         self.chunk_size_str = chunk_size
         self.chunk_size = CHUNK_SIZE_MAP.get(chunk_size, 500 * 1024 * 1024)
         self.upload_concurrency = upload_concurrency
+        self.scheduler.resize(upload_concurrency)
         self.random_chunk_name = random_chunk_name
         self.max_retries = max_retries
+        self.dir_cache_ttl = dir_cache_ttl
+
+    def same_endpoint(self, api_host: str, access_token: str, **pool_options) -> bool:
+        """连接目标、凭据和连接池参数均未变化时可继续复用本客户端"""
+        return (self.api_host == api_host.rstrip("/")
+                and self.access_token == access_token
+                and all(self.pool_options.get(k) == v for k, v in pool_options.items()))
+
+    # ===========================================
+    # 连接池
+    # ===========================================
+
+    def _make_trace_config(self) -> aiohttp.TraceConfig:
+        """统计请求数、新建连接和复用连接"""
+        stats = self.pool_stats
+
+        async def on_request_start(session, ctx, params):
+            stats["requests"] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            stats["connections_reused"] += 1
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取或创建复用的 HTTP 会话"""
+        if self._session is None or self._session.closed:
+            opts = self.pool_options
+            connector = aiohttp.TCPConnector(
+                limit=opts["pool_limit"],
+                limit_per_host=opts["pool_limit_per_host"],
+                ttl_dns_cache=opts["dns_cache_ttl"] or None,
+                use_dns_cache=opts["dns_cache_ttl"] > 0,
+                keepalive_timeout=opts["keepalive_timeout"],
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.DEFAULT_TIMEOUT,
+                trace_configs=[self._make_trace_config()],
+            )
+        return self._session
+
+    async def close(self):
+        """关闭 HTTP 会话（自建的 part 调度器一并停止）"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._owns_scheduler:
+            await self.scheduler.stop()
+
+    async def close_when_idle(self):
+        """等待进行中的上传结束后关闭会话（配置切换后回收旧客户端）"""
+        while self._active:
+            self._idle.clear()
+            await self._idle.wait()
+        await self.close()
+
+    def get_pool_stats(self) -> dict:
+        """获取连接池统计：打开/空闲连接数、新建与复用次数"""
+        stats = dict(self.pool_stats)
+        idle = in_use = 0
+        session = self._session
+        if session is not None and not session.closed:
+            connector = session.connector
+            # aiohttp 未公开连接计数，读取 BaseConnector 内部结构
+            idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+            in_use = len(getattr(connector, "_acquired", ()))
+        stats["open"] = idle + in_use
+        stats["idle"] = idle
+        stats["in_use"] = in_use
+        return stats
+
+    def get_upload_stats(self) -> dict:
+        """获取上传请求计数"""
+        return dict(self.upload_stats)
 
     def _get_headers(self) -> dict:
         """获取请求头"""
@@ -59,26 +317,26 @@ class TelDriveClient:
     async def test_connection(self) -> dict:
         """测试 TelDrive 连接"""
         try:
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.get(
-                    f"{self.api_host}/api/auth/session",
-                    headers=self._get_headers()
-                ) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        username = data.get("userName", data.get("name", "unknown"))
-                        return {
-                            "success": True,
-                            "message": f"TelDrive 连接成功，用户: {username}",
-                            "version": None
-                        }
-                    else:
-                        text = await resp.text()
-                        return {
-                            "success": False,
-                            "message": f"TelDrive 认证失败 (HTTP {resp.status}): {text}",
-                            "version": None
-                        }
+            session = await self._get_session()
+            async with session.get(
+                f"{self.api_host}/api/auth/session",
+                headers=self._get_headers()
+            ) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    username = data.get("userName", data.get("name", "unknown"))
+                    return {
+                        "success": True,
+                        "message": f"TelDrive 连接成功，用户: {username}",
+                        "version": None
+                    }
+                else:
+                    text = await resp.text()
+                    return {
+                        "success": False,
+                        "message": f"TelDrive 认证失败 (HTTP {resp.status}): {text}",
+                        "version": None
+                    }
         except Exception as e:
             return {
                 "success": False,
@@ -87,32 +345,146 @@ class TelDriveClient:
             }
 
     async def create_directory(self, path: str) -> dict:
-        """创建目录 - POST /api/files/mkdir"""
-        async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-            async with session.post(
-                f"{self.api_host}/api/files/mkdir",
-                headers={**self._get_headers(), "Content-Type": "application/json"},
-                json={"path": path}
-            ) as resp:
-                if resp.status == 204:
-                    return {"success": True}
-                try:
-                    return await resp.json()
-                except Exception:
-                    return {"success": resp.status < 300}
+        """创建目录 - POST /api/files/mkdir（返回值总含 success，按 HTTP 状态判断）"""
+        session = await self._get_session()
+        self.upload_stats["mkdir_posts"] += 1
+        async with session.post(
+            f"{self.api_host}/api/files/mkdir",
+            headers={**self._get_headers(), "Content-Type": "application/json"},
+            json={"path": path}
+        ) as resp:
+            ok = resp.status < 300
+            if ok:
+                self._remember_directory(path)
+            if resp.status == 204:
+                return {"success": True}
+            try:
+                data = await resp.json()
+            except Exception:
+                data = None
+            if not isinstance(data, dict):
+                return {"success": ok, "status": resp.status}
+            return {**data, "success": ok, "status": resp.status}
+
+    async def _directory_exists(self, path: str) -> bool:
+        """按名称在上级目录中查找目录（mkdir 失败后复核）"""
+        if path == "/":
+            return True
+        parent, name = path.rsplit("/", 1)
+        self.upload_stats["mkdir_rechecks"] += 1
+        session = await self._get_session()
+        return await self._find_file(session, parent or "/", name, is_folder=True) is not None
+
+    # ===========================================
+    # 目录缓存
+    # ===========================================
+
+    @staticmethod
+    def _normalize_dir(path: str) -> str:
+        return "/" + "/".join(p for p in path.replace("\\", "/").split("/") if p)
+
+    @staticmethod
+    def _dir_ancestors(path: str) -> List[str]:
+        """/a/b/c -> ["/a", "/a/b", "/a/b/c"]（不含根目录）"""
+        parts = [p for p in path.split("/") if p]
+        return ["/" + "/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+    def _remember_directory(self, path: str):
+        """记录目录已存在（mkdir 会创建上级目录，一并记录）"""
+        if self.dir_cache_ttl <= 0:
+            return
+        expires = time.monotonic() + self.dir_cache_ttl
+        for d in self._dir_ancestors(self._normalize_dir(path)):
+            self._known_dirs[d] = expires
+
+    def _is_known_directory(self, path: str) -> bool:
+        if path == "/":
+            return True
+        expires = self._known_dirs.get(path)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._known_dirs[path]
+            return False
+        return True
+
+    def forget_directory(self, path: str):
+        """使目录及其子目录的缓存失效（目录可能已在 TelDrive 上被删除）"""
+        path = self._normalize_dir(path)
+        prefix = path.rstrip("/") + "/"
+        for d in list(self._known_dirs):
+            if d == path or d.startswith(prefix):
+                del self._known_dirs[d]
+
+    async def ensure_directory(self, path: str) -> bool:
+        """确保目录存在：缓存命中时不发请求，同一目录的并发调用合并为一次 mkdir
+
+        mkdir 返回非 2xx（如目录已存在）时按名称复核一次，目录确实存在即视为成功。
+
+        Returns:
+            本次调用是否向服务端创建或确认了该目录（缓存命中、合并到并发请求时为 False）
+        """
+        path = self._normalize_dir(path)
+        if self._is_known_directory(path):
+            self.upload_stats["mkdir_cached"] += 1
+            return False
+        pending = self._pending_dirs.get(path)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._pending_dirs[path] = future
+        try:
+            result = await self.create_directory(path)
+            if not result.get("success"):
+                if not await self._directory_exists(path):
+                    raise Exception(f"创建目录失败 {path}: {result}")
+                self._remember_directory(path)
+            future.set_result(None)
+            return True
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 无其他等待者时避免 "exception never retrieved"
+            raise
+        finally:
+            self._pending_dirs.pop(path, None)
+
+    async def ensure_directories(self, paths) -> int:
+        """一次性补齐一组目标目录（含上级目录），返回实际创建或确认的目录数
+
+        只创建缓存中不存在的目录，按深度由浅到深逐层创建，同层目录并发请求。
+        """
+        missing = set()
+        for path in paths:
+            for d in self._dir_ancestors(self._normalize_dir(path)):
+                if not self._is_known_directory(d):
+                    missing.add(d)
+        if not missing:
+            return 0
+
+        by_depth: Dict[int, List[str]] = {}
+        for d in missing:
+            by_depth.setdefault(d.count("/"), []).append(d)
+        created = 0
+        for depth in sorted(by_depth):
+            # 上一层 mkdir 已顺带创建的目录不再请求
+            level = [d for d in by_depth[depth] if not self._is_known_directory(d)]
+            results = await asyncio.gather(*(self.ensure_directory(d) for d in level))
+            created += sum(1 for confirmed in results if confirmed)
+        return created
 
     async def list_files(self, path: str = "/") -> list:
         """列出目录文件"""
-        async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-            async with session.get(
-                f"{self.api_host}/api/files",
-                headers=self._get_headers(),
-                params={"path": path}
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get("items", data if isinstance(data, list) else [])
-                return []
+        session = await self._get_session()
+        async with session.get(
+            f"{self.api_host}/api/files",
+            headers=self._get_headers(),
+            params={"path": path}
+        ) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                return data.get("items", data if isinstance(data, list) else [])
+            return []
 
     # ===========================================
     # 文件查找与删除（参考 util.go 的 getFile / driver.go 的 Remove）
@@ -146,8 +518,103 @@ class TelDriveClient:
             headers={**self._get_headers(), "Content-Type": "application/json"},
             json={"ids": [file_id]}
         ) as resp:
+            if resp.status < 300:
+                self._forget_listed_file(file_id)
             return resp.status < 300
 
+    # ===========================================
+    # 目录列表预取（批量上传的同名文件检测）
+    # ===========================================
+
+    LISTING_PAGE_SIZE = 500
+
+    async def prefetch_listing(self, path: str) -> int:
+        """分页拉取目录下的全部文件并建立按文件名的索引，返回文件数
+
+        之后该目录下的同名检测直接查索引，不再逐个文件请求 find；
+        本客户端的上传和删除会同步更新索引。
+        """
+        path = self._normalize_dir(path)
+        session = await self._get_session()
+        index: Dict[str, Dict] = {}
+        page = 1
+        while True:
+            self.upload_stats["listing_pages"] += 1
+            async with session.get(
+                f"{self.api_host}/api/files",
+                headers=self._get_headers(),
+                params={
+                    "path": path,
+                    "operation": "list",
+                    "page": page,
+                    "limit": self.LISTING_PAGE_SIZE,
+                }
+            ) as resp:
+                if resp.status == 404:
+                    break  # 目录尚不存在，自然没有同名文件
+                if resp.status != 200:
+                    raise Exception(f"获取目录列表失败 {path} (HTTP {resp.status})")
+                data = await resp.json()
+            items = data.get("items", [])
+            for item in items:
+                if item.get("type", "file") == "file" and item.get("name"):
+                    index.setdefault(item["name"], item)
+            total_pages = (data.get("meta") or {}).get("totalPages")
+            if total_pages is not None:
+                if page >= total_pages:
+                    break
+            elif len(items) < self.LISTING_PAGE_SIZE:
+                break
+            page += 1
+        self._listings[path] = index
+        return len(index)
+
+    async def prefetch_listings(self, paths) -> int:
+        """并发预取一组目录，单个目录失败时该目录退回逐个 find"""
+        paths = {self._normalize_dir(p) for p in paths}
+        results = await asyncio.gather(
+            *(self.prefetch_listing(p) for p in paths), return_exceptions=True
+        )
+        total = 0
+        for path, result in zip(paths, results):
+            if isinstance(result, Exception):
+                logger.warning(f"预取目录列表失败，退回逐个查找: {path} - {result}")
+            else:
+                total += result
+        return total
+
+    def release_listings(self, paths):
+        """批量上传结束后丢弃预取的目录列表"""
+        for path in paths:
+            self._listings.pop(self._normalize_dir(path), None)
+
+    def _forget_listed_file(self, file_id: str):
+        for index in self._listings.values():
+            for name, item in list(index.items()):
+                if item.get("id") == file_id:
+                    del index[name]
+
+    async def _find_existing(self, session: aiohttp.ClientSession,
+                             path: str, name: str) -> Optional[Dict]:
+        """同名文件检测：目录已预取时查索引，否则请求 find"""
+        index = self._listings.get(self._normalize_dir(path))
+        if index is not None:
+            self.upload_stats["find_cached"] += 1
+            return index.get(name)
+        self.upload_stats["find_requests"] += 1
+        return await self._find_file(session, path, name)
+
+    def _record_uploaded(self, path: str, name: str, data: Any):
+        """上传成功后更新预取索引，后续同名上传能找到这条新记录"""
+        index = self._listings.get(self._normalize_dir(path))
+        if index is None:
+            return
+        if isinstance(data, dict) and data.get("id"):
+            index[name] = data
+        else:
+            # 拿不到新文件 ID 时索引已不可信，该目录退回逐个 find
+            del self._listings[self._normalize_dir(path)]
+
     # ===========================================
     # 上传辅助方法（参考 upload.go）
     # ===========================================
@@ -165,14 +632,33 @@ class TelDriveClient:
                     return data
             return []
 
-    async def _check_part_exists(self, session: aiohttp.ClientSession,
-                                  upload_id: str, part_no: int) -> Optional[Dict]:
-        """检查某个 part 是否已存在 — 对标 upload.go 的 checkFilePartExist"""
-        parts = await self._get_file_parts(session, upload_id)
-        for part in parts:
-            if part.get("partId") == part_no or part.get("partNo") == part_no:
-                return part
-        return None
+    async def _sync_manifest(self, session: aiohttp.ClientSession,
+                             upload_session: UploadSession) -> None:
+        """按需（首次或出错后）从远程重新拉取 part 清单
+
+        取代 upload.go 中每个 part 前调用的 checkFilePartExist，
+        避免每块都拉一次完整列表。并发的块共用同一次拉取。
+        """
+        async with upload_session._sync_lock:
+            if not upload_session.stale:
+                return
+            if upload_session.fetched:
+                self.upload_stats["manifest_resyncs"] += 1
+            self.upload_stats["manifest_fetches"] += 1
+            parts = await self._get_file_parts(session, upload_session.upload_id)
+            # 同一 partNo 重传过时服务端会保留多份（TelDrive 没有删除单个 part 的接口），
+            # partId 为频道消息 id、随上传递增，取最新的一份
+            manifest: Dict[int, Dict] = {}
+            for p in parts:
+                part_no = p.get("partNo")
+                if part_no is None or p.get("partId") in upload_session.superseded:
+                    continue
+                previous = manifest.get(part_no)
+                if previous is None or (p.get("partId") or 0) >= (previous.get("partId") or 0):
+                    manifest[part_no] = p
+            upload_session.manifest = manifest
+            upload_session.stale = False
+            upload_session.fetched = True
 
     async def _touch(self, session: aiohttp.ClientSession,
                      name: str, path: str) -> dict:
@@ -217,32 +703,38 @@ class TelDriveClient:
     # ===========================================
 
     async def _upload_single_chunk(self, session: aiohttp.ClientSession,
-                                    upload_id: str, chunk_data: bytes,
+                                    upload_id: str, chunk: FileRange,
                                     part_no: int, filename: str,
                                     total_parts: int,
-                                    progress_callback: Optional[Callable] = None,
-                                    chunk_offset: int = 0,
-                                    file_size: int = 0) -> Dict:
-        """上传单个 chunk，含断点续传检查、流式发送进度和指数退避重试"""
+                                    progress: Optional[TransferProgress] = None,
+                                    upload_session: UploadSession = None) -> Dict:
+        """上传单个 chunk，含断点续传检查、流式发送进度和指数退避重试
+
+        chunk 数据直接从文件流式读取发送，不整块读入内存；
+        是否已上传由会话的本地 part 清单判断，不再逐块请求远程列表。
+        进度只写入 progress 的内存计数，发送路径不等待任何 I/O。
+        """
         retry_count = 0
-        # 流式发送粒度：1MB
-        STREAM_BLOCK = 1024 * 1024
+        part_key = (upload_id, part_no)
 
         while True:
-            # 断点续传：检查 part 是否已存在
-            existing = await self._check_part_exists(session, upload_id, part_no)
+            # 断点续传：检查 part 是否已存在（清单出错后才重新同步）
+            await self._sync_manifest(session, upload_session)
+            existing = upload_session.get_part(part_no)
             if existing and existing.get("name"):
                 logger.info(f"  块 {part_no}/{total_parts} 已存在，跳过上传")
-                # 已跳过的块也要上报进度
-                if progress_callback and file_size > 0:
-                    await progress_callback(chunk_offset + len(chunk_data), file_size)
+                self.upload_stats["parts_skipped"] += 1
+                # 已跳过的块也要计入进度
+                if progress:
+                    progress.part_done(part_key, chunk.size)
+                await upload_session.mark_done(part_no)
                 return existing
 
             part_name = self._get_part_name(filename, part_no, total_parts)
 
             headers = self._get_headers()
             headers["Content-Type"] = "application/octet-stream"
-            headers["Content-Length"] = str(len(chunk_data))
+            headers["Content-Length"] = str(chunk.size)
 
             params = {
                 "partName": part_name,
@@ -251,37 +743,50 @@ class TelDriveClient:
             }
 
             try:
-                # 用 async generator 做流式发送，每发 STREAM_BLOCK 字节回调一次进度
-                async def data_sender():
-                    sent = 0
-                    total = len(chunk_data)
-                    while sent < total:
-                        end = min(sent + STREAM_BLOCK, total)
-                        yield chunk_data[sent:end]
-                        sent = end
-                        if progress_callback and file_size > 0:
-                            await progress_callback(chunk_offset + sent, file_size)
+                # 流式发送：每发 1MB 更新一次计数；每次重试重新从文件读取
+                on_sent = None
+                if progress:
+                    on_sent = functools.partial(progress.part_sent, part_key)
 
+                self.upload_stats["part_posts"] += 1
+                start = time.perf_counter()
                 async with session.post(
                     f"{self.api_host}/api/uploads/{upload_id}",
                     headers=headers,
-                    data=data_sender(),
-                    params=params
+                    data=chunk.iter_blocks(on_sent),
+                    params=params,
+                    timeout=self.UPLOAD_TIMEOUT
                 ) as resp:
                     if resp.status in (200, 201):
                         result = await resp.json()
                         if result.get("name") or result.get("partId") is not None:
+                            metrics.UPLOAD_PART_SECONDS.labels(self.api_host).observe(
+                                time.perf_counter() - start)
+                            metrics.UPLOAD_PART_BYTES.labels(self.api_host).inc(chunk.size)
+                            if progress:
+                                progress.part_done(part_key, chunk.size)
+                            upload_session.add_part(part_no, result)
+                            await upload_session.mark_done(part_no)
                             return result
                         raise Exception(f"上传块 {part_no} 响应缺少有效数据: {result}")
                     else:
                         text = await resp.text()
                         raise Exception(f"HTTP {resp.status}: {text}")
             except asyncio.CancelledError:
+                if progress:
+                    progress.part_reset(part_key)
                 raise  # 被取消时立即退出，不重试
             except Exception as e:
+                if progress:
+                    progress.part_reset(part_key)
+                # 请求失败时 part 可能已在服务端落地，重试前重新同步清单
+                upload_session.stale = True
                 retry_count += 1
                 if retry_count > self.max_retries:
+                    metrics.UPLOAD_PART_FAILURES.labels(self.api_host).inc()
                     raise Exception(f"上传块 {part_no} 在 {self.max_retries} 次重试后仍然失败: {e}")
+                self.upload_stats["part_retries"] += 1
+                metrics.UPLOAD_PART_RETRIES.labels(self.api_host).inc()
 
                 backoff = min(retry_count * retry_count, 30)
                 logger.warning(f"  块 {part_no} 上传失败: {e}，{backoff}s 后第 {retry_count} 次重试")
@@ -292,12 +797,15 @@ class TelDriveClient:
     # ===========================================
 
     async def _create_file_record(self, session: aiohttp.ClientSession,
-                                   name: str, upload_id: str, path: str,
-                                   uploaded_parts: List[Dict],
+                                   name: str, upload_session: UploadSession,
+                                   path: str, uploaded_parts: List[Dict],
                                    total_size: int) -> dict:
         """上传完成后校验 parts 并创建文件记录"""
-        # 校验：比对远程 parts 数量与本地上传的数量
-        remote_parts = await self._get_file_parts(session, upload_id)
+        # 校验：比对清单与本地上传的数量，不一致时才重新拉取远程列表
+        if len(upload_session.manifest) != len(uploaded_parts):
+            upload_session.stale = True
+            await self._sync_manifest(session, upload_session)
+        remote_parts = upload_session.part_list()
         if len(remote_parts) != len(uploaded_parts):
             logger.warning(
                 f"Parts 数量不一致: 本地 {len(uploaded_parts)}, 远程 {len(remote_parts)}"
@@ -311,22 +819,28 @@ class TelDriveClient:
                 part_entry["salt"] = p["salt"]
             format_parts.append(part_entry)
 
+        return await self._post_file_record(session, name, path, format_parts, total_size)
+
+    async def _post_file_record(self, session: aiohttp.ClientSession, name: str,
+                                path: str, parts: List[Dict], total_size: int) -> dict:
+        """POST /api/files 创建文件记录，结果中附带所用的 parts（供内容索引记录）"""
         file_data = {
             "name": name,
             "type": "file",
             "path": path,
-            "parts": format_parts,
+            "parts": parts,
             "size": total_size,
         }
 
         async with session.post(
             f"{self.api_host}/api/files",
             headers={**self._get_headers(), "Content-Type": "application/json"},
-            json=file_data
+            json=file_data,
+            timeout=self.UPLOAD_TIMEOUT
         ) as resp:
             if resp.status in (200, 201):
                 result = await resp.json()
-                return {"success": True, "data": result}
+                return {"success": True, "data": result, "parts": parts}
             else:
                 text = await resp.text()
                 return {
@@ -334,149 +848,248 @@ class TelDriveClient:
                     "error": f"创建文件记录失败 (HTTP {resp.status}): {text}"
                 }
 
-    # ===========================================
-    # 串行上传 — 对标 upload.go 的 doSingleUpload
-    # ===========================================
-
-    async def _do_single_upload(self, session: aiohttp.ClientSession,
-                                 file_path: Path, upload_id: str,
-                                 filename: str, file_size: int,
-                                 total_parts: int,
-                                 progress_callback: Optional[Callable]) -> List[Dict]:
-        """串行逐块上传（文件较小时使用）"""
-        uploaded = 0
-        parts = []
-
-        with open(file_path, "rb") as f:
-            part_no = 1
-            while uploaded < file_size:
-                chunk = f.read(self.chunk_size)
-                if not chunk:
-                    break
-
-                chunk_len = len(chunk)
-                logger.info(f"  上传块 {part_no}/{total_parts} ({chunk_len} bytes)")
-
-                part_result = await self._upload_single_chunk(
-                    session, upload_id, chunk, part_no, filename, total_parts,
-                    progress_callback=progress_callback,
-                    chunk_offset=uploaded,
-                    file_size=file_size
-                )
-                parts.append(part_result)
+    async def get_file(self, file_id: str) -> Optional[Dict]:
+        """按 ID 获取文件信息，不存在时返回 None"""
+        session = await self._get_session()
+        async with session.get(
+            f"{self.api_host}/api/files/{file_id}",
+            headers=self._get_headers()
+        ) as resp:
+            if resp.status == 200:
+                return await resp.json()
+            if resp.status == 404:
+                return None
+            raise Exception(f"获取文件信息失败 (HTTP {resp.status})")
 
-                uploaded += chunk_len
-                part_no += 1
+    @staticmethod
+    def _part_ids(parts: Optional[List[Dict]]) -> List:
+        """parts 列表中的 part id（文件详情与创建请求中的字段名不同）"""
+        return [p.get("id", p.get("partId")) for p in parts or []]
+
+    async def create_file_from_parts(self, name: str, teldrive_path: str,
+                                     parts: List[Dict], total_size: int,
+                                     source_id: str) -> dict:
+        """复用已有文件的 parts 创建文件记录（内容去重，不发送任何数据）
+
+        先确认源文件仍存在且大小一致；目标位置已有的同名文件就是源文件、
+        或与本次使用相同的 parts 时直接返回。同名文件与复用的 parts 部分重叠
+        （或无法取得其 parts）时不删除它，返回 {"success": False, "conflict": True}。
+        源文件已不存在时返回 {"success": False, "stale": True}。
+        """
+        session = await self._get_session()
+        self._active += 1
+        try:
+            source = await self.get_file(source_id)
+            if not source or int(source.get("size") or total_size) != total_size:
+                return {"success": False, "stale": True,
+                        "error": f"源文件已不存在: {source_id}"}
 
-        return parts
+            if teldrive_path != "/":
+                try:
+                    await self.ensure_directory(teldrive_path)
+                except Exception:
+                    pass
+
+            existing_file = await self._find_existing(session, teldrive_path, name)
+            if existing_file and existing_file.get("id") == source_id:
+                logger.info(f"文件 {name} 已存在于 {teldrive_path}，内容相同，跳过上传")
+                return {"success": True, "data": existing_file, "parts": parts}
+            if existing_file and existing_file.get("id"):
+                # 同名文件可能本身就是复用这批 parts 的副本，删除它会连带删除共享的 parts
+                detail = await self.get_file(existing_file["id"])
+                if detail is not None:
+                    existing_ids = self._part_ids(detail.get("parts"))
+                    reused_ids = self._part_ids(parts)
+                    if existing_ids == reused_ids:
+                        logger.info(f"文件 {name} 已存在于 {teldrive_path}，parts 相同，跳过上传")
+                        return {"success": True, "data": existing_file, "parts": parts}
+                    if not existing_ids or set(existing_ids) & set(reused_ids):
+                        return {"success": False, "conflict": True,
+                                "error": f"{teldrive_path} 下的同名文件 {name} 可能与复用的 "
+                                         f"parts 共享数据，为避免连带删除未覆盖，请手动处理"}
+                    logger.info(f"发现同名文件 {name} (id={existing_file['id']})，删除后重新创建")
+                    await self._delete_file(session, existing_file["id"])
+
+            result = await self._post_file_record(session, name, teldrive_path,
+                                                  parts, total_size)
+            if result.get("success"):
+                self._record_uploaded(teldrive_path, name, result.get("data"))
+                logger.info(f"文件 {name} 复用已有 parts 创建成功（源文件 {source_id}）")
+            return result
+        except Exception as e:
+            logger.error(f"复用 parts 创建文件失败: {e}")
+            return {"success": False, "error": str(e)}
+        finally:
+            self._active -= 1
+            if not self._active:
+                self._idle.set()
 
     # ===========================================
-    # 并发上传 — 对标 upload.go 的 doMultiUpload
+    # 分块上传 — 对标 upload.go 的 doSingleUpload / doMultiUpload
     # ===========================================
 
-    async def _do_multi_upload(self, session: aiohttp.ClientSession,
-                                file_path: Path, upload_id: str,
-                                filename: str, file_size: int,
-                                total_parts: int,
-                                progress_callback: Optional[Callable]) -> List[Dict]:
-        """并发分块上传（Semaphore 控制并发度）"""
-        sem = asyncio.Semaphore(self.upload_concurrency)
-        results: Dict[int, Dict] = {}
-        uploaded_bytes = 0
-        lock = asyncio.Lock()
-
-        # 预读所有 chunks 到内存中（通过 offset + size 描述）
-        # 为避免一次性读入超大文件，采用按需读取方式
-        chunks_info = []
+    @staticmethod
+    def _iter_part_ranges(file_size: int, chunk_size: int):
+        """惰性生成 (part_no, offset, size)，只记录区间，数据在发送时从文件流式读取"""
         offset = 0
         part_no = 1
         while offset < file_size:
-            cur_chunk_size = min(self.chunk_size, file_size - offset)
-            chunks_info.append((part_no, offset, cur_chunk_size))
+            cur_chunk_size = min(chunk_size, file_size - offset)
+            yield part_no, offset, cur_chunk_size
             offset += cur_chunk_size
             part_no += 1
 
+    async def _upload_parts(self, session: aiohttp.ClientSession,
+                            file_path: Path, upload_id: str, filename: str,
+                            total_parts: int,
+                            progress: Optional[TransferProgress],
+                            upload_session: UploadSession,
+                            schedule_key: str, ranges, results: Dict[int, Dict],
+                            chunks: Optional[Dict[int, FileRange]] = None):
+        """把一批 part 交给全局调度器，与其他文件共享 upload_concurrency 个 worker
+
+        ranges 可以是惰性迭代器：worker 空闲时才取下一个 part。
+        任一块失败时调度器取消本批其余块并抛出异常。
+        """
         async def upload_chunk(p_no: int, p_offset: int, p_size: int):
-            nonlocal uploaded_bytes
-
-            async with sem:
-                # 从文件中读取对应位置的数据
-                loop = asyncio.get_event_loop()
-
-                def read_chunk():
-                    with open(file_path, "rb") as f:
-                        f.seek(p_offset)
-                        return f.read(p_size)
-
-                chunk_data = await loop.run_in_executor(None, read_chunk)
-
-                # 并发上传时，进度通过 lock 累加已发送字节
-                async def concurrent_progress(sent_total: int, _total: int):
-                    nonlocal uploaded_bytes
-                    # sent_total 是 chunk_offset + 已发送量，取相对于 chunk 的已发送量
-                    chunk_sent = sent_total - p_offset
-                    async with lock:
-                        # 重新计算：已完成的其他块 + 当前块已发送
-                        current_total = sum(
-                            ci[2] for ci in chunks_info
-                            if ci[0] in results  # 已完成的块
-                        ) + chunk_sent
-                        uploaded_bytes = current_total
-                        if progress_callback:
-                            await progress_callback(uploaded_bytes, file_size)
-
-                logger.info(f"  并发上传块 {p_no}/{total_parts} ({p_size} bytes)")
-                part_result = await self._upload_single_chunk(
-                    session, upload_id, chunk_data, p_no, filename, total_parts,
-                    progress_callback=concurrent_progress,
-                    chunk_offset=p_offset,
-                    file_size=file_size
-                )
-                results[p_no] = part_result
+            chunk = FileRange(file_path, p_offset, p_size)
+            if chunks is not None:
+                chunks[p_no] = chunk
+            logger.info(f"  上传块 {p_no}/{total_parts} ({p_size} bytes)")
+            results[p_no] = await self._upload_single_chunk(
+                session, upload_id, chunk, p_no, filename, total_parts,
+                progress=progress,
+                upload_session=upload_session
+            )
 
-        # 创建所有上传任务
-        tasks = [
-            asyncio.create_task(upload_chunk(p_no, p_offset, p_size))
-            for p_no, p_offset, p_size in chunks_info
-        ]
+        def part_jobs():
+            for p_no, p_offset, p_size in ranges:
+                yield p_size, functools.partial(upload_chunk, p_no, p_offset, p_size)
 
-        # 等待所有任务完成（任一失败则抛出异常）
-        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        await self.scheduler.run(schedule_key, part_jobs())
 
-        # 检查是否有异常
-        for task in done:
-            if task.exception():
-                # 取消剩余任务
-                for p in pending:
-                    p.cancel()
-                raise task.exception()
+    async def _do_multi_upload(self, session: aiohttp.ClientSession,
+                                file_path: Path, upload_id: str,
+                                filename: str, file_size: int,
+                                total_parts: int,
+                                progress: Optional[TransferProgress],
+                                chunk_size: int,
+                                upload_session: UploadSession,
+                                schedule_key: str) -> List[Dict]:
+        """分块上传：全部 part 以惰性迭代器交给调度器"""
+        results: Dict[int, Dict] = {}
+        await self._upload_parts(
+            session, file_path, upload_id, filename, total_parts, progress,
+            upload_session, schedule_key,
+            self._iter_part_ranges(file_size, chunk_size), results
+        )
 
         # 按 part_no 排序返回
-        sorted_parts = [results[k] for k in sorted(results.keys())]
-        return sorted_parts
+        return [results[k] for k in sorted(results.keys())]
+
+    async def _do_pipelined_upload(self, session: aiohttp.ClientSession,
+                                    file_path: Path, upload_id: str,
+                                    filename: str, file_size: int,
+                                    total_parts: int,
+                                    progress: Optional[TransferProgress],
+                                    chunk_size: int,
+                                    upload_session: UploadSession,
+                                    schedule_key: str,
+                                    wait_ready: Callable) -> List[Dict]:
+        """边下边传：每当某些 part 的字节区间已下载完成就提交上传
+
+        wait_ready() 返回下载的分片完成情况（需提供 has_range(offset, size)
+        与 complete），两次调用之间由调用方负责等待。下载完成后上传剩余 part。
+
+        aria2 的磁盘缓存可能让已标记完成的分片尚未落盘，因此下载完成前
+        上传的 part 会在结束时重新读取校验 CRC32，不一致的重新上传。
+        """
+        results: Dict[int, Dict] = {}
+        early_chunks: Dict[int, FileRange] = {}
+        remaining = list(self._iter_part_ranges(file_size, chunk_size))
+        batches: List[asyncio.Task] = []
+
+        pieces = None
+        try:
+            # 所有 part 提交后仍需等到下载完成，复核前数据必须已全部落盘
+            while remaining or pieces is None or not pieces.complete:
+                pieces = await wait_ready()
+                for batch in batches:
+                    if batch.done() and batch.exception():
+                        raise batch.exception()
+
+                ready = [r for r in remaining if pieces.has_range(r[1], r[2])]
+                if not ready:
+                    continue
+                ready_nos = {r[0] for r in ready}
+                remaining = [r for r in remaining if r[0] not in ready_nos]
+                logger.info(f"  边下边传: 提交 {len(ready)} 块，剩余 {len(remaining)} 块")
+                batches.append(asyncio.create_task(self._upload_parts(
+                    session, file_path, upload_id, filename, total_parts, progress,
+                    upload_session, schedule_key, ready, results,
+                    None if pieces.complete else early_chunks
+                )))
+            await asyncio.gather(*batches)
+        finally:
+            for batch in batches:
+                batch.cancel()
+            await asyncio.gather(*batches, return_exceptions=True)
+
+        # 复核下载完成前上传的 part
+        stale = []
+        for p_no, chunk in sorted(early_chunks.items()):
+            if chunk.crc32 is not None and chunk.crc32 != await chunk.checksum():
+                stale.append((p_no, chunk.offset, chunk.size))
+        if stale:
+            logger.warning(f"  {len(stale)} 个提前上传的块与最终文件不一致，重新上传: "
+                           f"{[r[0] for r in stale]}")
+            for p_no, _, size in stale:
+                upload_session.discard_part(p_no)
+                # 旧 part 已计入进度，重传完成时会再计入一次
+                if progress:
+                    progress.part_redo((upload_id, p_no), size)
+            self.upload_stats["parts_reuploaded"] += len(stale)
+            await self._upload_parts(
+                session, file_path, upload_id, filename, total_parts, progress,
+                upload_session, schedule_key, stale, results
+            )
+
+        return [results[k] for k in sorted(results.keys())]
 
     # ===========================================
     # 主上传入口 — 对标 driver.go 的 Put 方法
     # ===========================================
 
+    async def cleanup_upload(self, upload_id: str) -> None:
+        """删除 TelDrive 上的上传记录（放弃续传时调用）"""
+        session = await self._get_session()
+        await self._cleanup_upload(session, upload_id)
+
     async def upload_file_chunked(self, file_path: str, teldrive_path: str = "/",
-                                   progress_callback: Callable = None) -> dict:
+                                   progress: Optional[TransferProgress] = None,
+                                   upload_session: Optional[UploadSession] = None,
+                                   schedule_key: Optional[str] = None,
+                                   file_size: Optional[int] = None,
+                                   wait_ready: Optional[Callable] = None) -> dict:
         """上传文件到 TelDrive（完整流程）
 
         流程（参考 OpenList driver.go 的 Put 方法）：
-        1. 生成 upload_id (UUID)
+        1. 生成 upload_id (UUID)，或沿用 upload_session 的 upload_id 续传
         2. 查找并删除同名文件
         3. 初始化上传会话
         4. 空文件 → touch
-        5. 单块文件 → 串行上传
-        6. 多块文件 → 并发上传
-        7. 创建文件记录（含 parts 校验）
-        8. finally: 清理上传记录
+        5. 分块上传（part 由全局调度器派发，并发数为整个进程在传输中的 part 数）
+        6. 创建文件记录（含 parts 校验）
+        7. finally: 清理上传记录（续传会话仅在成功后清理，失败时保留已上传的 parts）
 
         Args:
             file_path: 本地文件路径
             teldrive_path: TelDrive 目标路径
-            progress_callback: 进度回调函数 (uploaded_bytes, total_bytes)
+            progress: 进度计数器，发送过程中只更新内存计数
+            upload_session: 可续传的上传会话，None 表示一次性上传
+            schedule_key: 调度分组（通常为任务 ID），同组文件共享公平份额
+            file_size: 文件最终大小（边下边传时文件尚未写完，由下载器提供）
+            wait_ready: 边下边传时返回分片完成情况的协程函数，见 _do_pipelined_upload
 
         Returns:
             上传结果 dict
@@ -485,73 +1098,102 @@ class TelDriveClient:
         if not file_path.exists():
             raise FileNotFoundError(f"文件不存在: {file_path}")
 
-        file_size = file_path.stat().st_size
+        if file_size is None:
+            file_size = file_path.stat().st_size
         filename = file_path.name
-        upload_id = str(uuid.uuid4())
+        # 未传入会话时使用一次性会话（失败后不保留已上传的 parts）
+        resumable = upload_session is not None
+        if not resumable:
+            upload_session = UploadSession(str(uuid.uuid4()), self.chunk_size)
+        upload_id = upload_session.upload_id
+        chunk_size = upload_session.chunk_size
 
-        total_parts = int(math.ceil(file_size / self.chunk_size)) if file_size > 0 else 0
+        total_parts = int(math.ceil(file_size / chunk_size)) if file_size > 0 else 0
 
+        resumed = len(upload_session.completed_parts)
         logger.info(f"开始上传: {filename} ({file_size} bytes, {total_parts} 块, "
-                     f"并发={self.upload_concurrency}, chunk={self.chunk_size_str})")
+                     f"并发={self.upload_concurrency}, chunk={chunk_size}"
+                     + (f", 续传已完成 {resumed} 块" if resumed else "") + ")")
 
-        # 确保目标目录存在
-        if teldrive_path != "/":
-            try:
-                await self.create_directory(teldrive_path)
-            except Exception:
-                pass
+        succeeded = False
+        session = await self._get_session()
+        # 进行中的上传计数，配置切换时旧客户端等上传结束再关闭连接池
+        self._active += 1
+        try:
+            # 确保目标目录存在（目录缓存命中时不发请求）
+            if teldrive_path != "/":
+                try:
+                    await self.ensure_directory(teldrive_path)
+                except Exception:
+                    pass
+
+            # 步骤 1: 查找并删除同名文件（对标 driver.go Put 中的逻辑）
+            existing_file = await self._find_existing(session, teldrive_path, filename)
+            if existing_file:
+                file_id = existing_file.get("id")
+                if file_id:
+                    logger.info(f"发现同名文件 {filename} (id={file_id})，删除后重新上传")
+                    await self._delete_file(session, file_id)
+
+            # 步骤 2: 初始化上传会话 — GET /api/uploads/{uploadId}
+            # 整个会话只拉取这一次 part 清单
+            upload_session.stale = True
+            await self._sync_manifest(session, upload_session)
+            logger.debug(f"初始化上传会话: 已有 {len(upload_session.manifest)} 块")
+
+            # 步骤 3: 空文件处理
+            if file_size == 0:
+                logger.info(f"空文件，直接创建记录")
+                result = await self._touch(session, filename, teldrive_path)
+                succeeded = bool(result.get("success"))
+                if succeeded:
+                    self._record_uploaded(teldrive_path, filename, result.get("data"))
+                return result
 
-        async with aiohttp.ClientSession(timeout=self.UPLOAD_TIMEOUT) as session:
-            try:
-                # 步骤 1: 查找并删除同名文件（对标 driver.go Put 中的逻辑）
-                existing_file = await self._find_file(session, teldrive_path, filename)
-                if existing_file:
-                    file_id = existing_file.get("id")
-                    if file_id:
-                        logger.info(f"发现同名文件 {filename} (id={file_id})，删除后重新上传")
-                        await self._delete_file(session, file_id)
-
-                # 步骤 2: 初始化上传会话 — GET /api/uploads/{uploadId}
-                async with session.get(
-                    f"{self.api_host}/api/uploads/{upload_id}",
-                    headers=self._get_headers()
-                ) as resp:
-                    logger.debug(f"初始化上传会话: HTTP {resp.status}")
-
-                # 步骤 3: 空文件处理
-                if file_size == 0:
-                    logger.info(f"空文件，直接创建记录")
-                    return await self._touch(session, filename, teldrive_path)
-
-                # 步骤 4: 上传分块
-                if total_parts <= 1:
-                    uploaded_parts = await self._do_single_upload(
-                        session, file_path, upload_id, filename,
-                        file_size, total_parts, progress_callback
-                    )
-                else:
-                    uploaded_parts = await self._do_multi_upload(
-                        session, file_path, upload_id, filename,
-                        file_size, total_parts, progress_callback
-                    )
-
-                # 步骤 5: 创建文件记录（含 parts 校验）
-                result = await self._create_file_record(
-                    session, filename, upload_id, teldrive_path,
-                    uploaded_parts, file_size
+            # 步骤 4: 上传分块（单块/多块都经全局调度器）
+            schedule_key = schedule_key or upload_id
+            if wait_ready:
+                # 边下边传：按下载进度分批提交
+                uploaded_parts = await self._do_pipelined_upload(
+                    session, file_path, upload_id, filename,
+                    file_size, total_parts, progress,
+                    chunk_size, upload_session, schedule_key, wait_ready
+                )
+            else:
+                uploaded_parts = await self._do_multi_upload(
+                    session, file_path, upload_id, filename,
+                    file_size, total_parts, progress,
+                    chunk_size, upload_session, schedule_key
                 )
 
-                if result.get("success"):
-                    logger.info(f"文件 {filename} 上传成功")
-                else:
-                    logger.error(f"文件 {filename} 创建记录失败: {result.get('error')}")
+            # 步骤 5: 创建文件记录（含 parts 校验）
+            result = await self._create_file_record(
+                session, filename, upload_session, teldrive_path,
+                uploaded_parts, file_size
+            )
 
-                return result
+            if result.get("success"):
+                succeeded = True
+                self._record_uploaded(teldrive_path, filename, result.get("data"))
+                logger.info(f"文件 {filename} 上传成功")
+            else:
+                logger.error(f"文件 {filename} 创建记录失败: {result.get('error')}")
+                # 目标目录可能已在 TelDrive 上被删除，下次重新确认
+                self.forget_directory(teldrive_path)
 
-            except Exception as e:
-                logger.error(f"上传文件失败: {e}")
-                return {"success": False, "error": str(e)}
+            return result
+
+        except Exception as e:
+            logger.error(f"上传文件失败: {e}")
+            return {"success": False, "error": str(e)}
 
+        finally:
+            # 步骤 6: 清理上传记录（对标 driver.go Put 的 defer）
+            # 续传会话失败时保留记录，下次用同一 upload_id 跳过已上传的 parts
+            try:
+                if succeeded or not resumable:
+                    await self._cleanup_upload(session, upload_id)
             finally:
-                # 步骤 6: 清理上传记录（对标 driver.go Put 的 defer）
-                await self._cleanup_upload(session, upload_id)
+                self._active -= 1
+                if not self._active:
+                    self._idle.set()
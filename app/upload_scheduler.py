@@ -0,0 +1,214 @@
+"""全局 part 上传调度器 - 所有任务、所有文件共享固定数量的上传 worker
+
+upload_concurrency 即同时在传输中的 part 数。每个文件的 part 以惰性迭代器提交，
+worker 空闲时才取出下一个 part，不会为每个 part 预先创建 asyncio.Task。
+任务之间按加权公平排队（WFQ）：每个任务组按已派发字节数 / 权重累计虚拟时间，
+总是从虚拟时间最小的组取下一个 part，大文件无法饿死小文件。
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (part 字节数, 返回协程的无参函数)
+PartJob = Tuple[int, Callable[[], Awaitable]]
+
+
+class _Flow:
+    """一个文件的 part 作业流"""
+
+    __slots__ = ("group", "jobs", "running", "future", "exhausted")
+
+    def __init__(self, group: "_Group", jobs: Iterator[PartJob], future: asyncio.Future):
+        self.group = group
+        self.jobs = jobs
+        self.running: set = set()
+        self.future = future
+        self.exhausted = False
+
+    @property
+    def ready(self) -> bool:
+        """还有未派发的 part 且未失败"""
+        return not self.exhausted and not self.future.done()
+
+
+class _Group:
+    """同一任务下的作业流，组内轮转派发"""
+
+    __slots__ = ("key", "weight", "vtime", "flows")
+
+    def __init__(self, key: str, weight: float, vtime: float):
+        self.key = key
+        self.weight = weight
+        self.vtime = vtime
+        self.flows: deque = deque()
+
+    def next_ready_flow(self) -> Optional[_Flow]:
+        for _ in range(len(self.flows)):
+            flow = self.flows[0]
+            self.flows.rotate(-1)
+            if flow.ready:
+                return flow
+        return None
+
+
+class PartScheduler:
+    """固定 worker 池 + 跨任务加权公平排队的 part 调度器"""
+
+    def __init__(self, workers: int = 4):
+        self.workers = max(1, workers)
+        self._groups: dict = {}
+        self._wakeup = asyncio.Event()
+        self._worker_tasks: set = set()
+        self._worker_count = 0
+        # 系统虚拟时间：最近一次派发时所选组的虚拟时间，新加入的组从这里起步
+        self._vclock = 0.0
+        self.stats = {"dispatched": 0, "completed": 0, "failed": 0}
+
+    def resize(self, workers: int):
+        """调整 worker 数（热更新 upload_concurrency）
+
+        尚未启动的调度器只记录 worker 数，首次 run() 时才创建 worker，
+        仅用于测试连接等不上传的客户端不会留下常驻任务。
+        """
+        self.workers = max(1, workers)
+        if self._worker_tasks:
+            self._ensure_workers()
+        self._wakeup.set()
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        while self._worker_count < self.workers:
+            self._worker_count += 1
+            task = loop.create_task(self._worker())
+            self._worker_tasks.add(task)
+            task.add_done_callback(self._worker_tasks.discard)
+
+    async def stop(self):
+        """停止所有 worker（进行中的 part 随之取消；可重复调用，之后的 run() 会重新启动）"""
+        tasks = list(self._worker_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_count = 0
+
+    async def run(self, group_key: str, jobs: Iterator[PartJob], weight: float = 1.0):
+        """提交一个文件的 part 作业流并等待全部完成
+
+        任一 part 失败时不再派发该流的后续 part，取消其进行中的 part 并抛出异常；
+        调用方被取消时同样取消该流。
+        """
+        loop = asyncio.get_running_loop()
+        self._ensure_workers()
+        group = self._groups.get(group_key)
+        if group is None:
+            group = _Group(group_key, weight, self._vclock)
+            self._groups[group_key] = group
+        flow = _Flow(group, iter(jobs), loop.create_future())
+        group.flows.append(flow)
+        self._wakeup.set()
+        try:
+            await flow.future
+        finally:
+            group.flows.remove(flow)
+            if not group.flows and self._groups.get(group_key) is group:
+                del self._groups[group_key]
+            if flow.running:
+                for task in flow.running:
+                    task.cancel()
+                await asyncio.gather(*flow.running, return_exceptions=True)
+
+    def _pick(self) -> Optional[Tuple[_Flow, Callable[[], Awaitable]]]:
+        """选出虚拟时间最小的组，组内轮转取下一个 part"""
+        while True:
+            best = None
+            best_flow = None
+            for group in self._groups.values():
+                if best is not None and group.vtime >= best.vtime:
+                    continue
+                flow = group.next_ready_flow()
+                if flow is not None:
+                    best, best_flow = group, flow
+            if best is None:
+                return None
+
+            try:
+                cost, job = next(best_flow.jobs)
+            except StopIteration:
+                best_flow.exhausted = True
+                self._maybe_complete(best_flow)
+                continue
+            except Exception as e:
+                self._fail(best_flow, e)
+                continue
+
+            self._vclock = best.vtime
+            best.vtime += max(cost, 1) / best.weight
+            return best_flow, job
+
+    async def _worker(self):
+        try:
+            while True:
+                if self._worker_count > self.workers:
+                    return  # 缩容
+                picked = self._pick()
+                if picked is None:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                flow, job = picked
+                self.stats["dispatched"] += 1
+                task = asyncio.ensure_future(job())
+                flow.running.add(task)
+                try:
+                    await asyncio.wait([task])
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                finally:
+                    flow.running.discard(task)
+                self._on_part_done(flow, task)
+        finally:
+            self._worker_count -= 1
+
+    def _on_part_done(self, flow: _Flow, task: asyncio.Task):
+        if task.cancelled():
+            # 由 run() 清理时取消的 part 不影响结果；其他原因被取消视为失败
+            if not flow.future.done():
+                self._fail(flow, Exception("上传块被取消"))
+            return
+        exc = task.exception()
+        if exc is not None:
+            self.stats["failed"] += 1
+            self._fail(flow, exc)
+            return
+        self.stats["completed"] += 1
+        self._maybe_complete(flow)
+
+    @staticmethod
+    def _fail(flow: _Flow, exc: BaseException):
+        if not flow.future.done():
+            flow.future.set_exception(exc)
+
+    @staticmethod
+    def _maybe_complete(flow: _Flow):
+        if flow.exhausted and not flow.running and not flow.future.done():
+            flow.future.set_result(None)
+
+    def is_queued(self, group_key: str) -> bool:
+        """该组有待派发的 part，但当前没有 part 在传输中（在排队等待 worker）"""
+        group = self._groups.get(group_key)
+        return group is not None and not any(flow.running for flow in group.flows)
+
+    def get_stats(self) -> dict:
+        """调度器统计：worker 数、在途 part、活跃任务组和作业流"""
+        stats = dict(self.stats)
+        stats["workers"] = self.workers
+        stats["in_flight"] = sum(len(f.running) for g in self._groups.values() for f in g.flows)
+        stats["groups"] = len(self._groups)
+        stats["flows"] = sum(len(g.flows) for g in self._groups.values())
+        return stats
@@ -0,0 +1,137 @@
+"""WebSocket 协议 v2 - 按 tick 合并的增量推送
+
+v1：每次任务变化立即推送一帧完整任务行（task_update）。
+v2：任务变化只做标记，每个 tick 汇总成一帧 batch，只包含各任务变化的字段；
+    定期推送非终态任务的完整快照（snapshot）用于纠正可能的偏差。
+    客户端可选 msgpack 二进制编码（需安装 msgpack，未安装时回退 JSON）。
+
+连接参数：/ws?v=2&enc=msgpack
+"""
+
+import json
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 2
+
+
+def encode_message(message: dict, encoding: str = "json"):
+    """序列化 WebSocket 消息：json 为 str（与 send_json 格式相同），msgpack 为 bytes"""
+    if encoding == "msgpack":
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def negotiate_encoding(requested: Optional[str]) -> str:
+    """客户端请求 msgpack 但服务端未安装时回退 JSON"""
+    if requested == "msgpack" and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+
+class TickBatcher:
+    """记录各任务上次推送的状态，按 tick 生成增量帧
+
+    所有 v2 客户端共享同一份基准状态：新客户端的 init 快照总是不旧于基准，
+    之后收到的增量只会重复设置它已有的值，不会丢失变化。
+    """
+
+    # 完整快照间隔（秒）
+    SNAPSHOT_INTERVAL = 30.0
+    # 每次更新都会变化、面板也不显示的字段，不进入增量（完整快照中仍包含）
+    DELTA_IGNORED = frozenset(("updated_at",))
+
+    def __init__(self, snapshot_interval: float = SNAPSHOT_INTERVAL):
+        self.snapshot_interval = snapshot_interval
+        self._sent: Dict[str, dict] = {}
+        self._dirty: set = set()
+        self._removed: set = set()
+        self._global_stat: Optional[dict] = None
+        self._last_snapshot = time.monotonic()
+        self.seq = 0
+        self.stats = {"batches": 0, "snapshots": 0, "fields": 0}
+
+    def mark(self, task_id: str):
+        self._dirty.add(task_id)
+        self._removed.discard(task_id)
+
+    def mark_removed(self, task_id: str):
+        # 客户端可能只从 init 快照里见过该任务，总是通知删除
+        self._dirty.discard(task_id)
+        self._removed.add(task_id)
+
+    def set_global_stat(self, data: dict):
+        self._global_stat = data
+
+    def reset(self):
+        """没有 v2 客户端时清空基准，不再维护增量"""
+        self._sent.clear()
+        self._dirty.clear()
+        self._removed.clear()
+        self._global_stat = None
+
+    def snapshot_due(self, now: float) -> bool:
+        return now - self._last_snapshot >= self.snapshot_interval
+
+    def build_batch(self, get_task) -> Optional[dict]:
+        """汇总本 tick 的变化；没有变化时返回 None
+
+        Args:
+            get_task: task_id -> 当前任务 dict（已删除返回 None）
+        """
+        tasks = {}
+        for task_id in self._dirty:
+            current = get_task(task_id)
+            if current is None:
+                self._removed.add(task_id)
+                continue
+            previous = self._sent.get(task_id)
+            if previous is None:
+                delta = dict(current)
+            else:
+                delta = {k: v for k, v in current.items()
+                         if k not in self.DELTA_IGNORED and previous.get(k) != v}
+            if delta:
+                tasks[task_id] = delta
+                self._sent[task_id] = dict(current)
+                self.stats["fields"] += len(delta)
+        self._dirty.clear()
+
+        removed = list(self._removed)
+        self._removed.clear()
+        for task_id in removed:
+            self._sent.pop(task_id, None)
+
+        if not tasks and not removed and self._global_stat is None:
+            return None
+        self.seq += 1
+        self.stats["batches"] += 1
+        frame = {"type": "batch", "seq": self.seq}
+        if tasks:
+            frame["tasks"] = tasks
+        if removed:
+            frame["removed"] = removed
+        if self._global_stat is not None:
+            frame["global_stat"] = self._global_stat
+            self._global_stat = None
+        return frame
+
+    def build_snapshot(self, tasks: Iterable[dict], now: float) -> dict:
+        """完整快照：基准重置为快照中的任务（其余任务下次变化时发送完整字段）
+
+        待发送的变化和删除不在此清除：快照只含非终态任务，
+        刚结束或被删除的任务仍由下一帧 batch 通知。
+        """
+        self._sent = {t["task_id"]: dict(t) for t in tasks}
+        self._last_snapshot = now
+        self.seq += 1
+        self.stats["snapshots"] += 1
+        return {"type": "snapshot", "seq": self.seq, "tasks": list(self._sent.values())}
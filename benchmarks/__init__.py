@@ -0,0 +1 @@
+"""上传链路性能测试：本地模拟 TelDrive 服务端 + 测试脚本"""
@@ -0,0 +1,274 @@
+"""本地模拟 TelDrive 服务端 - 用于上传性能测试，不需要真实的 TelDrive / Telegram
+
+实现客户端用到的接口：
+    GET/POST/DELETE /api/uploads/{id}     part 清单 / 上传 part / 清理上传记录
+    GET/POST        /api/files            列目录（支持分页）/ 创建文件记录
+    GET             /api/files/{id}       文件详情
+    POST            /api/files/mkdir      创建目录
+    POST            /api/files/delete     删除文件
+    GET             /api/auth/session     连接测试
+
+可模拟网络条件：
+    latency      每个请求的固定延迟（秒），jitter 为额外的随机延迟上限
+    bandwidth    所有连接共享的上行带宽（字节/秒），0 = 不限
+    error_rate   part 上传在收完数据后返回 HTTP 500 的概率
+
+另有 GET /_bench/stats 和 POST /_bench/reset 供测试脚本读取/清零请求计数。
+
+独立运行：
+    python -m benchmarks.fake_teldrive --port 8080 --latency 0.02 --bandwidth 50M
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+# 读取 part 请求体的块大小
+READ_BLOCK = 1024 * 1024
+
+
+def parse_size(text: str) -> int:
+    """'500M' / '2G' / '64K' / '1048576' -> 字节数"""
+    text = str(text).strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+class _Bandwidth:
+    """所有连接共享的带宽限制：按到达顺序预约发送时间"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = 0.0
+
+    async def consume(self, n: int):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self._next)
+        self._next = start + n / self.rate
+        delay = self._next - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FakeTelDrive:
+    """内存中的 TelDrive：文件、目录和上传会话都不落盘，part 数据只计数不保存"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 bandwidth: float = 0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = _Bandwidth(bandwidth)
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self.uploads: Dict[str, list] = {}
+        self.files: Dict[str, dict] = {}
+        self.dirs = {"/"}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests: Dict[str, int] = {}
+        self.bytes_received = 0
+        self.errors_injected = 0
+
+    def get_stats(self) -> dict:
+        return {
+            "requests": dict(self.requests),
+            "requests_total": sum(self.requests.values()),
+            "bytes_received": self.bytes_received,
+            "errors_injected": self.errors_injected,
+        }
+
+    def _next_id(self) -> str:
+        return str(next(self._ids))
+
+    # ===========================================
+    # 应用与中间件
+    # ===========================================
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=1 << 40, middlewares=[self._middleware])
+        app.router.add_get("/api/uploads/{id}", self.get_parts)
+        app.router.add_post("/api/uploads/{id}", self.post_part)
+        app.router.add_delete("/api/uploads/{id}", self.delete_upload)
+        app.router.add_get("/api/files", self.list_files)
+        app.router.add_post("/api/files", self.create_file)
+        app.router.add_post("/api/files/mkdir", self.mkdir)
+        app.router.add_post("/api/files/delete", self.delete_files)
+        app.router.add_get("/api/files/{id}", self.get_file)
+        app.router.add_get("/api/auth/session", self.session)
+        app.router.add_get("/_bench/stats", self.bench_stats)
+        app.router.add_post("/_bench/reset", self.bench_reset)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        if request.path.startswith("/_bench/"):
+            return await handler(request)
+        route = request.match_info.route.resource
+        key = f"{request.method} {route.canonical if route else request.path}"
+        self.requests[key] = self.requests.get(key, 0) + 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await handler(request)
+
+    # ===========================================
+    # 上传
+    # ===========================================
+
+    async def get_parts(self, request: web.Request):
+        return web.json_response(self.uploads.get(request.match_info["id"], []))
+
+    async def post_part(self, request: web.Request):
+        size = 0
+        async for block in request.content.iter_chunked(READ_BLOCK):
+            size += len(block)
+            await self.bandwidth.consume(len(block))
+        self.bytes_received += size
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors_injected += 1
+            return web.Response(status=500, text="injected error")
+        part_no = int(request.query.get("partNo", 0))
+        part = {
+            "name": request.query.get("partName", ""),
+            "partId": int(self._next_id()),
+            "partNo": part_no,
+            "size": size,
+            "channelId": 1,
+        }
+        parts = self.uploads.setdefault(request.match_info["id"], [])
+        # 同一 partNo 重传时覆盖旧记录
+        parts[:] = [p for p in parts if p["partNo"] != part_no]
+        parts.append(part)
+        return web.json_response(part)
+
+    async def delete_upload(self, request: web.Request):
+        self.uploads.pop(request.match_info["id"], None)
+        return web.Response(status=200)
+
+    # ===========================================
+    # 文件与目录
+    # ===========================================
+
+    async def list_files(self, request: web.Request):
+        path = request.query.get("path", "/")
+        name = request.query.get("name")
+        items = [f for f in self.files.values()
+                 if f["path"] == path and (not name or f["name"] == name)]
+        items += [{"id": f"dir:{d}", "name": d.rsplit("/", 1)[-1], "type": "folder",
+                   "path": path} for d in self.dirs
+                  if d != "/" and d.rsplit("/", 1)[0] == path.rstrip("/")
+                  and (not name or d.endswith("/" + name))]
+        kind = request.query.get("type")
+        if kind:
+            items = [i for i in items if i.get("type", "file") == kind]
+        page = int(request.query.get("page", 1))
+        limit = int(request.query.get("limit", 0)) or max(1, len(items))
+        total_pages = max(1, -(-len(items) // limit))
+        return web.json_response({
+            "items": items[(page - 1) * limit:page * limit],
+            "meta": {"count": len(items), "totalPages": total_pages, "currentPage": page},
+        })
+
+    async def create_file(self, request: web.Request):
+        data = await request.json()
+        data["id"] = self._next_id()
+        data.setdefault("type", "file")
+        self.files[data["id"]] = data
+        return web.json_response(data, status=201)
+
+    async def get_file(self, request: web.Request):
+        item = self.files.get(request.match_info["id"])
+        if item is None:
+            return web.json_response({"message": "file not found"}, status=404)
+        return web.json_response(item)
+
+    async def mkdir(self, request: web.Request):
+        data = await request.json()
+        path = "/" + data.get("path", "").strip("/")
+        # 逐级创建父目录（与 TelDrive 一致）
+        while path not in self.dirs:
+            self.dirs.add(path)
+            path = path.rsplit("/", 1)[0] or "/"
+        return web.Response(status=201)
+
+    async def delete_files(self, request: web.Request):
+        data = await request.json()
+        for file_id in data.get("ids", []):
+            self.files.pop(file_id, None)
+        return web.Response(status=204)
+
+    async def session(self, request: web.Request):
+        return web.json_response({"userName": "bench"})
+
+    # ===========================================
+    # 测试脚本接口
+    # ===========================================
+
+    async def bench_stats(self, request: web.Request):
+        return web.json_response(self.get_stats())
+
+    async def bench_reset(self, request: web.Request):
+        self.reset_stats()
+        return web.Response(status=204)
+
+
+async def start_server(fake: FakeTelDrive, host: str = "127.0.0.1",
+                       port: int = 0) -> tuple:
+    """启动服务，返回 (runner, 实际地址)；port=0 时由系统分配"""
+    runner = web.AppRunner(fake.make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+def add_network_arguments(parser: argparse.ArgumentParser):
+    """模拟网络条件的命令行参数（与 upload_bench 共用）"""
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="额外随机延迟上限（秒）")
+    parser.add_argument("--bandwidth", default="0", help="共享上行带宽，如 50M（字节/秒），0=不限")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="part 上传失败概率")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+
+
+def fake_from_args(args) -> FakeTelDrive:
+    return FakeTelDrive(latency=args.latency, jitter=args.jitter,
+                        bandwidth=parse_size(args.bandwidth),
+                        error_rate=args.error_rate, seed=args.seed)
+
+
+async def _serve_forever(args):
+    runner, url = await start_server(fake_from_args(args), args.host, args.port)
+    print(f"Fake TelDrive 已启动: {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 TelDrive 服务端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_network_arguments(parser)
+    try:
+        asyncio.run(_serve_forever(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
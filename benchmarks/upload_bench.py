@@ -0,0 +1,289 @@
+"""上传链路性能测试 - 对本地模拟 TelDrive 跑 chunk 大小 × 并发 × 文件数 × 文件大小 的组合
+
+两种模式：
+    file  逐个调用 TelDriveClient.upload_file_chunked（单文件链路）
+    dir   调用 TaskManager._upload_directory 上传整个目录（多文件并发、目录缓存、列表预取）
+
+每个组合在独立的子进程中运行，峰值 RSS 和 CPU 时间互不影响；模拟服务端运行在主进程，
+其开销不计入结果。结果以 JSON 输出（--output 指定文件，默认 stdout），汇总表打印到 stderr。
+
+示例：
+    python -m benchmarks.upload_bench --mode file,dir --file-sizes 64M --file-counts 1,16 \\
+        --chunk-sizes 8M,32M --concurrency 1,4,8 --latency 0.005 --output results.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import List
+
+from benchmarks.fake_teldrive import (
+    add_network_arguments, fake_from_args, parse_size, start_server)
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# 生成测试文件的写入块：随机内容重复写入，避免逐字节生成随机数
+DATA_BLOCK = 1024 * 1024
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_dataset(root: Path, file_size: int, file_count: int) -> Path:
+    """生成 file_count 个 file_size 字节的文件（分散到几个子目录，模拟文件夹任务）"""
+    data_dir = root / f"data_{file_size}_{file_count}"
+    if data_dir.exists():
+        return data_dir
+    block = os.urandom(DATA_BLOCK)
+    for i in range(file_count):
+        sub = data_dir / f"d{i % 4}"
+        sub.mkdir(parents=True, exist_ok=True)
+        with open(sub / f"f{i:05d}.bin", "wb") as f:
+            # 文件头写入序号，各文件内容不同
+            f.write(i.to_bytes(8, "big"))
+            remaining = file_size - 8
+            while remaining > 0:
+                n = min(remaining, DATA_BLOCK)
+                f.write(block[:n])
+                remaining -= n
+    return data_dir
+
+
+# ===========================================
+# 子进程：运行单个组合
+# ===========================================
+
+def run_case(case: dict, api_host: str, data_dir: str, work_dir: str) -> dict:
+    """在子进程中执行一个组合（模块级函数，供 spawn 进程池调用）"""
+    # 必须在导入 app 之前设置：配置文件路径在 app.config 导入时确定
+    os.environ["CONFIG_PATH"] = os.path.join(work_dir, "config.toml")
+    sys.path.insert(0, str(PROJECT_ROOT))
+    logging.basicConfig(level=logging.WARNING)
+    return asyncio.run(_run_case(case, api_host, data_dir, work_dir))
+
+
+async def _run_case(case: dict, api_host: str, data_dir: str, work_dir: str) -> dict:
+    from app import database as db
+    from app.task_manager import TaskManager
+    from app.teldrive_client import TelDriveClient
+
+    db.DB_PATH = Path(work_dir) / "bench.db"
+    await db.init_db()
+    db.start_writer()
+
+    files = sorted(str(p) for p in Path(data_dir).rglob("*") if p.is_file())
+    total_bytes = sum(os.path.getsize(p) for p in files)
+    chunk_size = parse_size(case["chunk_size"])
+    result = {"ok": False, "error": None}
+
+    tm = None
+    client = None
+    rss_baseline = _peak_rss_bytes()
+    cpu_start = _cpu_seconds()
+    start = time.perf_counter()
+    try:
+        if case["mode"] == "file":
+            client = TelDriveClient(api_host=api_host, access_token="bench",
+                                    upload_concurrency=case["concurrency"])
+            # 测试任意 chunk 大小，不受配置可选值限制
+            client.chunk_size = chunk_size
+            for path in files:
+                rel = os.path.relpath(os.path.dirname(path), data_dir)
+                uploaded = await client.upload_file_chunked(path, f"/bench/{rel}")
+                if not uploaded.get("success"):
+                    raise RuntimeError(f"上传失败: {uploaded}")
+            stats = client.get_upload_stats()
+        else:
+            tm = TaskManager()
+            td = tm.config["teldrive"]
+            td.update(api_host=api_host, access_token="bench",
+                      upload_concurrency=case["concurrency"],
+                      file_concurrency=case["file_concurrency"])
+            tm._init_clients()
+            tm.teldrive.chunk_size = chunk_size
+            await tm._add_task("bench", "bench://", os.path.basename(data_dir))
+            await tm._upload_directory("bench", data_dir, "/bench")
+            status = tm.store.get("bench").status
+            if status != "completed":
+                raise RuntimeError(f"任务状态: {status} {tm.store.get('bench').error}")
+            stats = tm.teldrive.get_upload_stats()
+        result["ok"] = True
+    except Exception as e:
+        stats = {}
+        result["error"] = str(e)
+    elapsed = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu_start
+    peak_rss = _peak_rss_bytes()
+
+    if tm is not None:
+        await tm.teldrive.close()
+        await tm.part_scheduler.stop()
+    if client is not None:
+        await client.close()
+    await db.close_db()
+
+    gb = total_bytes / 1024 ** 3
+    result.update({
+        "bytes": total_bytes,
+        "seconds": round(elapsed, 4),
+        "mb_per_s": round(total_bytes / 1024 ** 2 / elapsed, 2) if elapsed > 0 else None,
+        "cpu_seconds": round(cpu, 4),
+        "cpu_seconds_per_gb": round(cpu / gb, 4) if gb > 0 else None,
+        "peak_rss_mb": round(peak_rss / 1024 ** 2, 1),
+        "baseline_rss_mb": round(rss_baseline / 1024 ** 2, 1),
+        "client_stats": stats,
+    })
+    return result
+
+
+# ===========================================
+# 主进程：组合矩阵、模拟服务端、汇总
+# ===========================================
+
+def build_cases(args) -> List[dict]:
+    cases = []
+    for mode, size, count, chunk, conc in itertools.product(
+            args.mode, args.file_sizes, args.file_counts, args.chunk_sizes, args.concurrency):
+        cases.append({
+            "mode": mode,
+            "file_size": parse_size(size),
+            "file_count": count,
+            "chunk_size": chunk,
+            "concurrency": conc,
+            "file_concurrency": args.file_concurrency if mode == "dir" else 1,
+        })
+    return cases
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ""
+
+
+def _print_summary(results: List[dict]):
+    header = (f"{'mode':<5}{'size':>10}{'files':>7}{'chunk':>7}{'conc':>6}"
+              f"{'MB/s':>10}{'rss MB':>9}{'cpu s/GB':>10}{'req/file':>10}  ok")
+    print(header, file=sys.stderr)
+    for r in results:
+        print(f"{r['mode']:<5}{r['file_size']:>10}{r['file_count']:>7}{r['chunk_size']:>7}"
+              f"{r['concurrency']:>6}{r['mb_per_s'] or 0:>10.1f}{r['peak_rss_mb']:>9.1f}"
+              f"{r['cpu_seconds_per_gb'] or 0:>10.2f}{r['requests_per_file']:>10.1f}  "
+              f"{'yes' if r['ok'] else 'NO: ' + str(r['error'])}", file=sys.stderr)
+
+
+async def run_benchmarks(args) -> dict:
+    fake = fake_from_args(args)
+    runner, api_host = await start_server(fake)
+    loop = asyncio.get_running_loop()
+    root = Path(tempfile.mkdtemp(prefix="upload_bench_"))
+    results = []
+    try:
+        for case in build_cases(args):
+            data_dir = make_dataset(root, case["file_size"], case["file_count"])
+            for repeat in range(args.repeat):
+                work_dir = tempfile.mkdtemp(dir=root)
+                fake.reset_stats()
+                # 每个组合一个全新进程：峰值 RSS / CPU 只反映本组合
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    outcome = await loop.run_in_executor(
+                        pool, run_case, case, api_host, str(data_dir), work_dir)
+                server = fake.get_stats()
+                entry = dict(case, repeat=repeat, **outcome)
+                entry["requests"] = server["requests"]
+                entry["requests_total"] = server["requests_total"]
+                entry["requests_per_file"] = round(
+                    server["requests_total"] / case["file_count"], 2)
+                entry["errors_injected"] = server["errors_injected"]
+                results.append(entry)
+                shutil.rmtree(work_dir, ignore_errors=True)
+                print(f"[{len(results)}] {case['mode']} size={case['file_size']} "
+                      f"files={case['file_count']} chunk={case['chunk_size']} "
+                      f"conc={case['concurrency']}: {entry['mb_per_s']} MB/s",
+                      file=sys.stderr)
+    finally:
+        await runner.cleanup()
+        if not args.keep_data:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "server": {
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "bandwidth": parse_size(args.bandwidth),
+            "error_rate": args.error_rate,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def _csv(cast):
+    return lambda text: [cast(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上传链路性能测试（本地模拟 TelDrive）")
+    parser.add_argument("--mode", type=_csv(str), default=["file", "dir"],
+                        help="file,dir")
+    parser.add_argument("--file-sizes", type=_csv(str), default=["64M"],
+                        help="文件大小列表，如 1M,64M,512M")
+    parser.add_argument("--file-counts", type=_csv(int), default=[1, 8],
+                        help="文件数列表")
+    parser.add_argument("--chunk-sizes", type=_csv(str), default=["8M", "32M"],
+                        help="chunk 大小列表（任意大小，不限于配置可选值）")
+    parser.add_argument("--concurrency", type=_csv(int), default=[1, 4, 8],
+                        help="upload_concurrency 列表（同时传输中的 part 数）")
+    parser.add_argument("--file-concurrency", type=int, default=3,
+                        help="dir 模式同时上传的文件数")
+    parser.add_argument("--repeat", type=int, default=1, help="每个组合重复次数")
+    parser.add_argument("--output", help="结果 JSON 文件，默认输出到 stdout")
+    parser.add_argument("--keep-data", action="store_true", help="保留生成的测试文件")
+    add_network_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmarks(args))
+    _print_summary(report["results"])
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    failed = sum(1 for r in report["results"] if not r["ok"])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
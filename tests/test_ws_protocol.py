@@ -0,0 +1,55 @@
+"""TickBatcher 增量帧与快照的交互"""
+
+from app.ws_protocol import TickBatcher
+
+
+def _task(task_id: str, status: str, **fields) -> dict:
+    return dict({"task_id": task_id, "status": status}, **fields)
+
+
+def test_removal_survives_snapshot_in_same_tick():
+    """同一 tick 内先删除任务再生成快照，删除仍由之后的 batch 通知"""
+    batcher = TickBatcher()
+    tasks = {"a": _task("a", "downloading"), "b": _task("b", "downloading")}
+    batcher.mark("a")
+    batcher.mark("b")
+    batcher.build_batch(tasks.get)
+
+    del tasks["b"]
+    batcher.mark_removed("b")
+    snapshot = batcher.build_snapshot(list(tasks.values()), now=100.0)
+    assert [t["task_id"] for t in snapshot["tasks"]] == ["a"]
+
+    batch = batcher.build_batch(tasks.get)
+    assert batch is not None
+    assert batch["removed"] == ["b"]
+    assert "tasks" not in batch
+
+
+def test_terminal_change_survives_snapshot_in_same_tick():
+    """快照只含非终态任务，同一 tick 内结束的任务仍以完整字段发出"""
+    batcher = TickBatcher()
+    tasks = {"a": _task("a", "uploading", upload_progress=50.0)}
+    batcher.mark("a")
+    batcher.build_batch(tasks.get)
+
+    tasks["a"] = _task("a", "completed", upload_progress=100.0)
+    batcher.mark("a")
+    snapshot = batcher.build_snapshot([], now=100.0)
+    assert snapshot["tasks"] == []
+
+    batch = batcher.build_batch(tasks.get)
+    assert batch["tasks"] == {"a": tasks["a"]}
+
+
+def test_snapshot_resets_delta_baseline():
+    """快照中已包含的最新状态不会在随后的 batch 中重复发送"""
+    batcher = TickBatcher()
+    tasks = {"a": _task("a", "downloading", download_progress=10.0)}
+    batcher.mark("a")
+    batcher.build_batch(tasks.get)
+
+    tasks["a"] = _task("a", "downloading", download_progress=20.0)
+    batcher.mark("a")
+    batcher.build_snapshot(list(tasks.values()), now=100.0)
+    assert batcher.build_batch(tasks.get) is None